@@ -0,0 +1,38 @@
+import os
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.ml.predictor import MODEL_PATH
+from app.services.auth import require_admin
+from app.workers.inference_worker import reload_model
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+def _model_file(name: Optional[str]) -> Optional[str]:
+    """
+    A file in ML_MODEL_PATH's directory, or None for ML_MODEL_PATH itself.
+    Anything resolving outside that directory is refused.
+    """
+    if not name:
+        return None
+    model_dir = os.path.realpath(os.path.dirname(MODEL_PATH) or ".")
+    path = os.path.realpath(os.path.join(model_dir, name))
+    if os.path.dirname(path) != model_dir:
+        raise HTTPException(status_code=422, detail="path must name a file in the model directory")
+    return path
+
+
+@router.post("/model/reload")
+async def admin_reload_model(path: str = Query(None)):
+    """
+    Hot-reload the crash model (default: ML_MODEL_PATH; `path` picks another
+    file in the same directory). Returns once the new model is loaded, warmed
+    up and live; on failure the old model keeps serving.
+    """
+    model_path = _model_file(path)
+    try:
+        version = await reload_model(model_path)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Model reload failed: {e}")
+    return {"status": "ok", "model_version": version}
@@ -5,10 +5,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from datetime import datetime
 
-from app.models.schemas import DeviceRead, DeviceCreate
+from app.models.schemas import DeviceRead, DeviceCreate, GeoFenceIn, GeoFenceOut
 from app.database.connection import get_db
 from app.services.auth import get_current_user_uid
 from app.repositories.devices_repo import DevicesRepo
+from app.repositories.geofences_repo import create_fence, delete_fence, get_fence, list_device_fences
+from app.services.geofence import geofences
 
 router = APIRouter()
 
@@ -74,3 +76,93 @@ async def get_device_details(
         raise HTTPException(status_code=403, detail="Not authorized to view this device")
         
     return device
+
+
+# --- Geo-fences ---
+
+async def _owned_device(db: AsyncSession, device_id: str, uid: str):
+    device = await DevicesRepo.get_device(db, device_id)
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    if device.user_id != uid:
+        raise HTTPException(status_code=403, detail="Not authorized to manage this device")
+    return device
+
+
+async def _owned_fence(db: AsyncSession, device_id: str, fence_id: str, uid: str):
+    await _owned_device(db, device_id, uid)
+    fence = await get_fence(db, fence_id)
+    if not fence or fence.device_id != device_id:
+        raise HTTPException(status_code=404, detail="Fence not found")
+    return fence
+
+
+def _fence_out(fence) -> GeoFenceOut:
+    out = GeoFenceOut.model_validate(fence)
+    out.inside = geofences.inside(fence.device_id, fence.fence_id)
+    return out
+
+
+@router.get("/{device_id}/fences", response_model=List[GeoFenceOut])
+async def list_device_fences_endpoint(
+    device_id: str,
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    List the device's geo-fences, with whether it is inside each right now.
+    """
+    await _owned_device(db, device_id, uid)
+    return [_fence_out(f) for f in await list_device_fences(db, device_id)]
+
+@router.post("/{device_id}/fences", response_model=GeoFenceOut, status_code=status.HTTP_201_CREATED)
+async def create_device_fence(
+    device_id: str,
+    fence_in: GeoFenceIn,
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Add a circle or polygon fence. Entering/leaving it raises a geo_fence alert.
+    """
+    await _owned_device(db, device_id, uid)
+    fence = await create_fence(db, uid, device_id, **fence_in.model_dump(mode="json"))
+    await db.commit()
+    await db.refresh(fence)
+    geofences.upsert(fence)
+    return _fence_out(fence)
+
+@router.put("/{device_id}/fences/{fence_id}", response_model=GeoFenceOut)
+async def update_device_fence(
+    device_id: str,
+    fence_id: str,
+    fence_in: GeoFenceIn,
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Replace a fence's shape and settings.
+    """
+    fence = await _owned_fence(db, device_id, fence_id, uid)
+    for field, value in fence_in.model_dump(mode="json").items():
+        setattr(fence, field, value)
+    await db.commit()
+    await db.refresh(fence)
+    geofences.upsert(fence)
+    return _fence_out(fence)
+
+@router.delete("/{device_id}/fences/{fence_id}")
+async def delete_device_fence(
+    device_id: str,
+    fence_id: str,
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Delete a fence.
+    """
+    await _owned_fence(db, device_id, fence_id, uid)
+    await delete_fence(db, fence_id)
+    await db.commit()
+    geofences.remove(fence_id)
+    return {"status": "deleted", "fence_id": fence_id}
@@ -1,14 +1,22 @@
 # app/api/endpoints/trips.py
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from datetime import datetime
 
-from app.models.schemas import TripSummaryOut, TripDetailOut, RoutePoint, TripDataRead
+from app.models.schemas import TripSummaryOut, TripDetailOut, TripNearOut, RoutePoint, TripDataRead
 from app.database.connection import get_db
 from app.services.auth import get_current_user_uid
 from app.repositories.trips_repo import TripsRepo
+from app.services.geo_index import MAX_BBOX_SPAN_DEG, trips_near, trips_within
+from app.services.route_service import (
+    BINARY_MEDIA_TYPE, POLYLINE_MEDIA_TYPE,
+    binary_payload, load_route, negotiate_format, polyline_payload,
+)
+from app.services.compression import RESAMPLE_COLUMNS, resample
+from app.services.timeline import NDJSON_MEDIA_TYPE, timeline_ndjson
 import app.repositories.telemetry_repo as TelemetryRepo
 
 router = APIRouter()
@@ -45,6 +53,68 @@ async def list_my_trips(
         ) for t in trips
     ]
 
+@router.get("/near", response_model=List[TripNearOut])
+async def list_trips_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_m: float = Query(500, gt=0, le=10_000),
+    limit: int = Query(50, ge=1, le=500),
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    My trips that passed within radius_m of a point, nearest first.
+    """
+    near = await trips_near(db, uid, lat, lng, radius_m, limit)
+    if not near:
+        return []
+    trips = {t.trip_id: t for t in await TripsRepo.get_trips(db, [n["trip_id"] for n in near])}
+    return [
+        TripNearOut(
+            trip_id=t.trip_id,
+            device_id=t.device_id,
+            start_time=t.start_time,
+            end_time=t.end_time,
+            total_distance=t.total_distance,
+            average_speed=t.average_speed,
+            status=t.status,
+            distance_m=n["distance_m"],
+            closest_ts=n["ts"],
+        )
+        for n in near if (t := trips.get(n["trip_id"])) is not None
+    ]
+
+@router.get("/within", response_model=List[TripSummaryOut])
+async def list_trips_within(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lng: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lng: float = Query(..., ge=-180, le=180),
+    starting: bool = Query(False, description="Only trips that started in the box"),
+    limit: int = Query(50, ge=1, le=500),
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    My trips that passed through (or started in) a bounding box, newest first.
+    """
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=422, detail="min_lat/min_lng must not exceed max_lat/max_lng")
+    if max_lat - min_lat > MAX_BBOX_SPAN_DEG or max_lng - min_lng > MAX_BBOX_SPAN_DEG:
+        raise HTTPException(status_code=422, detail=f"box may span at most {MAX_BBOX_SPAN_DEG} degrees each way")
+    trips = await trips_within(db, uid, (min_lat, min_lng, max_lat, max_lng), starting, limit)
+    return [
+        TripSummaryOut(
+            trip_id=t.trip_id,
+            device_id=t.device_id,
+            start_time=t.start_time,
+            end_time=t.end_time,
+            total_distance=t.total_distance,
+            average_speed=t.average_speed,
+            status=t.status
+        ) for t in trips
+    ]
+
 @router.get("/{trip_id}", response_model=TripDetailOut)
 async def get_trip_details(
     trip_id: str,
@@ -80,11 +150,18 @@ async def get_trip_details(
 @router.get("/{trip_id}/route", response_model=List[RoutePoint])
 async def get_trip_route(
     trip_id: str,
+    zoom: Optional[int] = Query(None, ge=0, le=22, description="Map zoom level to simplify for"),
+    tolerance: Optional[float] = Query(None, gt=0, description="Max deviation in metres"),
+    format: Optional[str] = Query(None, pattern="^(json|polyline|binary)$"),
+    accept: Optional[str] = Header(None),
     uid: str = Depends(get_current_user_uid),
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Get the full GPS route for a trip.
+    Get the GPS route for a trip: every point, or simplified (Douglas-Peucker)
+    for a map zoom level or a tolerance in metres.
+    Representation by ?format= or Accept: JSON points (default), an encoded
+    polyline with delta-encoded timestamps, or packed float32 records.
     """
     trip = await TripsRepo.get_trip(db, trip_id)
     if not trip:
@@ -93,16 +170,26 @@ async def get_trip_route(
     if trip.user_id != uid:
         raise HTTPException(status_code=403, detail="Not authorized to view this trip")
         
-    # Fetch route points
-    points = await TripsRepo.get_trip_route_points(db, trip_id)
-    
+    # Fetch route points (simplified ones are cached once the trip is closed)
+    route = await load_route(
+        db, trip_id,
+        cacheable=trip.status != "recording",
+        zoom=zoom,
+        tolerance_m=tolerance,
+        ref_lat=trip.start_lat,
+    )
+
+    # Compact formats are built straight from the column arrays
+    fmt = negotiate_format(format, accept)
+    if fmt == "polyline":
+        return JSONResponse(polyline_payload(trip_id, route), media_type=POLYLINE_MEDIA_TYPE)
+    if fmt == "binary":
+        body, headers = binary_payload(route)
+        return Response(body, media_type=BINARY_MEDIA_TYPE, headers=headers)
+
     return [
-        RoutePoint(
-            lat=p.lat,
-            lng=p.lng,
-            ts=p.timestamp,
-            speed=p.speed
-        ) for p in points
+        RoutePoint(lat=lat, lng=lng, ts=ts, speed=speed)
+        for ts, lat, lng, speed in zip(route.ts, route.lat.tolist(), route.lng.tolist(), route.speed_list())
     ]
 
 @router.get("/{trip_id}/metrics", response_model=List[TripDataRead])
@@ -126,3 +213,51 @@ async def get_trip_metrics(
     # Fetch telemetry
     data = await TelemetryRepo.get_range_for_trip(db, trip_id, limit=limit, offset=offset)
     return data
+
+@router.get("/{trip_id}/samples")
+async def get_trip_samples(
+    trip_id: str,
+    hz: float = Query(1.0, gt=0, le=50, description="Output rate in samples per second"),
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Telemetry columns on a uniform time grid of `hz`. With telemetry
+    compression on, skipped samples are rebuilt within its error bounds
+    (position/speed interpolated, heart rate and IMU held).
+    """
+    trip = await TripsRepo.get_trip(db, trip_id)
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+    if trip.user_id != uid:
+        raise HTTPException(status_code=403, detail="Not authorized to view this trip")
+
+    rows = await TelemetryRepo.get_trip_columns(db, trip_id, RESAMPLE_COLUMNS)
+    try:
+        out = resample(rows, hz)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"trip_id": trip_id, **out}
+
+@router.get("/{trip_id}/timeline")
+async def get_trip_timeline(
+    trip_id: str,
+    hz: Optional[float] = Query(None, gt=0, le=50, description="Downsample telemetry to this rate"),
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Replay stream: the trip's telemetry and alerts merged in time order, one
+    JSON object per line (type telemetry / alert), then a final "end" line.
+    With ?hz= telemetry is thinned to the first sample per 1/hz seconds;
+    crash-flagged samples are always kept.
+    """
+    trip = await TripsRepo.get_trip(db, trip_id)
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+    if trip.user_id != uid:
+        raise HTTPException(status_code=403, detail="Not authorized to view this trip")
+
+    return StreamingResponse(timeline_ndjson(trip_id, hz), media_type=NDJSON_MEDIA_TYPE)
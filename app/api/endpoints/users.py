@@ -1,13 +1,14 @@
 # app/api/endpoints/users.py
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from pydantic import BaseModel
 
-from app.models.schemas import UserRead, UserUpdate
+from app.models.schemas import UserRead, UserUpdate, UserStatsOut
 from app.database.connection import get_db
 from app.services.auth import get_current_user_uid
 from app.repositories.users_repo import UsersRepo
+from app.services.user_stats import PERIODS, user_stats
 
 router = APIRouter()
 
@@ -44,3 +45,16 @@ async def update_my_profile(
         raise HTTPException(status_code=404, detail="User not found")
         
     return user
+
+@router.get("/me/stats", response_model=UserStatsOut)
+async def get_my_stats(
+    period: str = Query("week", pattern=f"^({'|'.join(PERIODS)})$"),
+    uid: str = Depends(get_current_user_uid),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Totals for the current day / week / month / year (local time) or all time:
+    trips, distance, ride time, crashes. Summed from daily buckets, so the
+    cost doesn't grow with ride history.
+    """
+    return await user_stats.get(db, uid, period)
@@ -0,0 +1,73 @@
+# app/database/migrations.py
+from __future__ import annotations
+
+from sqlalchemy.engine import Connection
+
+# Lightweight, idempotent schema fixes for databases created by older builds.
+# create_all() only creates missing tables; anything that changes an existing
+# table goes here. Each step checks the live schema first, so running on every
+# startup is safe.
+
+
+def _sqlite_fix_trip_data_pk(conn: Connection) -> None:
+    """
+    Older builds created trip_data.data_id as BIGINT, which SQLite does not
+    auto-increment, so every telemetry insert failed. Rebuild the table with an
+    INTEGER PRIMARY KEY and copy any rows across.
+    """
+    from app.models.db_models import TripData
+
+    cols = conn.exec_driver_sql("PRAGMA table_info(trip_data)").fetchall()
+    if not cols:
+        return
+    pk = [c for c in cols if c[5]]
+    if pk and pk[0][2].upper() == "INTEGER":
+        return
+
+    print("[migrate] Rebuilding trip_data with an auto-increment primary key")
+    for (name,) in conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='trip_data' AND sql IS NOT NULL"
+    ).fetchall():
+        conn.exec_driver_sql(f'DROP INDEX "{name}"')
+    conn.exec_driver_sql("ALTER TABLE trip_data RENAME TO trip_data_old")
+    TripData.__table__.create(conn)
+    names = ", ".join(f'"{c[1]}"' for c in cols if c[1] in TripData.__table__.c)
+    conn.exec_driver_sql(f"INSERT INTO trip_data ({names}) SELECT {names} FROM trip_data_old")
+    conn.exec_driver_sql("DROP TABLE trip_data_old")
+
+
+def _add_missing_columns(conn: Connection) -> None:
+    """Nullable columns added to existing tables (ALTER TABLE ... ADD COLUMN)."""
+    from sqlalchemy import inspect
+    from app.models.db_models import TripData
+
+    inspector = inspect(conn)
+    for column in (TripData.__table__.c.speed,):
+        table = column.table.name
+        if column.name in {c["name"] for c in inspector.get_columns(table)}:
+            continue
+        print(f"[migrate] Adding column {table}.{column.name}")
+        ddl = column.type.compile(dialect=conn.dialect)
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column.name} {ddl}")
+
+
+def _add_missing_indexes(conn: Connection) -> None:
+    """Indexes declared on tables that already existed before they were added."""
+    from sqlalchemy import inspect
+    from app.models.db_models import Trip, TripData
+
+    inspector = inspect(conn)
+    for table in (Trip.__table__, TripData.__table__):
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"[migrate] Creating index {index.name}")
+                index.create(conn)
+
+
+def run_migrations(conn: Connection) -> None:
+    """Call via `await conn.run_sync(run_migrations)` after create_all."""
+    if conn.dialect.name == "sqlite":
+        _sqlite_fix_trip_data_pk(conn)
+    _add_missing_columns(conn)
+    _add_missing_indexes(conn)
@@ -1,15 +1,33 @@
 from __future__ import annotations
 import asyncio
 import json
+import time
+from typing import Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.models.schemas import TelemetryIn, TripStartIn, TripEndIn
-from app.workers.persist_worker import enqueue_persist, start_persist_worker
+from app.models.schemas import TelemetryIn, TripStartIn, TripEndIn, AlertIn
+from app.workers.persist_worker import enqueue_persist, start_persist_worker, persist_stats
+from app.workers.inference_worker import (
+    feed_inference, start_inference_worker, stop_inference_worker, inference_stats,
+    run_model_watcher,
+)
+from app.workers.trip_stats_job import run_startup_recompute
 from app.database.connection import engine
 from app.models.db_models import Base
+from app.database.migrations import run_migrations
 from app.api.api_router import api_router
 from app.services.connection_manager import manager
+from app.services.broadcaster import stream_buffer, parse_since
+from app.services.device_owner_cache import owner_cache
+from app.services.fleet import fleet
+from app.services.prediction_log import prediction_log
+from app.services.latency import lane_latency, latency_stats
+from app.services.hr_monitor import hr_monitor
+from app.services.geofence import geofences
+from app.services.route_service import route_cache
+from app.services.user_stats import user_stats
+from app.services.analytics_service import trip_analytics
 from fastapi.staticfiles import StaticFiles
 
 
@@ -34,6 +52,7 @@ async def startup_event():
     # Create tables if not exist
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
 
     # (Optional) print which DB you’re actually using (hides password)
     # try:
@@ -45,11 +64,69 @@ async def startup_event():
     # Start the persistence worker
     asyncio.create_task(start_persist_worker())
 
+    # Server-side crash detection on live windows
+    asyncio.create_task(start_inference_worker())
+    asyncio.create_task(run_model_watcher())
+    asyncio.create_task(prediction_log.run())
+
+    # Per-rider heart-rate baselines (restored from DB, saved periodically)
+    asyncio.create_task(hr_monitor.run())
+
+    # Geo-fence index (loaded from DB, external edits picked up periodically)
+    asyncio.create_task(geofences.run())
+
+    # Drop running trip summaries of devices that vanished mid-trip
+    asyncio.create_task(trip_analytics.run())
+
+    # Trips closed without stats (legacy rows, restarts mid-trip), then
+    # per-user daily buckets if this database has none yet
+    asyncio.create_task(_startup_stats())
+
+    # Ping dashboards and reap dead sockets
+    asyncio.create_task(manager.run_heartbeat())
+
+    # Fleet map: one aggregated snapshot per tick
+    asyncio.create_task(fleet.run())
+    asyncio.create_task(fleet.manager.run_heartbeat())
+
+async def _startup_stats():
+    await run_startup_recompute()
+    try:
+        await user_stats.backfill()
+    except Exception as e:
+        print(f"[user-stats] backfill failed: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_inference_worker()
+    await prediction_log.flush()
+    await hr_monitor.persist()
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    In-process gauges for the streaming path (JSON, per worker process).
+    """
+    return {
+        "stream": manager.stats(),
+        "owner_cache": owner_cache.stats(),
+        "fleet": fleet.stats(),
+        "inference": inference_stats(),
+        "predictions": prediction_log.stats(),
+        "persist": persist_stats(),
+        "latency": latency_stats(),
+        "hr_monitor": hr_monitor.stats(),
+        "geofences": geofences.stats(),
+        "route_cache": route_cache.stats(),
+        "user_stats": user_stats.stats(),
+    }
+
+
 from fastapi.responses import HTMLResponse
 
 @app.get("/", response_class=HTMLResponse)
@@ -61,12 +138,17 @@ async def root():
 @app.websocket("/ws/stream")
 async def ws_stream(
     websocket: WebSocket, 
-    token: str = Query(None)
+    token: str = Query(None),
+    since: str = Query(None),
+    boot: str = Query(None),
 ):
     """
     Real-time stream for dashboards.
     Clients connect here to receive live telemetry.
     Authenticated and scoped to the user's devices.
+    Pass since=<seq|ts> to be backfilled from the in-memory buffer first, and
+    boot=<id from the last resume_complete> so a seq from before a restart is
+    not trusted.
     """
     from app.services.auth import verify_firebase_token
     
@@ -83,34 +165,151 @@ async def ws_stream(
         await websocket.close(code=1008, reason="Invalid token")
         return
 
-    await manager.connect(websocket, user_id)
+    if not await manager.admit(websocket, user_id):
+        return
+
     try:
+        if since is None:
+            await manager.connect(websocket, user_id)
+        else:
+            await websocket.accept()
+            await _resume_stream(websocket, user_id, since, boot)
+
         while True:
-            # Keep connection alive
-            await websocket.receive_text()
+            # Client may send subscribe/unsubscribe control messages, e.g.
+            # {"action": "subscribe", "id": "map", "device_ids": ["helmet-pi-01"],
+            #  "fields": ["gps"], "max_rate": 1}
+            # Answering server {"type": "ping"} with {"type": "pong"} is
+            # optional: any inbound frame, or a frame delivered to it, keeps
+            # the socket alive.
+            text = await websocket.receive_text()
+            try:
+                ack = manager.handle_client_message(websocket, text)
+            except Exception as e:
+                ack = {"type": "error", "detail": str(e)}
+            if ack is not None:
+                # Through the socket's outbox, so it stays in order with live frames
+                manager.send_json(websocket, ack)
     except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        # Reaped by the heartbeat, or the transport died mid-send
+        print(f"[ws_stream] closed: {e!r}")
+    finally:
         manager.disconnect(websocket, user_id)
 
-# Simple cache for device ownership to avoid DB hits on every packet
-# Map device_id -> user_id
-_DEVICE_OWNER_CACHE = {}
+@app.websocket("/ws/fleet")
+async def ws_fleet(
+    websocket: WebSocket,
+    token: str = Query(None),
+):
+    """
+    Fleet map stream: one compact snapshot per tick (FLEET_TICK_SECONDS)
+    covering every device the user can see, from in-memory latest state.
+    {"type": "fleet", "ts": ..., "fields": [...], "rows": [[device_id, lat, lng, ...], ...]}
+    """
+    from app.services.auth import verify_firebase_token
 
-@app.websocket("/ws/ingest")
-async def ws_ingest(websocket: WebSocket):
+    try:
+        if not token:
+            await websocket.close(code=1008, reason="Missing token")
+            return
+        decoded = await verify_firebase_token(token)
+        user_id = decoded.get("uid")
+    except Exception:
+        await websocket.close(code=1008, reason="Invalid token")
+        return
+
+    if not await fleet.manager.admit(websocket, user_id):
+        return
+
+    try:
+        await fleet.manager.connect(websocket, user_id)
+        while True:
+            # Only pongs are expected from fleet viewers
+            fleet.manager.touch(websocket)
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"[ws_fleet] closed: {e!r}")
+    finally:
+        fleet.manager.disconnect(websocket, user_id)
+
+async def _resume_stream(websocket: WebSocket, user_id: str, since: str, boot: Optional[str]) -> None:
+    """
+    Replay buffered frames newer than `since`, then switch to live delivery.
+    The last (empty) catch-up check and attach() run without an await in
+    between, so no live frame can slip through the gap.
+    A seq from another boot means nothing here: the whole window is replayed.
+    """
     from app.repositories.devices_repo import DevicesRepo
     from app.database.connection import get_db_context
 
+    try:
+        since_seq, since_ts = parse_since(since, stream_buffer.last_seq)
+    except ValueError:
+        await websocket.send_json({"type": "error", "detail": "invalid since"})
+        since_seq, since_ts = None, None
+    if boot is not None and boot != stream_buffer.boot_id:
+        since_seq = None
+
+    async with get_db_context() as db:
+        device_ids = [d.device_id for d in await DevicesRepo.get_user_devices(db, user_id)]
+
+    while True:
+        frames = stream_buffer.frames_since(device_ids, since_seq, since_ts)
+        if not frames:
+            manager.attach(websocket, user_id)
+            resume_seq = stream_buffer.last_seq
+            break
+        for frame in frames:
+            await websocket.send_json(frame)
+        since_seq = frames[-1]["seq"]
+    # Queued right after attach(), so it precedes every live frame
+    manager.send_json(websocket, {"type": "resume_complete", "seq": resume_seq, "boot": stream_buffer.boot_id})
+
+async def _publish_priority(device_id: str, payload: dict, persist_msg: dict, received_at: float) -> None:
+    """
+    Push to every watcher without throttling, then persist. Only alert rows
+    take the priority persist lane: telemetry (crash-flagged included) goes
+    through the bulk lane so each device's samples, trip_start and trip_end
+    are written in the order they arrived.
+    """
+    if device_id:
+        for user_id in await owner_cache.resolve(device_id):
+            await manager.broadcast_to_user(user_id, payload, priority=True)
+    lane_latency["priority_notify"].record(time.monotonic() - received_at)
+    await enqueue_persist(persist_msg, priority=persist_msg.get("type") == "alert", received_at=received_at)
+
+
+@app.websocket("/ws/ingest")
+async def ws_ingest(websocket: WebSocket):
     await websocket.accept()
     try:
         while True:
             data = await websocket.receive_text()
+            received_at = time.monotonic()
             try:
                 payload = json.loads(data)
                 msg_type = payload.get("type")
                 device_id = payload.get("device_id")
+                priority = False
+                derived_alerts = []
 
                 if msg_type == "telemetry":
                     obj = TelemetryIn(**payload)
+                    # Keep for reconnect backfill; seq lets clients resume
+                    payload["seq"] = stream_buffer.append(obj)
+                    feed_inference(obj)
+                    hr_alert = hr_monitor.observe(obj)
+                    if hr_alert:
+                        derived_alerts.append(hr_alert)
+                    derived_alerts.extend(geofences.observe(obj))
+                    priority = obj.crash_flag
+                elif msg_type == "alert":
+                    obj = AlertIn(**payload)
+                    priority = True
                 elif msg_type == "trip_start":
                     obj = TripStartIn(**payload)
                 elif msg_type == "trip_end":
@@ -119,23 +318,24 @@ async def ws_ingest(websocket: WebSocket):
                     await websocket.send_text("❌ error: unknown type")
                     continue
 
-                # 1. Enqueue for persistence
-                await enqueue_persist(obj.model_dump())
-                
-                # 2. Broadcast to device owner
-                if device_id:
-                    owner_id = _DEVICE_OWNER_CACHE.get(device_id)
-                    
-                    # If not in cache, look up in DB
-                    if not owner_id:
-                        async with get_db_context() as db:
-                            device = await DevicesRepo.get_device(db, device_id)
-                            if device and device.user_id:
-                                owner_id = device.user_id
-                                _DEVICE_OWNER_CACHE[device_id] = owner_id
-                    
-                    if owner_id:
-                        await manager.broadcast_to_user(owner_id, payload)
+                if priority:
+                    # Crash path: notify watchers first, unthrottled, then
+                    # persist (alerts through the priority lane)
+                    await _publish_priority(device_id, payload, obj.model_dump(), received_at)
+                else:
+                    # 1. Enqueue for persistence
+                    await enqueue_persist(obj.model_dump(), received_at=received_at)
+
+                    # 2. Broadcast to everyone linked to the device (owner + viewers)
+                    if device_id:
+                        for user_id in await owner_cache.resolve(device_id):
+                            await manager.broadcast_to_user(user_id, payload)
+
+                # Alerts derived on ingest (heart-rate anomalies, geo-fence
+                # crossings) take the priority lane
+                for derived_alert in derived_alerts:
+                    alert = AlertIn(**derived_alert)
+                    await _publish_priority(device_id, derived_alert, alert.model_dump(), received_at)
 
                 await websocket.send_text("✅ saved")
             except Exception as e:
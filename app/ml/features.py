@@ -0,0 +1,168 @@
+# app/ml/features.py
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+from app.ml.windows import CH
+from app.services.geo import EARTH_RADIUS_M, haversine_m
+
+GRAVITY = 9.80665
+
+FEATURE_NAMES = (
+    "acc_mag_mean",    # m/s^2
+    "acc_mag_std",     # m/s^2
+    "peak_g",          # max |a| in g
+    "jerk_max",        # max |d|a|/dt|, m/s^3
+    "gyro_energy",     # mean(gx^2 + gy^2 + gz^2)
+    "hr_delta",        # newest HR - oldest HR, bpm
+    "speed_max_kmh",   # fastest GPS segment in the window
+    "speed_drop_kmh",  # fastest segment - newest segment
+)
+# Segments with a NaN (no fix) end are left out of the speed features;
+# without any segment both are 0.
+FX = {name: i for i, name in enumerate(FEATURE_NAMES)}
+N_FEATURES = len(FEATURE_NAMES)
+
+
+def extract_features(windows: np.ndarray) -> np.ndarray:
+    """
+    Features for a whole batch at once.
+    windows: (devices, window, channels), oldest sample first, channels per CH.
+    Returns (devices, N_FEATURES) float64. No Python loop over devices or samples.
+    """
+    w = np.asarray(windows, dtype=np.float64)
+    out = np.empty((w.shape[0], N_FEATURES), dtype=np.float64)
+
+    t = w[:, :, CH["t"]]
+    dt = np.diff(t, axis=1)
+    safe_dt = np.where(dt > 0, dt, 1.0)
+
+    acc = w[:, :, CH["ax"]:CH["az"] + 1]
+    mag = np.sqrt(np.einsum("bwc,bwc->bw", acc, acc))
+    out[:, FX["acc_mag_mean"]] = mag.mean(axis=1)
+    out[:, FX["acc_mag_std"]] = mag.std(axis=1)
+    out[:, FX["peak_g"]] = mag.max(axis=1) / GRAVITY
+    jerk = np.where(dt > 0, np.abs(np.diff(mag, axis=1)) / safe_dt, 0.0)
+    out[:, FX["jerk_max"]] = jerk.max(axis=1)
+
+    gyro = w[:, :, CH["gx"]:CH["gz"] + 1]
+    out[:, FX["gyro_energy"]] = np.einsum("bwc,bwc->bw", gyro, gyro).mean(axis=1)
+
+    hr = w[:, :, CH["hr"]]
+    out[:, FX["hr_delta"]] = hr[:, -1] - hr[:, 0]
+
+    lat = w[:, :, CH["lat"]]
+    lng = w[:, :, CH["lng"]]
+    fix = np.isfinite(lat) & np.isfinite(lng)
+    seg = fix[:, :-1] & fix[:, 1:]
+    dist = haversine_m(lat[:, :-1], lng[:, :-1], lat[:, 1:], lng[:, 1:])
+    speed = np.where(seg & (dt > 0), dist / safe_dt * 3.6, 0.0)
+    speed_max = np.where(seg, speed, 0.0).max(axis=1)
+    newest = seg.shape[1] - 1 - np.argmax(seg[:, ::-1], axis=1)
+    final = np.where(seg.any(axis=1), speed[np.arange(len(speed)), newest], 0.0)
+    out[:, FX["speed_max_kmh"]] = speed_max
+    out[:, FX["speed_drop_kmh"]] = speed_max - final
+    return out
+
+
+def extract_features_reference(window: np.ndarray) -> np.ndarray:
+    """
+    Per-sample reference for one (window, channels) array, written as plain
+    Python loops. extract_features() must agree with it; see __main__.
+    """
+    n = len(window)
+    rows = [list(map(float, r)) for r in window]
+    t = [r[CH["t"]] for r in rows]
+
+    mag = [math.sqrt(r[CH["ax"]] ** 2 + r[CH["ay"]] ** 2 + r[CH["az"]] ** 2) for r in rows]
+    mean = sum(mag) / n
+    std = math.sqrt(sum((m - mean) ** 2 for m in mag) / n)
+    jerk_max = 0.0
+    for i in range(1, n):
+        dt = t[i] - t[i - 1]
+        if dt > 0:
+            jerk_max = max(jerk_max, abs(mag[i] - mag[i - 1]) / dt)
+    gyro_energy = sum(r[CH["gx"]] ** 2 + r[CH["gy"]] ** 2 + r[CH["gz"]] ** 2 for r in rows) / n
+    hr_delta = rows[-1][CH["hr"]] - rows[0][CH["hr"]]
+
+    speeds = []
+    for i in range(1, n):
+        dt = t[i] - t[i - 1]
+        ends = (rows[i - 1][CH["lat"]], rows[i - 1][CH["lng"]], rows[i][CH["lat"]], rows[i][CH["lng"]])
+        if not all(math.isfinite(v) for v in ends):
+            continue
+        if dt <= 0:
+            speeds.append(0.0)
+            continue
+        lat1, lng1, lat2, lng2 = ends
+        p1, p2 = math.radians(lat1), math.radians(lat2)
+        dl = math.radians(lng2) - math.radians(lng1)
+        a = math.sin((p2 - p1) / 2.0) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2.0) ** 2
+        speeds.append(2.0 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0))) / dt * 3.6)
+
+    return np.array([
+        mean,
+        std,
+        max(mag) / GRAVITY,
+        jerk_max,
+        gyro_energy,
+        hr_delta,
+        max(speeds, default=0.0),
+        max(speeds) - speeds[-1] if speeds else 0.0,
+    ])
+
+
+def synthetic_windows(devices: int, window: int, seed: int = 0) -> np.ndarray:
+    """Plausible riding windows (5 Hz) with a few injected impacts, for benchmarks/tests."""
+    from app.ml.windows import N_CHANNELS
+
+    rng = np.random.default_rng(seed)
+    w = np.zeros((devices, window, N_CHANNELS))
+    w[:, :, CH["t"]] = np.arange(window) * 0.2 - (window - 1) * 0.2
+    w[:, :, CH["ax"]:CH["az"] + 1] = rng.normal(0.0, 0.4, (devices, window, 3))
+    w[:, :, CH["az"]] += 9.81
+    w[:, :, CH["gx"]:CH["gz"] + 1] = rng.normal(0.0, 5.0, (devices, window, 3))
+    w[:, :, CH["hr"]] = 80 + np.cumsum(rng.normal(0, 0.5, (devices, window)), axis=1)
+    w[:, :, CH["lat"]] = 33.85 + np.cumsum(rng.normal(5e-5, 1e-5, (devices, window)), axis=1)
+    w[:, :, CH["lng"]] = 35.86 + np.cumsum(rng.normal(5e-5, 1e-5, (devices, window)), axis=1)
+    lost = rng.random((devices, window)) < 0.02
+    w[:, :, CH["lat"]][lost] = np.nan
+    w[:, :, CH["lng"]][lost] = np.nan
+    hit = rng.random(devices) < 0.05
+    w[hit, window // 2, CH["ax"]] += 60.0
+    return w
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Feature extraction benchmark")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--window", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    batch = synthetic_windows(args.devices, args.window)
+
+    ref = np.stack([extract_features_reference(w) for w in batch])
+    vec = extract_features(batch)
+    if not np.allclose(vec, ref, rtol=1e-9, atol=1e-9):
+        raise SystemExit(f"MISMATCH: max abs diff {np.abs(vec - ref).max():.3e}")
+    print(f"verified {args.devices} windows against reference (max abs diff {np.abs(vec - ref).max():.2e})")
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        extract_features(batch)
+    vec_s = (time.perf_counter() - started) / args.repeat
+
+    started = time.perf_counter()
+    for w in batch:
+        extract_features_reference(w)
+    ref_s = time.perf_counter() - started
+
+    print(f"vectorized: {args.devices / vec_s:,.0f} windows/s ({vec_s * 1000:.2f} ms per batch)")
+    print(f"reference:  {args.devices / ref_s:,.0f} windows/s ({ref_s * 1000:.2f} ms per batch)")
+    print(f"speedup:    {ref_s / vec_s:.1f}x")
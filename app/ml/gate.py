@@ -0,0 +1,135 @@
+# app/ml/gate.py
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+GRAVITY = 9.80665
+
+# Stage 1 thresholds (per sample). Normal riding sits near 1 g.
+ACC_HIGH_G = float(os.getenv("ML_GATE_ACC_HIGH_G", "2.5"))
+ACC_LOW_G = float(os.getenv("ML_GATE_ACC_LOW_G", "0.3"))     # free fall
+GYRO_MAX = float(os.getenv("ML_GATE_GYRO", "300"))            # deg/s, any axis
+# After a trigger, the device's windows go to the model for this long, so the
+# model sees the event with context on both sides.
+ARM_SECONDS = float(os.getenv("ML_GATE_ARM_SECONDS", "6"))
+# Fraction of untriggered windows still scored, for monitoring the gate itself
+SAMPLE_RATE = float(os.getenv("ML_GATE_SAMPLE_RATE", "0.01"))
+
+_ACC_HIGH_SQ = (ACC_HIGH_G * GRAVITY) ** 2
+_ACC_LOW_SQ = (ACC_LOW_G * GRAVITY) ** 2
+
+
+def trigger_mask(
+    acc: np.ndarray,
+    gyro: np.ndarray,
+    crash_flag: np.ndarray,
+    imu_valid: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Vectorized StreamingGate.check() for recorded samples (offline replay).
+    acc, gyro: (N, 3); crash_flag, imu_valid: (N,). Same thresholds, same result.
+    """
+    mag_sq = np.einsum("nc,nc->n", acc, acc)
+    motion = (
+        (mag_sq > _ACC_HIGH_SQ)
+        | (mag_sq < _ACC_LOW_SQ)
+        | (np.abs(gyro) > GYRO_MAX).any(axis=1)
+    )
+    if imu_valid is not None:
+        motion &= imu_valid.astype(bool)
+    return crash_flag.astype(bool) | motion
+
+
+class StreamingGate:
+    """
+    Cheap first stage of the crash cascade. Each sample is checked in O(1)
+    (no sqrt, no arrays); only devices that tripped it recently, plus a small
+    random sample, are handed to the expensive model.
+    """
+
+    def __init__(
+        self,
+        arm_seconds: float = ARM_SECONDS,
+        sample_rate: float = SAMPLE_RATE,
+        seed: int | None = None,
+    ):
+        self.arm_seconds = arm_seconds
+        self.sample_rate = sample_rate
+        # Map device_id -> monotonic time until which its windows are scored
+        self.armed_until: Dict[str, float] = {}
+        self._rng = np.random.default_rng(seed)
+
+        self.samples = 0
+        self.imu_invalid = 0
+        self.triggers = 0
+        self.windows_offered = 0
+        self.windows_gated = 0
+        self.windows_sampled = 0
+
+    def check(
+        self,
+        device_id: str,
+        ax: float, ay: float, az: float,
+        gx: float, gy: float, gz: float,
+        crash_flag: bool = False,
+        imu_valid: bool = True,
+    ) -> bool:
+        """
+        Evaluate one sample; arms the device and returns True on a trigger.
+        imu_valid=False (IMU failed or asleep, reporting zeros) skips the
+        motion tests, which would otherwise read as free fall on every
+        sample; crash_flag still counts.
+        """
+        self.samples += 1
+        if not imu_valid:
+            self.imu_invalid += 1
+        mag_sq = ax * ax + ay * ay + az * az
+        if crash_flag or (imu_valid and (
+            mag_sq > _ACC_HIGH_SQ
+            or mag_sq < _ACC_LOW_SQ
+            or abs(gx) > GYRO_MAX
+            or abs(gy) > GYRO_MAX
+            or abs(gz) > GYRO_MAX
+        )):
+            self.triggers += 1
+            self.armed_until[device_id] = time.monotonic() + self.arm_seconds
+            return True
+        return False
+
+    def select(self, device_ids: Sequence[str]) -> np.ndarray:
+        """
+        Boolean mask over device_ids: which windows the model should score
+        this cycle (armed devices + random monitoring sample).
+        """
+        n = len(device_ids)
+        self.windows_offered += n
+        now = time.monotonic()
+        armed = np.fromiter(
+            (self.armed_until.get(d, 0.0) > now for d in device_ids), dtype=bool, count=n
+        )
+        sampled = ~armed & (self._rng.random(n) < self.sample_rate)
+        self.windows_gated += int(armed.sum())
+        self.windows_sampled += int(sampled.sum())
+
+        # Expired arms are dropped lazily so the dict tracks live incidents only
+        if len(self.armed_until) > 1024:
+            self.armed_until = {d: t for d, t in self.armed_until.items() if t > now}
+        return armed | sampled
+
+    def stats(self) -> dict:
+        return {
+            "samples": self.samples,
+            "imu_invalid": self.imu_invalid,
+            "triggers": self.triggers,
+            "trigger_rate": round(self.triggers / self.samples, 6) if self.samples else 0.0,
+            "windows_offered": self.windows_offered,
+            "windows_gated": self.windows_gated,
+            "windows_sampled": self.windows_sampled,
+            "model_fraction": round(
+                (self.windows_gated + self.windows_sampled) / self.windows_offered, 6
+            ) if self.windows_offered else 0.0,
+        }
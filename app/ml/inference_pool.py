@@ -0,0 +1,361 @@
+# app/ml/inference_pool.py
+from __future__ import annotations
+
+import asyncio
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.ml.features import extract_features, synthetic_windows
+from app.ml.predictor import CrashPredictor, DummyModel, MAX_BATCH_SIZE, load_predictor
+from app.ml.windows import N_CHANNELS, WINDOW_SIZE
+
+# "thread": score in a thread of the server process (default)
+# "process": score in ML_WORKERS separate processes fed through shared memory
+EXECUTION_MODE = os.getenv("ML_EXECUTION_MODE", "thread")
+WORKERS = int(os.getenv("ML_WORKERS", "1"))
+# A worker that doesn't answer a batch in this long is treated as dead
+SCORE_TIMEOUT_SECONDS = float(os.getenv("ML_WORKER_TIMEOUT_SECONDS", "10"))
+# ... or doesn't finish loading and warming up its model in this long
+READY_TIMEOUT_SECONDS = float(os.getenv("ML_WORKER_READY_SECONDS", "120"))
+# A replacement that fails to start is retried after 1 s, 2 s, 4 s ... up to this
+RESPAWN_MAX_SECONDS = 60.0
+
+# Errors meaning the child's end of the pipe is gone
+_PIPE_ERRORS = (EOFError, BrokenPipeError, ConnectionResetError)
+
+
+def score_windows(predictor: CrashPredictor, windows: np.ndarray) -> np.ndarray:
+    """Windows -> features -> probabilities, all batched. Same code in every mode."""
+    return predictor.predict(extract_features(windows))
+
+
+def warm_up(predictor: CrashPredictor, window: int = WINDOW_SIZE) -> None:
+    """
+    Push synthetic batches through the full scoring path (smallest and largest
+    batch shape) so session allocation and kernel selection happen here, not
+    on the first real cycle after startup or reload.
+    """
+    for n in sorted({1, predictor.max_batch_size}):
+        score_windows(predictor, synthetic_windows(n, window))
+
+
+def load_warm_predictor(path: Optional[str] = None, window: int = WINDOW_SIZE, strict: bool = False) -> CrashPredictor:
+    """
+    Load and warm a predictor. A model that loads but can't score our
+    batches (wrong input shape or type) falls back to the dummy unless strict.
+    """
+    predictor = load_predictor(path, strict=strict)
+    try:
+        warm_up(predictor, window)
+    except Exception as e:
+        if strict or isinstance(predictor.model, DummyModel):
+            raise
+        print(f"[ml] Model failed warm-up ({e}); using DummyModel")
+        predictor = CrashPredictor(DummyModel(), predictor.max_batch_size)
+        warm_up(predictor, window)
+    return predictor
+
+
+class ThreadScorer:
+    """
+    Runs scoring in the default thread pool. onnxruntime and NumPy release the
+    GIL for the heavy parts, but Python-level work still competes with the loop.
+    """
+
+    def __init__(self, predictor: Optional[CrashPredictor] = None, window: int = WINDOW_SIZE):
+        self.predictor = predictor or load_predictor()
+        self.window = window
+
+    @property
+    def version(self) -> str:
+        return self.predictor.version
+
+    async def score(self, windows: np.ndarray) -> Tuple[np.ndarray, str]:
+        """Probabilities plus the version of the model that produced them."""
+        predictor = self.predictor  # pinned for the whole batch
+        probs = await asyncio.to_thread(score_windows, predictor, windows)
+        return probs, predictor.version
+
+    async def reload(self, path: Optional[str] = None) -> str:
+        """
+        Load + warm the new model in a thread, then swap the reference. Batches
+        already running finish on the old predictor; the next one uses the new.
+        """
+        predictor = await asyncio.to_thread(load_warm_predictor, path, self.window, True)
+        self.predictor = predictor
+        return predictor.version
+
+    async def close(self) -> None:
+        pass
+
+
+# -----------------------
+# Process mode
+# -----------------------
+
+def _worker_main(
+    conn, in_name: str, out_name: str, max_rows: int, window: int,
+    model_path: Optional[str], strict: bool = False,
+) -> None:
+    """
+    Child process loop. Windows arrive in the shared input block, probabilities
+    go back through the shared output block; the pipe only carries row counts.
+    """
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    inputs = np.ndarray((max_rows, window, N_CHANNELS), dtype=np.float64, buffer=in_shm.buf)
+    outputs = np.ndarray((max_rows,), dtype=np.float32, buffer=out_shm.buf)
+    try:
+        try:
+            predictor = load_warm_predictor(model_path, window, strict)
+        except Exception as e:
+            conn.send(("error", repr(e)))
+            return
+        conn.send(("ready", predictor.version))
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            kind, arg = msg
+            try:
+                if kind == "score":
+                    outputs[:arg] = score_windows(predictor, inputs[:arg])
+                    conn.send(("ok", predictor.version))
+                else:
+                    conn.send(("error", f"unknown command {kind!r}"))
+            except Exception as e:
+                conn.send(("error", repr(e)))
+    finally:
+        del inputs, outputs
+        in_shm.close()
+        out_shm.close()
+
+
+class _Worker:
+    """One child process plus the two shared blocks it owns."""
+
+    def __init__(self, ctx, max_rows: int, window: int, model_path: Optional[str], strict: bool = False):
+        self.max_rows = max_rows
+        self.in_shm = shared_memory.SharedMemory(create=True, size=max_rows * window * N_CHANNELS * 8)
+        self.out_shm = shared_memory.SharedMemory(create=True, size=max_rows * 4)
+        self.inputs = np.ndarray((max_rows, window, N_CHANNELS), dtype=np.float64, buffer=self.in_shm.buf)
+        self.outputs = np.ndarray((max_rows,), dtype=np.float32, buffer=self.out_shm.buf)
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.in_shm.name, self.out_shm.name, max_rows, window, model_path, strict),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.version: Optional[str] = None
+        self.closed = False
+
+    async def recv(self, timeout: float):
+        """
+        Next reply from the child. Waits with poll() so a hung child costs a
+        bounded wait (and no stuck executor thread); raises TimeoutError.
+        """
+        if not await asyncio.to_thread(self.conn.poll, timeout):
+            raise TimeoutError(f"inference worker silent for {timeout:.0f}s")
+        return self.conn.recv()
+
+    async def wait_ready(self) -> str:
+        kind, detail = await self.recv(READY_TIMEOUT_SECONDS)
+        if kind != "ready":
+            raise RuntimeError(f"inference worker failed to load model: {detail}")
+        self.version = detail
+        return detail
+
+    def close(self, kill: bool = False) -> None:
+        """
+        Stop the child (kill: it's hung, don't wait for it) and free the blocks.
+        Joins the process, so call it through asyncio.to_thread from the loop.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except Exception:
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        del self.inputs, self.outputs
+        self.in_shm.close()
+        self.in_shm.unlink()
+        self.out_shm.close()
+        self.out_shm.unlink()
+
+
+class ProcessScorer:
+    """
+    Pool of scoring processes. The event loop only copies a batch into a free
+    worker's shared block and awaits a tiny reply; features and the model run
+    entirely outside the server process. Batches larger than one block are
+    split across workers and scored in parallel.
+    """
+
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        max_rows: int = MAX_BATCH_SIZE,
+        window: int = WINDOW_SIZE,
+        model_path: Optional[str] = None,
+    ):
+        ctx = mp.get_context("spawn")
+        self.max_rows = max_rows
+        self.window = window
+        self.model_path = model_path
+        self._ctx = ctx
+        self.size = workers
+        self._workers: List[_Worker] = [_Worker(ctx, max_rows, window, model_path) for _ in range(workers)]
+        self._idle: Optional[asyncio.Queue] = None
+        # Bumped when the pool is swapped or closed; stops stale respawns
+        self._generation = 0
+        # Held for a whole batch, and by reload() while it swaps the pool, so
+        # every chunk of one batch is scored by the same model generation
+        self._batch_lock: Optional[asyncio.Lock] = None
+        self.version: Optional[str] = None
+
+    async def start(self) -> None:
+        """Wait for every child to load and warm up its model."""
+        self._idle = asyncio.Queue()
+        self._batch_lock = asyncio.Lock()
+        for w in self._workers:
+            self.version = await w.wait_ready()
+            self._idle.put_nowait(w)
+
+    async def _take_worker(self) -> _Worker:
+        """
+        A free worker, or RuntimeError when none is up (all dead and their
+        replacements still starting) so the cycle is skipped instead of
+        waiting under the batch lock.
+        """
+        if self._idle.empty() and not any(w.version is not None for w in self._workers):
+            raise RuntimeError("no inference worker is running")
+        try:
+            return await asyncio.wait_for(self._idle.get(), SCORE_TIMEOUT_SECONDS)
+        except TimeoutError:
+            raise RuntimeError("no inference worker became free") from None
+
+    async def _score_chunk(self, chunk: np.ndarray) -> np.ndarray:
+        w = await self._take_worker()
+        sent = False
+        try:
+            n = len(chunk)
+            w.inputs[:n] = chunk
+            w.conn.send(("score", n))
+            sent = True
+            kind, detail = await w.recv(SCORE_TIMEOUT_SECONDS)
+            sent = False
+            if kind != "ok":
+                raise RuntimeError(f"inference worker failed: {detail}")
+            w.version = detail
+            return w.outputs[:n].copy()
+        except BaseException as e:
+            # Dead child, or its reply is still unread (timeout, cancellation):
+            # either way it can't take the next chunk. A live one is killed.
+            if sent or isinstance(e, _PIPE_ERRORS):
+                self._replace(w, hung=not isinstance(e, _PIPE_ERRORS))
+            raise
+        finally:
+            if w in self._workers:
+                self._idle.put_nowait(w)
+
+    def _replace(self, dead: _Worker, hung: bool = False) -> None:
+        """Drop a worker from the pool now; close it and start a new one in the background."""
+        self._workers.remove(dead)
+        asyncio.get_running_loop().create_task(self._respawn(dead, hung))
+
+    async def _respawn(self, dead: _Worker, hung: bool) -> None:
+        try:
+            await asyncio.to_thread(dead.close, hung)
+        except Exception:
+            pass
+        generation = self._generation
+        delay = 1.0
+        while generation == self._generation:
+            fresh = None
+            try:
+                fresh = _Worker(self._ctx, self.max_rows, self.window, self.model_path)
+                self._workers.append(fresh)
+                await fresh.wait_ready()
+            except Exception as e:
+                print(f"[ml] Replacement worker failed: {e}; retrying in {delay:.0f}s")
+            if fresh is not None and fresh.version is not None and generation == self._generation:
+                self._idle.put_nowait(fresh)
+                return
+            # Failed, or retired by a reload while it was starting
+            if fresh is not None:
+                if fresh in self._workers:
+                    self._workers.remove(fresh)
+                await asyncio.to_thread(fresh.close)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESPAWN_MAX_SECONDS)
+
+    async def score(self, windows: np.ndarray) -> Tuple[np.ndarray, str]:
+        """Probabilities plus the version of the model that produced them."""
+        n = len(windows)
+        async with self._batch_lock:
+            if n == 0:
+                return np.zeros(0, dtype=np.float32), self.version
+            chunks = [windows[i:i + self.max_rows] for i in range(0, n, self.max_rows)]
+            parts = await asyncio.gather(*(self._score_chunk(c) for c in chunks))
+            return np.concatenate(parts), self.version
+
+    async def reload(self, path: Optional[str] = None) -> str:
+        """
+        Blue/green swap: start a full new pool on the new model and wait until
+        every child has loaded and warmed up, while the old pool keeps scoring.
+        The swap itself happens between batches; the old pool is then retired.
+        """
+        fresh = [
+            _Worker(self._ctx, self.max_rows, self.window, path, strict=True)
+            for _ in range(self.size)
+        ]
+        try:
+            for w in fresh:
+                await w.wait_ready()
+        except Exception:
+            for w in fresh:
+                await asyncio.to_thread(w.close)
+            raise
+
+        async with self._batch_lock:
+            old = self._workers
+            self._workers = fresh
+            self._generation += 1
+            self.model_path = path
+            self.version = fresh[0].version
+            while not self._idle.empty():
+                self._idle.get_nowait()
+            for w in fresh:
+                self._idle.put_nowait(w)
+
+        for w in old:
+            await asyncio.to_thread(w.close)
+        return self.version
+
+    async def close(self) -> None:
+        workers, self._workers = self._workers, []
+        self._generation += 1
+        await asyncio.gather(*(asyncio.to_thread(w.close) for w in workers))
+
+
+async def create_scorer(mode: str = EXECUTION_MODE):
+    """Scorer for the configured execution mode, loaded and warmed up."""
+    if mode == "process":
+        scorer = ProcessScorer()
+        await scorer.start()
+        print(f"[ml] Scoring in {len(scorer._workers)} worker process(es), model {scorer.version}")
+        return scorer
+    return ThreadScorer(await asyncio.to_thread(load_warm_predictor))
@@ -0,0 +1,136 @@
+# app/ml/predictor.py
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+
+from app.ml.features import FX
+
+MODEL_PATH = os.getenv("ML_MODEL_PATH", "app/ml/model.onnx")
+# onnxruntime intra-op threads; keep small so inference never starves the event loop
+INTRA_OP_THREADS = int(os.getenv("ML_INTRA_OP_THREADS", "1"))
+# Largest batch handed to one run(); bigger batches are split
+MAX_BATCH_SIZE = int(os.getenv("ML_BATCH_SIZE", "256"))
+
+# Model input contract: float32 (batch, N_FEATURES), columns in FEATURE_NAMES
+# order, as produced by app.ml.features.extract_features().
+
+
+class DummyModel:
+    """
+    Pure-NumPy stand-in used when no real model is deployed (or in tests).
+    Logistic score on the window's peak acceleration (g).
+    """
+    name = "dummy"
+    version = "dummy-2"
+
+    def __init__(self, threshold_g: float = 3.0, steepness: float = 4.0):
+        self.threshold_g = threshold_g
+        self.steepness = steepness
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        peak_g = batch[:, FX["peak_g"]]
+        return 1.0 / (1.0 + np.exp(-self.steepness * (peak_g - self.threshold_g)))
+
+
+def model_fingerprint(path: str) -> str:
+    """Short content hash, so a replaced file with the same name gets a new version."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+
+class OnnxModel:
+    """
+    One onnxruntime CPU session, created once and reused for every batch.
+    """
+    name = "onnx"
+
+    def __init__(self, path: str, intra_op_threads: int = INTRA_OP_THREADS):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = intra_op_threads
+        opts.inter_op_num_threads = 1
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.version = f"{os.path.basename(path)}@{model_fingerprint(path)}"
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        out = self.session.run(None, {self.input_name: batch})[0]
+        out = np.asarray(out, dtype=np.float32)
+        # Accept (B,), (B, 1) or two-class (B, 2) probability outputs
+        if out.ndim == 2:
+            out = out[:, -1]
+        return out.reshape(-1)
+
+
+class CrashPredictor:
+    """
+    Batched crash-probability predictor.
+    predict() takes every active helmet's window as one array, so the model's
+    fixed per-call cost is paid once per batch instead of once per sample.
+    """
+
+    def __init__(self, model=None, max_batch_size: int = MAX_BATCH_SIZE):
+        self.model = model if model is not None else DummyModel()
+        self.max_batch_size = max_batch_size
+
+    @property
+    def version(self) -> str:
+        return self.model.version
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """
+        batch: (B, N_FEATURES) array, cast to contiguous float32.
+        Returns (B,) probabilities in [0, 1].
+        """
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        n = batch.shape[0]
+        if n == 0:
+            return np.zeros(0, dtype=np.float32)
+        if n <= self.max_batch_size:
+            return self.model.run(batch).astype(np.float32, copy=False)
+        return np.concatenate([
+            self.model.run(batch[i:i + self.max_batch_size])
+            for i in range(0, n, self.max_batch_size)
+        ]).astype(np.float32, copy=False)
+
+
+def load_model(path: Optional[str] = None, intra_op_threads: int = INTRA_OP_THREADS, strict: bool = False):
+    """
+    ONNX session if onnxruntime is installed and the model file is real and
+    loads; otherwise the NumPy dummy (the repo ships a zero-byte placeholder).
+    strict=True raises instead of falling back (used by hot-reload, where
+    silently swapping a live model for the dummy would be worse than failing).
+    """
+    path = path or MODEL_PATH
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        if strict:
+            raise FileNotFoundError(f"No model at {path}")
+        print(f"[ml] No model at {path}; using DummyModel")
+        return DummyModel()
+    try:
+        return OnnxModel(path, intra_op_threads=intra_op_threads)
+    except ImportError:
+        if strict:
+            raise
+        print("[ml] onnxruntime not installed; using DummyModel")
+        return DummyModel()
+    except Exception as e:
+        # Corrupt or incompatible file: onnxruntime raises its own error types
+        if strict:
+            raise
+        print(f"[ml] Could not load {path} ({e}); using DummyModel")
+        return DummyModel()
+
+
+def load_predictor(path: Optional[str] = None, strict: bool = False) -> CrashPredictor:
+    return CrashPredictor(load_model(path, strict=strict))
@@ -0,0 +1,293 @@
+# app/ml/replay.py
+"""
+Offline replay of stored telemetry through the live crash-detection code.
+
+    python -m app.ml.replay                      # every trip in DATABASE_URL / helmet.db
+    python -m app.ml.replay --db sqlite+aiosqlite:///./helmet.db --trip <id> --trip <id>
+    python -m app.ml.replay --model candidate.onnx --json
+
+Rows are streamed in chunks through a server-side cursor, cut into the same
+windows the inference worker scores (every --stride samples ≈ its cadence),
+passed through the gate, feature extraction and predictor, and alerts are
+counted with the live threshold and cooldown. Prints throughput and time per
+stage.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.ml.features import extract_features
+from app.ml.gate import ARM_SECONDS, trigger_mask
+from app.ml.inference_pool import load_warm_predictor
+from app.ml.windows import CH, WINDOW_SIZE, sliding_windows
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+STAGES = ("fetch", "convert", "window", "gate", "features", "predict")
+
+
+class _TripState:
+    """Samples of one (trip, device) not yet covered by a window, carried across chunks."""
+
+    __slots__ = ("trip_id", "device_id", "samples", "triggers", "last_trigger", "last_alert")
+
+    def __init__(self, trip_id: str, device_id: str, n_channels: int):
+        self.trip_id = trip_id
+        self.device_id = device_id
+        self.samples = np.zeros((0, n_channels))
+        self.triggers = np.zeros(0, dtype=bool)
+        self.last_trigger = -np.inf   # newest trigger time before samples[0]
+        self.last_alert = -np.inf
+
+
+class Replay:
+    def __init__(
+        self,
+        predictor,
+        window: int = WINDOW_SIZE,
+        stride: int = 5,
+        use_gate: bool = True,
+        threshold: Optional[float] = None,
+        cooldown: Optional[float] = None,
+    ):
+        from app.workers.inference_worker import ALERT_COOLDOWN_SECONDS, CRASH_THRESHOLD
+
+        self.predictor = predictor
+        self.window = window
+        self.stride = stride
+        self.use_gate = use_gate
+        self.threshold = CRASH_THRESHOLD if threshold is None else threshold
+        self.cooldown = ALERT_COOLDOWN_SECONDS if cooldown is None else cooldown
+
+        self.timings: Dict[str, float] = {s: 0.0 for s in STAGES}
+        self.rows = 0
+        self.trips = 0
+        self.windows = 0
+        self.windows_scored = 0
+        self.positives = 0
+        self.alerts: List[dict] = []
+        self.wall_s = 0.0
+        self._state: Optional[_TripState] = None
+
+    # -----------------------
+    # Chunk processing
+    # -----------------------
+
+    def _convert(self, rows: Sequence[tuple]):
+        """DB tuples -> key columns + (N, channels) float64 in WINDOW_CHANNELS order."""
+        cols = list(zip(*rows))
+        trip = np.array(cols[0], dtype=object)
+        device = np.array(cols[1], dtype=object)
+        # Naive UTC (the column type); subtraction is ~3x cheaper than to_epoch()
+        t = np.fromiter(((ts - _EPOCH) / _SECOND for ts in cols[2]), dtype=np.float64, count=len(rows))
+        values = np.array(cols[3:12], dtype=np.float64).T     # acc, gyro, hr, lat, lng
+        # Stored no-fix samples are (0, 0); live windows carry them as NaN
+        lat, lng = values[:, 7], values[:, 8]
+        no_fix = (lat == 0) & (lng == 0)
+        values[no_fix, 7:9] = np.nan
+        samples = np.column_stack([t, values])
+        crash_flag = np.array(cols[12], dtype=bool)
+        return trip, device, samples, crash_flag
+
+    def _windows_for(self, state: _TripState, samples: np.ndarray, triggers: np.ndarray):
+        """Append a segment to its trip state and cut every complete window."""
+        state.samples = np.concatenate([state.samples, samples])
+        state.triggers = np.concatenate([state.triggers, triggers])
+        n = len(state.samples)
+        if n < self.window:
+            return None
+        started = time.perf_counter()
+        batch = sliding_windows(state.samples, self.window, self.stride)
+        self.timings["window"] += time.perf_counter() - started
+        m = len(batch)
+        ends = np.arange(m) * self.stride + self.window - 1
+        t_end = state.samples[ends, CH["t"]]
+
+        started = time.perf_counter()
+        if self.use_gate:
+            trig_t = np.where(state.triggers, state.samples[:, CH["t"]], -np.inf)
+            last_trig = np.maximum.accumulate(np.concatenate([[state.last_trigger], trig_t]))[1:]
+            selected = (t_end - last_trig[ends]) <= ARM_SECONDS
+        else:
+            selected = np.ones(m, dtype=bool)
+        # Keep only samples still needed by the next window
+        consumed = m * self.stride
+        if consumed:
+            state.last_trigger = max(
+                state.last_trigger,
+                float(np.max(np.where(state.triggers[:consumed], state.samples[:consumed, CH["t"]], -np.inf))),
+            )
+        state.samples = state.samples[consumed:]
+        state.triggers = state.triggers[consumed:]
+        self.timings["gate"] += time.perf_counter() - started
+
+        self.windows += m
+        return batch[selected], t_end[selected]
+
+    def process(self, rows: Sequence[tuple]) -> None:
+        started = time.perf_counter()
+        trip, device, samples, crash_flag = self._convert(rows)
+        acc = samples[:, CH["ax"]:CH["az"] + 1]
+        gyro = samples[:, CH["gx"]:CH["gz"] + 1]
+        # imu.ok/sleep aren't stored; a failed or sleeping IMU is stored as all zeros
+        imu_valid = acc.any(axis=1) | gyro.any(axis=1)
+        triggers = trigger_mask(acc, gyro, crash_flag, imu_valid)
+        self.timings["convert"] += time.perf_counter() - started
+        self.rows += len(rows)
+
+        # Contiguous (trip, device) segments of this chunk
+        change = np.flatnonzero((trip[1:] != trip[:-1]) | (device[1:] != device[:-1])) + 1
+        bounds = [0, *change.tolist(), len(rows)]
+
+        batches, owners, ends = [], [], []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            state = self._state
+            if state is None or state.trip_id != trip[a] or state.device_id != device[a]:
+                state = self._state = _TripState(trip[a], device[a], samples.shape[1])
+                self.trips += 1
+            cut = self._windows_for(state, samples[a:b], triggers[a:b])
+            if cut is not None and len(cut[0]):
+                batches.append(cut[0])
+                ends.append(cut[1])
+                owners.extend([state] * len(cut[0]))
+        if not batches:
+            return
+        self._score(np.concatenate(batches), owners, np.concatenate(ends))
+
+    def _score(self, batch: np.ndarray, owners: List[_TripState], t_end: np.ndarray) -> None:
+        started = time.perf_counter()
+        features = extract_features(batch)
+        self.timings["features"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        probs = self.predictor.predict(features)
+        self.timings["predict"] += time.perf_counter() - started
+
+        self.windows_scored += len(batch)
+        hits = np.flatnonzero(probs >= self.threshold)
+        self.positives += len(hits)
+        # Windows are in time order per trip, so the live cooldown applies as-is
+        for i in hits:
+            state = owners[i]
+            if t_end[i] - state.last_alert < self.cooldown:
+                continue
+            state.last_alert = t_end[i]
+            self.alerts.append({
+                "trip_id": state.trip_id,
+                "device_id": state.device_id,
+                "ts": float(t_end[i]),
+                "probability": round(float(probs[i]), 4),
+            })
+
+    # -----------------------
+    # Report
+    # -----------------------
+
+    def report(self) -> dict:
+        wall_s = self.wall_s
+        return {
+            "model_version": self.predictor.version,
+            "rows": self.rows,
+            "trips": self.trips,
+            "windows": self.windows,
+            "windows_scored": self.windows_scored,
+            "positives": self.positives,
+            "alerts": len(self.alerts),
+            "wall_s": round(wall_s, 3),
+            "rows_per_s": round(self.rows / wall_s) if wall_s else 0,
+            "windows_per_s": round(self.windows / wall_s) if wall_s else 0,
+            "stages_ms": {s: round(v * 1000.0, 1) for s, v in self.timings.items()},
+        }
+
+
+async def replay(
+    url: Optional[str] = None,
+    trip_ids: Optional[Sequence[str]] = None,
+    chunk_size: int = 20_000,
+    model_path: Optional[str] = None,
+    window: int = WINDOW_SIZE,
+    stride: int = 5,
+    use_gate: bool = True,
+    threshold: Optional[float] = None,
+) -> Replay:
+    """Run a full replay; returns the Replay (report() + alerts)."""
+    from app.database.connection import _create_engine, engine as app_engine
+    from app.repositories.telemetry_repo import stream_trip_samples
+
+    # Strict when a model is named: a typo must not silently replay the dummy
+    predictor = load_warm_predictor(model_path, window, strict=model_path is not None)
+    run = Replay(predictor, window=window, stride=stride, use_gate=use_gate, threshold=threshold)
+    engine = _create_engine(url) if url else app_engine
+
+    started = time.perf_counter()
+    try:
+        async with AsyncSession(engine) as db:
+            chunks = stream_trip_samples(db, trip_ids, chunk_size)
+            while True:
+                t0 = time.perf_counter()
+                rows = await anext(chunks, None)
+                run.timings["fetch"] += time.perf_counter() - t0
+                if rows is None:
+                    break
+                run.process(rows)
+    finally:
+        if url:
+            await engine.dispose()
+    run.wall_s = time.perf_counter() - started
+    return run
+
+
+def _print_report(report: dict) -> None:
+    print(f"model      {report['model_version']}")
+    print(f"rows       {report['rows']:,} in {report['trips']:,} trip(s)")
+    print(f"windows    {report['windows']:,} cut, {report['windows_scored']:,} scored, "
+          f"{report['positives']:,} positive, {report['alerts']:,} alert(s)")
+    print(f"throughput {report['windows_per_s']:,} windows/s, {report['rows_per_s']:,} rows/s "
+          f"({report['wall_s']:.2f} s wall)")
+    total = sum(report["stages_ms"].values()) or 1.0
+    for stage, ms in report["stages_ms"].items():
+        print(f"  {stage:<9}{ms:>10.1f} ms  {ms / total * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay stored trips through crash inference")
+    parser.add_argument("--db", help="SQLAlchemy async URL (default: DATABASE_URL or helmet.db)")
+    parser.add_argument("--trip", action="append", dest="trips", help="Trip id (repeatable; default: all)")
+    parser.add_argument("--chunk", type=int, default=20_000, help="Rows per fetch")
+    parser.add_argument("--model", help="Model file (default: ML_MODEL_PATH)")
+    parser.add_argument("--window", type=int, default=WINDOW_SIZE)
+    parser.add_argument("--stride", type=int, default=5, help="Samples between scored windows (5 = 1 s at 5 Hz)")
+    parser.add_argument("--no-gate", action="store_true", help="Score every window, not only gated ones")
+    parser.add_argument("--threshold", type=float, help="Alert threshold (default: ML_CRASH_THRESHOLD)")
+    parser.add_argument("--alerts", action="store_true", help="List every alert")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(replay(
+        url=args.db,
+        trip_ids=args.trips,
+        chunk_size=args.chunk,
+        model_path=args.model,
+        window=args.window,
+        stride=args.stride,
+        use_gate=not args.no_gate,
+        threshold=args.threshold,
+    ))
+    report = result.report()
+    if args.alerts:
+        report["alert_list"] = result.alerts
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+        for a in result.alerts if args.alerts else ():
+            print(f"  alert {a['trip_id']} {a['device_id']} ts={a['ts']:.1f} p={a['probability']}")
@@ -0,0 +1,141 @@
+# app/ml/windows.py
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Samples per window (10 s at 5 Hz)
+WINDOW_SIZE = int(os.getenv("ML_WINDOW_SIZE", "50"))
+# Devices silent this long give their slot back
+IDLE_EVICT_SECONDS = 300.0
+
+# Channels of one window row, in order. t is epoch seconds in the ring and is
+# rebased by gather() so the newest sample sits at 0.
+WINDOW_CHANNELS = ("t", "ax", "ay", "az", "gx", "gy", "gz", "hr", "lat", "lng")
+CH = {name: i for i, name in enumerate(WINDOW_CHANNELS)}
+N_CHANNELS = len(WINDOW_CHANNELS)
+
+
+class DeviceWindows:
+    """
+    Sliding window of the last N samples for every active device, stored in one
+    preallocated (slots, window, channels) array. Appending a sample is a single
+    row write; gathering every dirty device's window is one fancy-index.
+    """
+
+    def __init__(self, window: int = WINDOW_SIZE, initial_slots: int = 64):
+        self.window = window
+        self.buf = np.zeros((initial_slots, window, N_CHANNELS), dtype=np.float64)
+        self.head = np.zeros(initial_slots, dtype=np.int64)    # next row to write
+        self.count = np.zeros(initial_slots, dtype=np.int64)   # samples seen (capped at window)
+        self.dirty = np.zeros(initial_slots, dtype=bool)       # new data since last gather
+        self.last_seen = np.zeros(initial_slots, dtype=np.float64)
+        self.slots: Dict[str, int] = {}
+        self.devices: List[Optional[str]] = [None] * initial_slots
+        self.free: List[int] = list(range(initial_slots - 1, -1, -1))
+
+    def _grow(self) -> None:
+        old = len(self.head)
+        new = old * 2
+        buf = np.zeros((new, self.window, N_CHANNELS), dtype=np.float64)
+        buf[:old] = self.buf
+        self.buf = buf
+        for name in ("head", "count", "last_seen"):
+            arr = getattr(self, name)
+            grown = np.zeros(new, dtype=arr.dtype)
+            grown[:old] = arr
+            setattr(self, name, grown)
+        dirty = np.zeros(new, dtype=bool)
+        dirty[:old] = self.dirty
+        self.dirty = dirty
+        self.devices.extend([None] * (new - old))
+        self.free.extend(range(new - 1, old - 1, -1))
+
+    def _slot(self, device_id: str) -> int:
+        slot = self.slots.get(device_id)
+        if slot is None:
+            if not self.free:
+                self.evict_idle(time.monotonic())
+            if not self.free:
+                self._grow()
+            slot = self.free.pop()
+            self.slots[device_id] = slot
+            self.devices[slot] = device_id
+            self.head[slot] = 0
+            self.count[slot] = 0
+        return slot
+
+    def push(self, device_id: str, row: Sequence[float]) -> int:
+        """Append one sample (values in WINDOW_CHANNELS order; t = epoch seconds)."""
+        slot = self._slot(device_id)
+        h = self.head[slot]
+        self.buf[slot, h] = row
+        self.head[slot] = (h + 1) % self.window
+        if self.count[slot] < self.window:
+            self.count[slot] += 1
+        self.dirty[slot] = True
+        self.last_seen[slot] = time.monotonic()
+        return slot
+
+    def evict_idle(self, now: float, idle_s: float = IDLE_EVICT_SECONDS) -> None:
+        for device_id, slot in list(self.slots.items()):
+            if now - self.last_seen[slot] > idle_s:
+                del self.slots[device_id]
+                self.devices[slot] = None
+                self.dirty[slot] = False
+                self.free.append(slot)
+
+    def take_dirty(self) -> np.ndarray:
+        """Slots with new data and a full window; clears their dirty flag."""
+        slots = np.flatnonzero(self.dirty & (self.count >= self.window))
+        self.dirty[slots] = False
+        return slots
+
+    def gather(self, slots: np.ndarray) -> np.ndarray:
+        """
+        (len(slots), window, channels) float64 batch, oldest sample first,
+        with t rebased so the newest sample is at 0. Kept in float64: float32
+        lat/lng would put metres of noise into GPS-derived speed.
+        """
+        order = (self.head[slots][:, None] + np.arange(self.window)[None, :]) % self.window
+        batch = self.buf[slots[:, None], order]
+        batch[:, :, CH["t"]] -= batch[:, -1:, CH["t"]]
+        return batch
+
+    def newest(self, slot: int) -> np.ndarray:
+        """Newest raw sample of a slot (absolute t)."""
+        return self.buf[slot, (self.head[slot] - 1) % self.window]
+
+    def newest_ts(self, slots: np.ndarray) -> np.ndarray:
+        """Epoch seconds of each slot's newest sample (the window end)."""
+        return self.buf[slots, (self.head[slots] - 1) % self.window, CH["t"]]
+
+    def device_of(self, slots: np.ndarray) -> List[str]:
+        return [self.devices[s] for s in slots]
+
+
+def sliding_windows(samples: np.ndarray, window: int = WINDOW_SIZE, stride: int = 1) -> np.ndarray:
+    """
+    Offline counterpart of DeviceWindows.gather() for one device's recorded
+    samples (N, channels): every full window starting at 0, stride, 2*stride...
+    in the same layout (oldest first, t rebased to the newest sample).
+    Returns (M, window, channels) as a copy.
+    """
+    if len(samples) < window:
+        return np.zeros((0, window, samples.shape[1]), dtype=np.float64)
+    view = np.lib.stride_tricks.sliding_window_view(samples, window, axis=0)[::stride]
+    # np.array, not ascontiguousarray: a lone window is already contiguous and
+    # would come back as the read-only view
+    batch = np.array(np.moveaxis(view, -1, 1), dtype=np.float64, order="C")
+    batch[:, :, CH["t"]] -= batch[:, -1:, CH["t"]]
+    return batch
+
+
+def sample_row(ts_epoch: float, ax: float, ay: float, az: float,
+               gx: float, gy: float, gz: float, hr: float,
+               lat: float, lng: float) -> Tuple[float, ...]:
+    """One window row in WINDOW_CHANNELS order."""
+    return (ts_epoch, ax, ay, az, gx, gy, gz, hr, lat, lng)
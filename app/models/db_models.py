@@ -4,8 +4,10 @@ from __future__ import annotations
 import uuid
 from datetime import datetime
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
+    Date,
     DateTime,
     Float,
     ForeignKey,
@@ -19,7 +21,16 @@ from sqlalchemy import (
     Index,
 )
 from sqlalchemy.dialects.mysql import BIGINT
-from sqlalchemy.orm import DeclarativeBase, relationship
+from sqlalchemy.orm import DeclarativeBase, relationship, synonym
+
+
+# Auto-increment 64-bit key: unsigned BIGINT on MySQL, INTEGER on SQLite
+# (SQLite only auto-increments an "INTEGER PRIMARY KEY" column).
+BigIntPK = (
+    BigInteger()
+    .with_variant(BIGINT(unsigned=True), "mysql")
+    .with_variant(Integer(), "sqlite")
+)
 
 
 # Base class for all ORM models
@@ -83,6 +94,9 @@ class Device(Base):
 # --------------------------------------------------------------------
 class Trip(Base):
     __tablename__ = "trips"
+    __table_args__ = (
+        Index("idx_trip_user_start", "user_id", "start_time"),
+    )
 
     trip_id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String(128), ForeignKey("users.user_id"), nullable=True)
@@ -121,16 +135,18 @@ class TripData(Base):
     __tablename__ = "trip_data"
     __table_args__ = (
         Index("idx_trip_device_time", "trip_id", "device_id", "timestamp"),
+        # Location queries: a trip's fixes in a latitude band (geo_index refine)
+        Index("idx_trip_data_trip_lat", "trip_id", "lat"),
     )
 
-    data_id = Column(BIGINT(unsigned=True), primary_key=True, autoincrement=True)
+    data_id = Column(BigIntPK, primary_key=True, autoincrement=True)
     trip_id = Column(String(36), ForeignKey("trips.trip_id", ondelete="SET NULL"), index=True, nullable=True)
     device_id = Column(String(64), ForeignKey("devices.device_id", ondelete="SET NULL"), index=True)
 
     timestamp = Column(DateTime, index=True)
     lat = Column(Float, nullable=True)
     lng = Column(Float, nullable=True)
-    # speed = Column(Float, nullable=True)
+    speed = Column(Float, nullable=True)    # km/h, derived server-side (analytics_service.SpeedTracker)
     # accuracy = Column(Float, nullable=True)
 
     acc_x = Column(Float)
@@ -168,6 +184,7 @@ class Alert(Base):
 
     ts = Column(DateTime, index=True)
     type = Column(String(64))  # crash, high_hr, battery_low, etc.
+    alert_type = synonym("type")  # name used by repos and AlertOut
     severity = Column(String(32))  # info, warning, critical
     message = Column(Text)
     payload_json = Column(JSON)
@@ -176,3 +193,96 @@ class Alert(Base):
     resolved_by = Column(String(128), nullable=True)
 
     trip = relationship("Trip", back_populates="alerts")
+
+
+# --------------------------------------------------------------------
+# PREDICTIONS (server model outputs, sampled)
+# --------------------------------------------------------------------
+class Prediction(Base):
+    __tablename__ = "predictions"
+    __table_args__ = (
+        Index("idx_prediction_trip_time", "trip_id", "window_end"),
+        Index("idx_prediction_device_time", "device_id", "window_end"),
+    )
+
+    prediction_id = Column(BigIntPK, primary_key=True, autoincrement=True)
+    trip_id = Column(String(36), ForeignKey("trips.trip_id", ondelete="SET NULL"), nullable=True)
+    device_id = Column(String(64), ForeignKey("devices.device_id", ondelete="SET NULL"))
+
+    window_end = Column(DateTime)  # timestamp of the newest sample in the window
+    model_version = Column(String(128), index=True)
+    probability = Column(Float)
+    positive = Column(Boolean, default=False)  # probability >= threshold at scoring time
+    # Negatives are sampled 1-in-N; weight N restores true rates in evaluation
+    sample_weight = Column(Integer, default=1)
+    features = Column(JSON)  # {feature_name: value}
+
+    created_at = Column(DateTime, server_default=func.now())
+
+
+# --------------------------------------------------------------------
+# HEART-RATE BASELINES (per device / rider, for anomaly detection)
+# --------------------------------------------------------------------
+class HRBaseline(Base):
+    __tablename__ = "hr_baselines"
+
+    device_id = Column(String(64), ForeignKey("devices.device_id", ondelete="CASCADE"), primary_key=True)
+    mean = Column(Float)        # EWMA of resting/riding HR, bpm
+    var = Column(Float)         # EWMA variance, bpm^2
+    samples = Column(Integer)   # clean samples folded in (warm-up tracking)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+# --------------------------------------------------------------------
+# USER DAILY STATS (per-user aggregates, one row per local day)
+# --------------------------------------------------------------------
+class UserDailyStats(Base):
+    __tablename__ = "user_daily_stats"
+
+    user_id = Column(String(128), ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)    # local day (USER_STATS_TIMEZONE) the trips started on
+    trips = Column(Integer, default=0)
+    distance_km = Column(Float, default=0.0)
+    ride_seconds = Column(Float, default=0.0)
+    crashes = Column(Integer, default=0)
+    max_speed = Column(Float, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+# --------------------------------------------------------------------
+# TRIP CELLS (spatial index: grid cells each trip passed through)
+# --------------------------------------------------------------------
+class TripCell(Base):
+    __tablename__ = "trip_cells"
+    __table_args__ = (
+        Index("idx_trip_cell_level_cell", "level", "cell"),
+    )
+
+    trip_id = Column(String(36), ForeignKey("trips.trip_id", ondelete="CASCADE"), primary_key=True)
+    level = Column(Integer, primary_key=True)   # index into geo_index.CELL_SIZES_DEG
+    cell = Column(BigInteger, primary_key=True, autoincrement=False)
+
+
+# --------------------------------------------------------------------
+# GEO-FENCES (circle / polygon areas watched per device)
+# --------------------------------------------------------------------
+class GeoFence(Base):
+    __tablename__ = "geo_fences"
+
+    fence_id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String(128), ForeignKey("users.user_id", ondelete="CASCADE"), index=True)
+    device_id = Column(String(64), ForeignKey("devices.device_id", ondelete="CASCADE"), index=True)
+
+    name = Column(String(128))
+    kind = Column(String(16))                   # circle / polygon
+    center_lat = Column(Float, nullable=True)   # circle
+    center_lng = Column(Float, nullable=True)
+    radius_m = Column(Float, nullable=True)
+    vertices = Column(JSON, nullable=True)      # polygon: [[lat, lng], ...]
+
+    alert_on = Column(String(16), default="both")   # enter / exit / both
+    severity = Column(String(32), default="warning")
+    active = Column(Boolean, default=True)
+
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -1,7 +1,7 @@
 # app/models/schemas.py
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 from typing import Optional, Literal, Any
 from zoneinfo import ZoneInfo
@@ -42,6 +42,13 @@ class Severity(str, Enum):
     critical = "critical"
 
 
+class StreamField(str, Enum):
+    gps = "gps"
+    imu = "imu"
+    hr = "hr"
+    alerts = "alerts"
+
+
 # -----------------------------
 # Common sensor blocks
 # -----------------------------
@@ -184,6 +191,28 @@ class AlertIn(BaseModel):
         return v
 
 
+# -----------------------------
+# /ws/stream control messages (from dashboard)
+# -----------------------------
+class StreamControlIn(BaseModel):
+    """
+    Subscribe/unsubscribe request sent by a dashboard over /ws/stream.
+    A socket that never subscribed receives everything (legacy behaviour);
+    once it has, unsubscribing its last id leaves it receiving nothing until
+    it subscribes again or sends "reset" (back to everything).
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    action: Literal["subscribe", "unsubscribe", "reset"]
+    id: str = "default"
+    # None = every device the user can see
+    device_ids: Optional[list[str]] = None
+    # None = every field group
+    fields: Optional[list[StreamField]] = None
+    # messages per second, per device; capped by the server-wide limit
+    max_rate: Optional[float] = Field(default=None, gt=0)
+
+
 # -----------------------------
 # Server outputs / API reads
 # -----------------------------
@@ -374,6 +403,17 @@ class TripSummaryOut(BaseModel):
                 setattr(self, field, val.astimezone(beirut))
         return self
 
+class TripNearOut(TripSummaryOut):
+    distance_m: float              # closest approach to the query point
+    closest_ts: datetime           # when it happened
+
+    @model_validator(mode="after")
+    def convert_closest_ts(self):
+        if self.closest_ts.tzinfo is None:
+            self.closest_ts = self.closest_ts.replace(tzinfo=ZoneInfo("UTC"))
+        self.closest_ts = self.closest_ts.astimezone(ZoneInfo("Asia/Beirut"))
+        return self
+
 class TripDetailOut(TripSummaryOut):
     max_speed: Optional[float]
     average_heart_rate: Optional[float]
@@ -451,6 +491,77 @@ class UserUpdate(BaseModel):
     email: Optional[str] = None
     phone_number: Optional[str] = None
 
+class UserStatsOut(BaseModel):
+    period: Literal["day", "week", "month", "year", "all"]
+    since: Optional[date] = None      # first local day of the period (None = all time)
+    trips: int = 0
+    ride_days: int = 0
+    distance_km: float = 0.0
+    ride_seconds: float = 0.0         # trip durations, start to end
+    average_speed: float = 0.0        # km/h over ride_seconds
+    max_speed: Optional[float] = None
+    crashes: int = 0
+
+class GeoFenceIn(BaseModel):
+    """A circle (center + radius_m) or polygon ([[lat, lng], ...]) for one device."""
+    model_config = ConfigDict(extra="forbid")
+
+    name: str = Field(min_length=1, max_length=128)
+    kind: Literal["circle", "polygon"]
+    center_lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    center_lng: Optional[float] = Field(default=None, ge=-180, le=180)
+    radius_m: Optional[float] = Field(default=None, gt=0, le=50_000)
+    vertices: Optional[list[tuple[float, float]]] = Field(default=None, min_length=3, max_length=500)
+    alert_on: Literal["enter", "exit", "both"] = "both"
+    severity: Severity = Severity.warning
+    active: bool = True
+
+    @model_validator(mode="after")
+    def check_shape(self):
+        if self.kind == "circle":
+            if self.center_lat is None or self.center_lng is None or self.radius_m is None:
+                raise ValueError("circle fences need center_lat, center_lng and radius_m")
+            self.vertices = None
+        else:
+            if not self.vertices:
+                raise ValueError("polygon fences need at least 3 vertices")
+            for lat, lng in self.vertices:
+                if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                    raise ValueError("vertices must be [lat, lng] pairs")
+            lats = [v[0] for v in self.vertices]
+            lngs = [v[1] for v in self.vertices]
+            if max(lats) - min(lats) > 1.0 or max(lngs) - min(lngs) > 1.0:
+                raise ValueError("polygon fences may span at most 1 degree each way")
+            self.center_lat = self.center_lng = self.radius_m = None
+        return self
+
+class GeoFenceOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    fence_id: str
+    device_id: str
+    name: str
+    kind: Literal["circle", "polygon"]
+    center_lat: Optional[float] = None
+    center_lng: Optional[float] = None
+    radius_m: Optional[float] = None
+    vertices: Optional[list[tuple[float, float]]] = None
+    alert_on: Literal["enter", "exit", "both"]
+    severity: Severity
+    active: bool
+    inside: Optional[bool] = None     # device currently inside (None: no fix yet)
+    created_at: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def convert_timezones(self):
+        beirut = ZoneInfo("Asia/Beirut")
+        utc = ZoneInfo("UTC")
+        if self.created_at is not None:
+            if self.created_at.tzinfo is None:
+                self.created_at = self.created_at.replace(tzinfo=utc)
+            self.created_at = self.created_at.astimezone(beirut)
+        return self
+
 class RoutePoint(BaseModel):
     lat: float
     lng: float
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from datetime import datetime
-from typing import Optional, Sequence, Iterable
+from typing import AsyncIterator, Optional, Sequence, Iterable
 
 from sqlalchemy import select, update, insert
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -101,6 +101,18 @@ async def range_for_trip(
     return tuple(res.scalars().all())
 
 
+async def stream_for_trip(
+    db: AsyncSession,
+    trip_id: str,
+    chunk_size: int = 500,
+) -> AsyncIterator[Alert]:
+    """range_for_trip() for a whole trip from a server-side cursor, one row at a time."""
+    q = select(Alert).where(Alert.trip_id == trip_id).order_by(Alert.ts.asc())
+    result = await db.stream_scalars(q.execution_options(yield_per=chunk_size))
+    async for row in result:
+        yield row
+
+
 async def recent_for_user(
     db: AsyncSession,
     user_id: str,
@@ -3,11 +3,12 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional, Sequence
 
-from sqlalchemy import select, update, delete
+from sqlalchemy import event, select, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from app.models.db_models import Device, UserDevice
+from app.services.device_owner_cache import owner_cache
 
 
 # --------- DEVICE ROWS ---------
@@ -41,6 +42,14 @@ async def update_last_seen(db: AsyncSession, device_id: str, ts: datetime) -> No
 
 # --------- OWNERSHIP (USER <-> DEVICE) ---------
 
+def _invalidate_on_commit(db: AsyncSession, device_id: str) -> None:
+    """
+    Drop the device's cached watchers once the caller commits. Invalidating
+    any earlier lets a concurrent lookup re-cache the old links.
+    """
+    event.listen(db.sync_session, "after_commit", lambda _session: owner_cache.invalidate(device_id), once=True)
+
+
 async def claim_device_to_user(
     db: AsyncSession,
     user_id: str,
@@ -92,6 +101,9 @@ async def claim_device_to_user(
             .values(user_id=user_id)
         )
 
+    # Live streams must follow the new link
+    _invalidate_on_commit(db, device_id)
+
 
 async def unclaim_device_from_user(db: AsyncSession, user_id: str, device_id: str) -> None:
     """Remove a user<->device link (does not delete the device itself)."""
@@ -101,6 +113,7 @@ async def unclaim_device_from_user(db: AsyncSession, user_id: str, device_id: st
             UserDevice.device_id == device_id,
         )
     )
+    _invalidate_on_commit(db, device_id)
 
 
 async def list_user_devices(db: AsyncSession, user_id: str) -> Sequence[Device]:
@@ -117,6 +130,22 @@ async def list_user_devices(db: AsyncSession, user_id: str) -> Sequence[Device]:
     return tuple(res.scalars().all())
 
 
+async def list_device_user_ids(db: AsyncSession, device_id: str) -> Sequence[str]:
+    """
+    Every user allowed to watch a device: the denormalized Device.user_id
+    plus all UserDevice links (owners and viewers).
+    """
+    res = await db.execute(
+        select(UserDevice.user_id).where(UserDevice.device_id == device_id)
+    )
+    user_ids = {uid for uid in res.scalars().all() if uid}
+    owner = await db.execute(select(Device.user_id).where(Device.device_id == device_id))
+    owner_id = owner.scalar_one_or_none()
+    if owner_id:
+        user_ids.add(owner_id)
+    return tuple(sorted(user_ids))
+
+
 # --- New Methods for API ---
 
 class DevicesRepo:
@@ -0,0 +1,44 @@
+from __future__ import annotations
+from typing import Optional, Sequence
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.db_models import GeoFence
+
+
+async def create_fence(db: AsyncSession, user_id: str, device_id: str, **fields) -> GeoFence:
+    """Add a fence (fields: GeoFence columns). Caller commits."""
+    fence = GeoFence(user_id=user_id, device_id=device_id, **fields)
+    db.add(fence)
+    await db.flush()
+    return fence
+
+
+async def get_fence(db: AsyncSession, fence_id: str) -> Optional[GeoFence]:
+    res = await db.execute(select(GeoFence).where(GeoFence.fence_id == fence_id))
+    return res.scalar_one_or_none()
+
+
+async def list_device_fences(db: AsyncSession, device_id: str) -> Sequence[GeoFence]:
+    res = await db.execute(
+        select(GeoFence).where(GeoFence.device_id == device_id).order_by(GeoFence.created_at)
+    )
+    return tuple(res.scalars().all())
+
+
+async def list_active_fences(db: AsyncSession) -> Sequence[GeoFence]:
+    """Every active fence (the in-memory index is built from these)."""
+    res = await db.execute(select(GeoFence).where(GeoFence.active.is_(True)))
+    return tuple(res.scalars().all())
+
+
+async def fences_signature(db: AsyncSession) -> tuple:
+    """(count, newest updated_at): changes whenever a fence is added, edited or removed."""
+    res = await db.execute(select(func.count(), func.max(GeoFence.updated_at)))
+    return tuple(res.one())
+
+
+async def delete_fence(db: AsyncSession, fence_id: str) -> None:
+    """Caller commits."""
+    await db.execute(delete(GeoFence).where(GeoFence.fence_id == fence_id))
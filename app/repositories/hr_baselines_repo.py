@@ -0,0 +1,37 @@
+from __future__ import annotations
+from typing import Iterable, Sequence
+
+from sqlalchemy import select, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.db_models import HRBaseline
+
+
+async def load_baselines(db: AsyncSession) -> Sequence[tuple]:
+    """All stored baselines as (device_id, mean, var, samples) tuples."""
+    res = await db.execute(
+        select(HRBaseline.device_id, HRBaseline.mean, HRBaseline.var, HRBaseline.samples)
+    )
+    return tuple(res.all())
+
+
+async def upsert_baselines(db: AsyncSession, rows: Iterable[dict]) -> int:
+    """
+    Write many baselines (keys: device_id, mean, var, samples) in two bulk
+    statements: one UPDATE by primary key for known devices, one INSERT for
+    the rest. Caller commits.
+    """
+    batch = list(rows)
+    if not batch:
+        return 0
+    ids = [r["device_id"] for r in batch]
+    res = await db.execute(select(HRBaseline.device_id).where(HRBaseline.device_id.in_(ids)))
+    existing = set(res.scalars().all())
+
+    updates = [r for r in batch if r["device_id"] in existing]
+    inserts = [r for r in batch if r["device_id"] not in existing]
+    if updates:
+        await db.execute(update(HRBaseline), updates)
+    if inserts:
+        await db.execute(insert(HRBaseline), inserts)
+    return len(batch)
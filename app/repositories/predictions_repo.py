@@ -0,0 +1,117 @@
+from __future__ import annotations
+from datetime import datetime
+from typing import Optional, Sequence, Iterable
+
+from sqlalchemy import select, insert, func, cast, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.db_models import Prediction
+
+
+# -----------------------------
+# CREATE
+# -----------------------------
+async def bulk_insert_predictions(db: AsyncSession, rows: Iterable[dict]) -> int:
+    """
+    Core multi-row INSERT for a buffered batch of predictions (not committed).
+    Keys: device_id, trip_id?, window_end, model_version, probability,
+          positive, sample_weight, features
+    """
+    batch = list(rows)
+    if not batch:
+        return 0
+    await db.execute(insert(Prediction), batch)
+    return len(batch)
+
+
+# -----------------------------
+# READ
+# -----------------------------
+async def range_for_trip(
+    db: AsyncSession,
+    trip_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model_version: Optional[str] = None,
+    positives_only: bool = False,
+    limit: int = 5000,
+    offset: int = 0,
+) -> Sequence[Prediction]:
+    """
+    Predictions for one trip in window order, e.g. to line model output up
+    against labelled crashes when evaluating a model version.
+    """
+    conds = [Prediction.trip_id == trip_id]
+    if start is not None:
+        conds.append(Prediction.window_end >= start)
+    if end is not None:
+        conds.append(Prediction.window_end <= end)
+    if model_version is not None:
+        conds.append(Prediction.model_version == model_version)
+    if positives_only:
+        conds.append(Prediction.positive.is_(True))
+
+    q = (
+        select(Prediction)
+        .where(*conds)
+        .order_by(Prediction.window_end.asc())
+        .limit(limit)
+        .offset(offset)
+    )
+    res = await db.execute(q)
+    return tuple(res.scalars().all())
+
+
+async def summary_for_trip(db: AsyncSession, trip_id: str) -> Sequence[dict]:
+    """
+    Per model version: logged rows, weighted window count (negatives scaled
+    back up by their sampling weight), positives and peak probability.
+    """
+    q = (
+        select(
+            Prediction.model_version,
+            func.count(),
+            func.sum(Prediction.sample_weight),
+            func.sum(cast(Prediction.positive, Integer)),
+            func.max(Prediction.probability),
+        )
+        .where(Prediction.trip_id == trip_id)
+        .group_by(Prediction.model_version)
+    )
+    res = await db.execute(q)
+    return tuple(
+        {
+            "model_version": version,
+            "rows": rows,
+            "windows": int(windows or 0),
+            "positives": int(positives or 0),
+            "max_probability": max_prob,
+        }
+        for version, rows, windows, positives, max_prob in res.all()
+    )
+
+
+class PredictionsRepo:
+    """
+    Static wrapper class for better import usage in endpoints.
+    """
+    @staticmethod
+    async def bulk_insert(db: AsyncSession, rows: Iterable[dict]) -> int:
+        return await bulk_insert_predictions(db, rows)
+
+    @staticmethod
+    async def get_trip_predictions(
+        db: AsyncSession,
+        trip_id: str,
+        model_version: Optional[str] = None,
+        limit: int = 5000,
+        offset: int = 0,
+    ) -> Sequence[Prediction]:
+        return await range_for_trip(db, trip_id, model_version=model_version, limit=limit, offset=offset)
+
+    @staticmethod
+    async def get_trip_summary(db: AsyncSession, trip_id: str) -> Sequence[dict]:
+        return await summary_for_trip(db, trip_id)
+
+
+# Repos don’t call commit() — the caller batches operations and commits once.
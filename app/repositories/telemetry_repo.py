@@ -1,8 +1,8 @@
 from __future__ import annotations
 from datetime import datetime
-from typing import Optional, Sequence, Iterable
+from typing import AsyncIterator, Optional, Sequence, Iterable
 
-from sqlalchemy import select, insert
+from sqlalchemy import select, insert, update, bindparam
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.db_models import TripData
@@ -25,7 +25,7 @@ async def insert_trip_data(
     trip_id: Optional[str] = None,
     lat: Optional[float] = None,
     lng: Optional[float] = None,
-    # speed: Optional[float] = None,
+    speed: Optional[float] = None,
     # accuracy: Optional[float] = None,
     heart_rate: Optional[float] = None,
     # impact_g: Optional[float] = None,
@@ -42,7 +42,7 @@ async def insert_trip_data(
         timestamp=timestamp,
         lat=lat,
         lng=lng,
-        # speed=speed,
+        speed=speed,
         # accuracy=accuracy,
         acc_x=acc_x,
         acc_y=acc_y,
@@ -156,6 +156,100 @@ async def get_range_for_trip(
 
 
 
+async def get_trip_fix_rows(db: AsyncSession, trip_id: str) -> Sequence[tuple]:
+    """(data_id, device_id, timestamp, lat, lng) of a trip's samples with a position, by device then time."""
+    res = await db.execute(
+        select(TripData.data_id, TripData.device_id, TripData.timestamp, TripData.lat, TripData.lng)
+        .where(TripData.trip_id == trip_id, TripData.lat.is_not(None), TripData.lng.is_not(None))
+        .order_by(TripData.device_id, TripData.timestamp)
+    )
+    return tuple(res.all())
+
+
+async def get_trip_columns(db: AsyncSession, trip_id: str, columns: Sequence[str]) -> Sequence[tuple]:
+    """A trip's stored samples as plain tuples (`columns` order), by time."""
+    res = await db.execute(
+        select(*(getattr(TripData, c) for c in columns))
+        .where(TripData.trip_id == trip_id)
+        .order_by(TripData.timestamp)
+    )
+    return tuple(res.all())
+
+
+async def bulk_update_speeds(db: AsyncSession, rows: Sequence[dict]) -> int:
+    """
+    Write many {"data_id", "speed"} rows as one executemany UPDATE by primary
+    key (Core: no ORM bookkeeping per row). Caller commits.
+    """
+    if not rows:
+        return 0
+    table = TripData.__table__
+    stmt = (
+        update(table)
+        .where(table.c.data_id == bindparam("b_id"))
+        .values(speed=bindparam("b_speed"))
+    )
+    conn = await db.connection()
+    await conn.execute(stmt, [{"b_id": r["data_id"], "b_speed": r["speed"]} for r in rows])
+    return len(rows)
+
+
+# -----------------------------
+# STREAM (OFFLINE JOBS)
+# -----------------------------
+# Column order yielded by stream_trip_samples()
+SAMPLE_COLUMNS = (
+    "trip_id", "device_id", "timestamp",
+    "acc_x", "acc_y", "acc_z", "gyro_x", "gyro_y", "gyro_z",
+    "heart_rate", "lat", "lng", "crash_flag",
+)
+
+
+async def stream_trip_samples(
+    db: AsyncSession,
+    trip_ids: Optional[Sequence[str]] = None,
+    chunk_size: int = 20_000,
+    columns: Sequence[str] = SAMPLE_COLUMNS,
+) -> AsyncIterator[Sequence[tuple]]:
+    """
+    Yield telemetry as chunks of plain tuples (`columns` order, SAMPLE_COLUMNS
+    by default), ordered by trip then time. Uses a streaming (server-side)
+    cursor, so memory stays at one chunk whatever the table size; no ORM
+    objects are built.
+    """
+    q = select(*(getattr(TripData, c) for c in columns)).where(TripData.trip_id.is_not(None))
+    if trip_ids:
+        q = q.where(TripData.trip_id.in_(list(trip_ids)))
+    q = q.order_by(TripData.trip_id, TripData.device_id, TripData.timestamp)
+
+    # Core-level stream on the session's connection: rows skip ORM loading
+    conn = await db.connection()
+    result = await conn.stream(q.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions(chunk_size):
+        yield rows
+
+
+async def stream_trip_columns(
+    db: AsyncSession,
+    trip_id: str,
+    columns: Sequence[str],
+    chunk_size: int = 5_000,
+) -> AsyncIterator[Sequence[tuple]]:
+    """
+    One trip's telemetry as chunks of plain tuples (`columns` order) by time,
+    from a server-side cursor: memory stays at one chunk however long the trip.
+    """
+    q = (
+        select(*(getattr(TripData, c) for c in columns))
+        .where(TripData.trip_id == trip_id)
+        .order_by(TripData.timestamp)
+    )
+    conn = await db.connection()
+    result = await conn.stream(q.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions(chunk_size):
+        yield rows
+
+
 # How this helps (super short)
 # insert_trip_data: save one incoming sample (used by your persistence worker).
 # bulk_insert_trip_data: save many samples at once (useful if you buffer 100–500 rows for speed).
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import Iterable, Sequence, Tuple
+
+from sqlalchemy import select, insert, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.db_models import Trip, TripCell, TripData
+
+
+def _insert_ignoring_duplicates(dialect: str):
+    """INSERT that skips rows whose key already exists, or None if the dialect has no such form."""
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        return dialect_insert(TripCell).on_conflict_do_nothing()
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+        return dialect_insert(TripCell).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return insert(TripCell).prefix_with("IGNORE")
+    return None
+
+
+async def insert_trip_cells(db: AsyncSession, rows: Iterable[dict]) -> int:
+    """
+    Store (trip_id, level, cell) rows in one INSERT, skipping ones already
+    present (ingest and backfill may both send a cell): ON CONFLICT DO
+    NOTHING on SQLite/PostgreSQL, INSERT IGNORE on MySQL. Other dialects
+    drop the known keys first. Caller commits.
+    """
+    batch = list(rows)
+    if not batch:
+        return 0
+    stmt = _insert_ignoring_duplicates(db.get_bind().dialect.name)
+    if stmt is None:
+        unique = {(r["trip_id"], r["level"], r["cell"]): r for r in batch}
+        res = await db.execute(
+            select(TripCell.trip_id, TripCell.level, TripCell.cell)
+            .where(tuple_(TripCell.trip_id, TripCell.level, TripCell.cell).in_(list(unique)))
+        )
+        existing = set(map(tuple, res.all()))
+        batch = [r for key, r in unique.items() if key not in existing]
+        if not batch:
+            return 0
+        stmt = insert(TripCell)
+    await db.execute(stmt, batch)
+    return len(batch)
+
+
+async def trips_in_cells(
+    db: AsyncSession,
+    user_id: str,
+    level: int,
+    cells: Sequence[int],
+) -> Sequence[str]:
+    """Candidate trips: the user's trips indexed under any of the cells."""
+    res = await db.execute(
+        select(TripCell.trip_id)
+        .join(Trip, Trip.trip_id == TripCell.trip_id)
+        .where(TripCell.level == level, TripCell.cell.in_(list(cells)), Trip.user_id == user_id)
+        .distinct()
+    )
+    return tuple(res.scalars().all())
+
+
+async def points_in_bbox(
+    db: AsyncSession,
+    trip_ids: Sequence[str],
+    bbox: Tuple[float, float, float, float],
+) -> Sequence[tuple]:
+    """(trip_id, timestamp, lat, lng) of candidate trips' fixes inside bbox, by trip then time."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    res = await db.execute(
+        select(TripData.trip_id, TripData.timestamp, TripData.lat, TripData.lng)
+        .where(
+            TripData.trip_id.in_(list(trip_ids)),
+            TripData.lat.between(min_lat, max_lat),
+            TripData.lng.between(min_lng, max_lng),
+        )
+        .order_by(TripData.trip_id, TripData.timestamp)
+    )
+    return tuple(res.all())
+
+
+async def trips_with_points_in_bbox(
+    db: AsyncSession,
+    trip_ids: Sequence[str],
+    bbox: Tuple[float, float, float, float],
+) -> Sequence[str]:
+    """Candidate trips that have at least one fix inside bbox."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    res = await db.execute(
+        select(TripData.trip_id)
+        .where(
+            TripData.trip_id.in_(list(trip_ids)),
+            TripData.lat.between(min_lat, max_lat),
+            TripData.lng.between(min_lng, max_lng),
+        )
+        .distinct()
+    )
+    return tuple(res.scalars().all())
+
+
+async def user_trips_with_points_in_bbox(
+    db: AsyncSession,
+    user_id: str,
+    bbox: Tuple[float, float, float, float],
+) -> Sequence[str]:
+    """The user's trips with at least one fix inside bbox, without the cell prefilter (large boxes)."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    res = await db.execute(
+        select(TripData.trip_id)
+        .join(Trip, Trip.trip_id == TripData.trip_id)
+        .where(
+            Trip.user_id == user_id,
+            TripData.lat.between(min_lat, max_lat),
+            TripData.lng.between(min_lng, max_lng),
+        )
+        .distinct()
+    )
+    return tuple(res.scalars().all())
+
+
+async def trips_starting_in(
+    db: AsyncSession,
+    user_id: str,
+    bbox: Tuple[float, float, float, float],
+    limit: int = 50,
+) -> Sequence[Trip]:
+    """The user's trips whose start point lies inside bbox, newest first."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    res = await db.execute(
+        select(Trip)
+        .where(
+            Trip.user_id == user_id,
+            Trip.start_lat.between(min_lat, max_lat),
+            Trip.start_lng.between(min_lng, max_lng),
+        )
+        .order_by(Trip.start_time.desc())
+        .limit(limit)
+    )
+    return tuple(res.scalars().all())
+
@@ -2,7 +2,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional, Sequence
 
-from sqlalchemy import select, update
+from sqlalchemy import select, update, exists
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.db_models import Trip
@@ -44,17 +44,24 @@ async def close_trip(
     end_lat: Optional[float] = None,
     end_lng: Optional[float] = None,
     crash_detected: Optional[bool] = None,
+    summary: Optional[dict] = None,
 ) -> None:
     """
     Mark a trip as completed (called when trip_end message arrives).
+    summary: final statistics from analytics_service (Trip column -> value),
+    written in the same UPDATE. Explicit end_lat/end_lng win over it.
     """
+    values = dict(summary or {})
+    if end_lat is not None or end_lng is not None:
+        values.update(end_lat=end_lat, end_lng=end_lng)
+    if crash_detected is None and summary is not None:
+        crash_detected = summary.get("crash_count", 0) > 0
     await db.execute(
         update(Trip)
         .where(Trip.trip_id == trip_id)
         .values(
+            **values,
             end_time=end_time,
-            end_lat=end_lat,
-            end_lng=end_lng,
             crash_detected=crash_detected,
             status="completed",
             updated_at=datetime.utcnow(),
@@ -114,6 +121,61 @@ async def list_trips_for_user(
 
 
 
+# -------------------------------
+# BULK STATISTICS
+# -------------------------------
+
+async def list_trips_for_recompute(
+    db: AsyncSession,
+    after: Optional[str] = None,
+    limit: int = 500,
+    missing_only: bool = True,
+) -> Sequence[str]:
+    """
+    Next page of closed trip ids (trip_id order, keyset after `after`) whose
+    stats need recomputing. missing_only: trips with no total_distance yet,
+    so a finished page drops out and an interrupted run resumes by itself.
+    """
+    q = select(Trip.trip_id).where(Trip.status != "recording")
+    if missing_only:
+        q = q.where(Trip.total_distance.is_(None))
+    if after is not None:
+        q = q.where(Trip.trip_id > after)
+    res = await db.execute(q.order_by(Trip.trip_id).limit(limit))
+    return tuple(res.scalars().all())
+
+
+async def list_trips_missing_speed(
+    db: AsyncSession,
+    after: Optional[str] = None,
+    limit: int = 100,
+    missing_only: bool = True,
+) -> Sequence[str]:
+    """
+    Next page of closed trip ids (keyset after `after`) for the speed
+    backfill. missing_only: trips none of whose samples has a speed yet.
+    """
+    from app.models.db_models import TripData
+
+    q = select(Trip.trip_id).where(Trip.status != "recording")
+    if missing_only:
+        q = q.where(~exists().where(TripData.trip_id == Trip.trip_id, TripData.speed.is_not(None)))
+    if after is not None:
+        q = q.where(Trip.trip_id > after)
+    res = await db.execute(q.order_by(Trip.trip_id).limit(limit))
+    return tuple(res.scalars().all())
+
+
+async def bulk_update_trip_stats(db: AsyncSession, rows: Sequence[dict]) -> int:
+    """
+    Write many trip summaries (trip_id + Trip columns) as one bulk UPDATE by
+    primary key. Caller commits.
+    """
+    if not rows:
+        return 0
+    await db.execute(update(Trip), list(rows))
+    return len(rows)
+
 
 # | Function                       | What it does                                                                          | Used by              |
 # | ------------------------------ | ------------------------------------------------------------------------------------- | -------------------- |
@@ -123,6 +185,9 @@ async def list_trips_for_user(
 # | `get_active_trip_for_device()` | Finds the open trip for a helmet; used when telemetry arrives but no trip_id is sent. | persistence worker   |
 # | `get_trip_by_id()`             | Fetches a single trip by ID (for APIs or debugging).                                  | API route            |
 # | `list_trips_for_user()`        | Lists all trips for a specific user (used for history pages).                         | `/api/v1/trips`      |
+# | `list_trips_for_recompute()`   | Pages closed trips whose stats are missing (or all, for a full rebuild).              | trip stats job       |
+# | `bulk_update_trip_stats()`     | Writes many trip summaries in one UPDATE.                                             | trip stats job       |
+# | `list_trips_missing_speed()`   | Pages closed trips whose samples have no derived speed yet.                           | speed backfill       |
 
 from app.models.db_models import TripData
 
@@ -134,6 +199,11 @@ class TripsRepo:
     async def get_trip(db: AsyncSession, trip_id: str) -> Optional[Trip]:
         return await get_trip_by_id(db, trip_id)
 
+    @staticmethod
+    async def get_trips(db: AsyncSession, trip_ids: Sequence[str]) -> Sequence[Trip]:
+        res = await db.execute(select(Trip).where(Trip.trip_id.in_(list(trip_ids))))
+        return tuple(res.scalars().all())
+
     @staticmethod
     async def get_user_trips(db: AsyncSession, user_id: str, limit: int = 50, offset: int = 0) -> Sequence[Trip]:
         return await list_trips_for_user(db, user_id, limit, offset)
@@ -156,6 +226,25 @@ class TripsRepo:
         res = await db.execute(q)
         return tuple(res.scalars().all())
 
+    @staticmethod
+    async def get_trip_route_rows(db: AsyncSession, trip_id: str) -> Sequence[tuple]:
+        """
+        (timestamp, lat, lng, speed) tuples for a trip's valid GPS points,
+        ordered by time. Plain columns, no ORM objects: routes run to tens of
+        thousands of rows.
+        """
+        q = (
+            select(TripData.timestamp, TripData.lat, TripData.lng, TripData.speed)
+            .where(
+                TripData.trip_id == trip_id,
+                TripData.lat.is_not(None),
+                TripData.lng.is_not(None)
+            )
+            .order_by(TripData.timestamp.asc())
+        )
+        res = await db.execute(q)
+        return tuple(res.all())
+
     @staticmethod
     async def get_last_known_location(db: AsyncSession, trip_id: str) -> Optional[TripData]:
         """
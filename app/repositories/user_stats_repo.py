@@ -0,0 +1,129 @@
+from __future__ import annotations
+from datetime import date, datetime
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import select, insert, update, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.db_models import Trip, UserDailyStats
+
+
+async def trip_starts(db: AsyncSession, trip_ids: Sequence[str]) -> Sequence[tuple]:
+    """(user_id, start_time) of the given trips that belong to a user."""
+    res = await db.execute(
+        select(Trip.user_id, Trip.start_time)
+        .where(Trip.trip_id.in_(list(trip_ids)), Trip.user_id.is_not(None))
+    )
+    return tuple(res.all())
+
+
+async def closed_trips_between(
+    db: AsyncSession,
+    user_id: str,
+    start: datetime,
+    end: datetime,
+) -> Sequence[tuple]:
+    """
+    (start_time, end_time, total_distance, crash_count, max_speed) of a user's
+    closed trips that started in [start, end) (naive UTC).
+    """
+    res = await db.execute(
+        select(Trip.start_time, Trip.end_time, Trip.total_distance, Trip.crash_count, Trip.max_speed)
+        .where(
+            Trip.user_id == user_id,
+            Trip.status != "recording",
+            Trip.start_time >= start,
+            Trip.start_time < end,
+        )
+    )
+    return tuple(res.all())
+
+
+async def list_trip_owner_starts(db: AsyncSession) -> Sequence[tuple]:
+    """(user_id, start_time) of every closed trip with an owner (full rebuild)."""
+    res = await db.execute(
+        select(Trip.user_id, Trip.start_time)
+        .where(Trip.user_id.is_not(None), Trip.status != "recording", Trip.start_time.is_not(None))
+    )
+    return tuple(res.all())
+
+
+async def count_daily_rows(db: AsyncSession) -> int:
+    res = await db.execute(select(func.count()).select_from(UserDailyStats))
+    return int(res.scalar_one())
+
+
+# Every column of a bucket but its (user_id, day) key
+_BUCKET_COLUMNS = ("trips", "distance_km", "ride_seconds", "crashes", "max_speed", "updated_at")
+
+
+def _upsert_statement(dialect: str):
+    """INSERT that overwrites a bucket already there, or None if the dialect has no such form."""
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(UserDailyStats)
+        return stmt.on_conflict_do_update(
+            index_elements=[UserDailyStats.user_id, UserDailyStats.day],
+            set_={c: stmt.excluded[c] for c in _BUCKET_COLUMNS},
+        )
+    if dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+        stmt = dialect_insert(UserDailyStats)
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in _BUCKET_COLUMNS})
+    return None
+
+
+async def upsert_daily_stats(db: AsyncSession, rows: Iterable[dict]) -> int:
+    """
+    Write many day buckets (keys: user_id, day + UserDailyStats columns).
+    Each row is a whole-day rebuild, so a bucket written meanwhile (another
+    worker closed a trip of the same day) is overwritten, not added to: one
+    INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE, so two closes can't
+    both take the INSERT path. Other dialects: UPDATE the existing buckets,
+    INSERT the rest. Caller commits.
+    """
+    batch = list(rows)
+    if not batch:
+        return 0
+    stmt = _upsert_statement(db.get_bind().dialect.name)
+    if stmt is not None:
+        await db.execute(stmt, batch)
+        return len(batch)
+
+    keys = [(r["user_id"], r["day"]) for r in batch]
+    res = await db.execute(
+        select(UserDailyStats.user_id, UserDailyStats.day)
+        .where(tuple_(UserDailyStats.user_id, UserDailyStats.day).in_(keys))
+    )
+    existing = set(map(tuple, res.all()))
+
+    updates = [r for r in batch if (r["user_id"], r["day"]) in existing]
+    inserts = [r for r in batch if (r["user_id"], r["day"]) not in existing]
+    if updates:
+        await db.execute(update(UserDailyStats), updates)
+    if inserts:
+        await db.execute(insert(UserDailyStats), inserts)
+    return len(batch)
+
+
+async def sum_daily_stats(db: AsyncSession, user_id: str, since: Optional[date] = None) -> tuple:
+    """
+    Totals over a user's buckets from `since` (inclusive; None = all time):
+    (days, trips, distance_km, ride_seconds, crashes, max_speed).
+    """
+    q = select(
+        func.count(),
+        func.coalesce(func.sum(UserDailyStats.trips), 0),
+        func.coalesce(func.sum(UserDailyStats.distance_km), 0.0),
+        func.coalesce(func.sum(UserDailyStats.ride_seconds), 0.0),
+        func.coalesce(func.sum(UserDailyStats.crashes), 0),
+        func.max(UserDailyStats.max_speed),
+    ).where(UserDailyStats.user_id == user_id, UserDailyStats.trips > 0)
+    if since is not None:
+        q = q.where(UserDailyStats.day >= since)
+    res = await db.execute(q)
+    return tuple(res.one())
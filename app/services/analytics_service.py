@@ -0,0 +1,458 @@
+# app/services/analytics_service.py
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.models.schemas import TelemetryIn
+from app.services.broadcaster import to_epoch
+from app.services.geo import haversine_m, haversine_m_scalar
+
+# GPS movement below this (metres) is treated as jitter: the anchor fix stays,
+# so a parked helmet doesn't accumulate phantom distance
+JITTER_M = 3.0
+# Implied speed above this (km/h) means a bad fix; it is skipped
+MAX_PLAUSIBLE_KMH = 250.0
+# Segments spanning a longer gap count toward distance but not toward speeds
+MAX_SEGMENT_GAP_S = 30.0
+# Flagged samples closer than this belong to the same crash
+CRASH_MERGE_S = 5.0
+# Speed at a fix: displacement of the smoothed position over this trailing
+# window. Under JITTER_M of displacement in the window reads as standing still
+SPEED_WINDOW_S = 2.0
+# Positions are smoothed as the mean of the fixes of this trailing window
+SMOOTH_S = 1.0
+# This many implausible fixes in a row: the position really jumped (e.g.
+# GPS reacquired elsewhere), so the speed track restarts from there
+MAX_REJECTS = 5
+# Trips with no telemetry this long drop their accumulator (the device went
+# away without a trip_end); the trip is rebuilt from stored rows when it closes
+IDLE_EVICT_SECONDS = 3600.0
+EVICT_SWEEP_SECONDS = 300.0
+
+
+class TripAccumulator:
+    """
+    Running trip summary, updated in O(1) per telemetry sample.
+    Distance in km, speeds in km/h (what the dashboard shows). max_speed is
+    the highest per-fix speed from SpeedTracker, passed in by the caller.
+    """
+    __slots__ = (
+        "complete",
+        "start_lat", "start_lng", "end_lat", "end_lng",
+        "anchor_lat", "anchor_lng", "anchor_ts",
+        "distance_m", "moving_m", "moving_s", "max_speed_kmh",
+        "hr_sum", "hr_count", "hr_max",
+        "crash_count", "last_crash_ts", "samples", "last_seen",
+    )
+
+    def __init__(self, complete: bool):
+        # False when created mid-trip (e.g. after a restart): totals would be
+        # partial, so they're not written and the recompute job fills them
+        self.complete = complete
+        self.start_lat = self.start_lng = None
+        self.end_lat = self.end_lng = None
+        self.anchor_lat = self.anchor_lng = None
+        self.anchor_ts = 0.0
+        self.distance_m = 0.0
+        self.moving_m = 0.0
+        self.moving_s = 0.0
+        self.max_speed_kmh = 0.0
+        self.hr_sum = 0.0
+        self.hr_count = 0
+        self.hr_max = None
+        self.crash_count = 0
+        self.last_crash_ts = None
+        self.samples = 0
+        self.last_seen = time.monotonic()
+
+    def add(self, obj: TelemetryIn, speed_kmh: Optional[float] = None) -> None:
+        self.samples += 1
+        self.last_seen = time.monotonic()
+        if speed_kmh is not None and speed_kmh > self.max_speed_kmh:
+            self.max_speed_kmh = speed_kmh
+
+        ts = to_epoch(obj.ts)
+        # Crashes: a crash spans several flagged samples, merged by time
+        if obj.crash_flag:
+            if self.last_crash_ts is None or ts - self.last_crash_ts > CRASH_MERGE_S:
+                self.crash_count += 1
+            self.last_crash_ts = ts
+
+        hrd = obj.heart_rate
+        if hrd.ok and hrd.finger and hrd.hr > 0:
+            self.hr_sum += hrd.hr
+            self.hr_count += 1
+            if self.hr_max is None or hrd.hr > self.hr_max:
+                self.hr_max = hrd.hr
+
+        gps = obj.gps
+        # (0, 0) too: stored rows carry no lock flag, so the offline pass
+        # can only recognise a missing fix by it
+        if not (gps.ok and gps.lock) or (gps.lat == 0 and gps.lng == 0):
+            return
+        if self.anchor_lat is None:
+            self.start_lat, self.start_lng = gps.lat, gps.lng
+            self.end_lat, self.end_lng = gps.lat, gps.lng
+            self.anchor_lat, self.anchor_lng, self.anchor_ts = gps.lat, gps.lng, ts
+            return
+        dt = ts - self.anchor_ts
+        if dt <= 0:
+            # Repeated or backwards device timestamp
+            return
+        d = haversine_m_scalar(self.anchor_lat, self.anchor_lng, gps.lat, gps.lng)
+        if d < JITTER_M or d / dt * 3.6 > MAX_PLAUSIBLE_KMH:
+            return
+        self.distance_m += d
+        if dt <= MAX_SEGMENT_GAP_S:
+            self.moving_m += d
+            self.moving_s += dt
+        self.anchor_lat, self.anchor_lng, self.anchor_ts = gps.lat, gps.lng, ts
+        self.end_lat, self.end_lng = gps.lat, gps.lng
+
+    def summary(self) -> dict:
+        """Trip column values, ready for the closing UPDATE."""
+        return _summary(
+            self.start_lat, self.start_lng, self.end_lat, self.end_lng,
+            self.distance_m, self.moving_m, self.moving_s, self.max_speed_kmh,
+            self.hr_sum, self.hr_count, self.hr_max, self.crash_count,
+        )
+
+
+def _summary(
+    start_lat, start_lng, end_lat, end_lng,
+    distance_m, moving_m, moving_s, max_speed_kmh,
+    hr_sum, hr_count, hr_max, crash_count,
+) -> dict:
+    return {
+        "start_lat": start_lat,
+        "start_lng": start_lng,
+        "end_lat": end_lat,
+        "end_lng": end_lng,
+        "total_distance": round(distance_m / 1000.0, 3),
+        "average_speed": round(moving_m / moving_s * 3.6, 2) if moving_s else 0.0,
+        "max_speed": round(max_speed_kmh, 2),
+        "average_heart_rate": round(hr_sum / hr_count, 1) if hr_count else None,
+        "max_heart_rate": hr_max,
+        "crash_count": crash_count,
+    }
+
+
+def _track_points(
+    t: np.ndarray,
+    lat: np.ndarray,
+    lng: np.ndarray,
+    jitter_m: float = JITTER_M,
+    max_rejects: Optional[int] = None,
+):
+    """
+    The live anchor rules over a stored track (valid fixes, time-ordered):
+    each fix is checked against the last kept one and rejected if it is out
+    of order, under jitter_m away or implausibly fast. With max_rejects, that
+    many implausible fixes in a row restart the track at the last of them
+    (SpeedTracker; jitter_m=0); without, the anchor holds (TripAccumulator).
+
+    Returns (kept indices, metres from the previous kept fix (0 where a track
+    starts), True where a track starts), fix for fix what the live trackers
+    keep. Every fix is first checked against its neighbour in one NumPy pass.
+    While the previous fix was kept, that check is the live one, so whole
+    runs of good fixes are accepted at once; only fixes after a rejection
+    (parked jitter, glitches) are checked one by one against the anchor.
+    """
+    n = len(t)
+    d_step = haversine_m(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    dt_step = np.diff(t)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        good = (dt_step > 0) & (d_step >= jitter_m) & (d_step / dt_step * 3.6 <= MAX_PLAUSIBLE_KMH)
+    bad = np.flatnonzero(~good) + 1     # fixes failing against their predecessor
+
+    tl, latl, lngl = t.tolist(), lat.tolist(), lng.tolist()
+    runs = [(0, 1)]                     # [a, b) ranges of kept fixes
+    restarts = []
+    anchor = 0
+    rejects = 0
+    i = 1
+    while i < n:
+        if anchor == i - 1:
+            # Anchor is the previous fix: accept up to the next failing step
+            b = int(bad[np.searchsorted(bad, i)]) if len(bad) and bad[-1] >= i else n
+            if b > i:
+                runs.append((i, b))
+                anchor = b - 1
+                i = b
+                continue
+        dt = tl[i] - tl[anchor]
+        if dt > 0:
+            d = haversine_m_scalar(latl[anchor], lngl[anchor], latl[i], lngl[i])
+            if d >= jitter_m:
+                restart = d / dt * 3.6 > MAX_PLAUSIBLE_KMH
+                if restart:
+                    rejects += 1
+                if not restart or (max_rejects is not None and rejects >= max_rejects):
+                    rejects = 0
+                    runs.append((i, i + 1))
+                    if restart:
+                        restarts.append(i)
+                    anchor = i
+        i += 1
+
+    idx = np.concatenate([np.arange(a, b) for a, b in runs])
+    # Distances of the bulk-accepted runs are their neighbour steps; fixes
+    # accepted on their own are measured from their (non-adjacent) anchor
+    prev = np.concatenate(([0], idx[:-1]))
+    dist = np.zeros(len(idx))
+    adjacent = (idx - prev) == 1
+    dist[adjacent] = d_step[idx[adjacent] - 1]
+    far = np.flatnonzero(~adjacent[1:]) + 1
+    if len(far):
+        dist[far] = haversine_m(lat[prev[far]], lng[prev[far]], lat[idx[far]], lng[idx[far]])
+    starts = np.zeros(len(idx), dtype=bool)
+    starts[0] = True
+    if restarts:
+        starts[np.searchsorted(idx, restarts)] = True
+        dist[starts] = 0.0
+    return idx, dist, starts
+
+
+def summarize_samples(
+    t: np.ndarray,
+    lat: np.ndarray,
+    lng: np.ndarray,
+    hr: np.ndarray,
+    crash_flag: np.ndarray,
+) -> dict:
+    """
+    Whole-trip summary from stored telemetry columns (time-ordered; t in epoch
+    seconds, missing values NaN). Same rules and output as TripAccumulator;
+    used to recompute trips in bulk. Stored rows carry no gps lock /
+    finger flags, so (0, 0) fixes and non-positive HR stand in for them.
+    """
+    hr_ok = hr > 0
+    hr_count = int(hr_ok.sum())
+    hr_sum = float(hr[hr_ok].sum()) if hr_count else 0.0
+    hr_max = float(hr[hr_ok].max()) if hr_count else None
+
+    crash_t = np.sort(t[crash_flag])
+    crash_count = 1 + int((np.diff(crash_t) > CRASH_MERGE_S).sum()) if len(crash_t) else 0
+
+    fix = np.isfinite(lat) & np.isfinite(lng) & ~((lat == 0) & (lng == 0))
+    t, lat, lng = t[fix], lat[fix], lng[fix]
+    if not len(t):
+        return _summary(None, None, None, None, 0.0, 0.0, 0.0, 0.0, hr_sum, hr_count, hr_max, crash_count)
+
+    idx, d, _ = _track_points(t, lat, lng)
+    d = d[1:]
+    dt = np.diff(t[idx])
+    moving = dt <= MAX_SEGMENT_GAP_S
+    # cumsum adds in order, as the accumulator does; sum() would pair terms
+    distance_m = float(np.cumsum(d)[-1]) if len(d) else 0.0
+    moving_m = float(np.cumsum(np.where(moving, d, 0.0))[-1]) if len(d) else 0.0
+    moving_s = float(np.cumsum(np.where(moving, dt, 0.0))[-1]) if len(d) else 0.0
+    speeds = _fix_speeds(t, lat, lng)
+    max_kmh = float(np.nanmax(speeds)) if np.isfinite(speeds).any() else 0.0
+    last = idx[-1]
+    return _summary(
+        float(lat[0]), float(lng[0]), float(lat[last]), float(lng[last]),
+        distance_m, moving_m, moving_s, max_kmh,
+        hr_sum, hr_count, hr_max, crash_count,
+    )
+
+
+# -----------------------
+# Speed
+# -----------------------
+
+def _fix_speeds(t: np.ndarray, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """
+    km/h at every fix of a track (valid fixes, time-ordered, t in epoch
+    seconds): SpeedTracker's rules, the smoothing and windows vectorized over
+    the fixes _track_points keeps. Rejected fixes carry the previous speed;
+    NaN where unknown (first SPEED_WINDOW_S of a track, across gaps).
+    """
+    idx, _, starts = _track_points(t, lat, lng, jitter_m=0.0, max_rejects=MAX_REJECTS)
+    tk, klat, klng = t[idx], lat[idx], lng[idx]
+    n = len(tk)
+    k = np.arange(n)
+    # A restarted track forgets everything before it
+    first = np.maximum.accumulate(np.where(starts, k, 0))
+    # Smoothed positions: mean over the trailing SMOOTH_S (running sums)
+    a = np.maximum(np.searchsorted(tk, tk - SMOOTH_S, side="left"), first)
+    count = k + 1 - a
+    cs_lat = np.concatenate(([0.0], np.cumsum(klat - klat[0])))
+    cs_lng = np.concatenate(([0.0], np.cumsum(klng - klng[0])))
+    plat = klat[0] + (cs_lat[k + 1] - cs_lat[a]) / count
+    plng = klng[0] + (cs_lng[k + 1] - cs_lng[a]) / count
+
+    # Displacement since the last fix at least SPEED_WINDOW_S older
+    j = np.searchsorted(tk, tk - SPEED_WINDOW_S, side="right") - 1
+    kept = np.full(n, np.nan)
+    has = j >= first
+    jh = j[has]
+    span = tk[has] - tk[jh]
+    d = haversine_m(plat[jh], plng[jh], plat[has], plng[has])
+    v = np.where(d < JITTER_M, 0.0, d / span * 3.6)
+    kept[has] = np.where(span <= MAX_SEGMENT_GAP_S, v, np.nan)
+
+    # Rejected fixes carry the last kept fix's speed
+    prev = np.searchsorted(idx, np.arange(len(t)), side="right") - 1
+    return kept[prev]
+
+
+def derive_speeds(t: np.ndarray, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """
+    Per-sample speed (km/h, NaN = unknown) for one device's stored samples,
+    time-ordered, t in epoch seconds. Vectorized version of SpeedTracker for
+    backfills; samples without a fix (NaN or (0, 0)) get NaN.
+    """
+    speed = np.full(len(t), np.nan)
+    fix = np.flatnonzero(np.isfinite(lat) & np.isfinite(lng) & ~((lat == 0) & (lng == 0)))
+    if len(fix):
+        speed[fix] = _fix_speeds(t[fix], lat[fix], lng[fix])
+    return speed
+
+
+class _SpeedState:
+    __slots__ = ("lat", "lng", "t", "origin", "recent", "sum_lat", "sum_lng", "history", "speed", "rejects")
+
+    def __init__(self, lat: float, lng: float, t: float):
+        self.lat, self.lng, self.t = lat, lng, t    # last kept fix
+        self.origin = (lat, lng)                    # sums are kept relative to it
+        self.recent = deque()                       # (t, lat, lng) of the last SMOOTH_S
+        self.sum_lat = self.sum_lng = 0.0           # over `recent`, relative to the first fix
+        self.history = deque()                      # (t, smoothed lat, lng) for the window
+        self.speed: Optional[float] = None
+        self.rejects = 0
+        self.accept(lat, lng, t)
+
+    def accept(self, lat: float, lng: float, t: float) -> Optional[float]:
+        self.rejects = 0
+        self.lat, self.lng, self.t = lat, lng, t
+        o_lat, o_lng = self.origin
+        recent = self.recent
+        recent.append((t, lat - o_lat, lng - o_lng))
+        self.sum_lat += lat - o_lat
+        self.sum_lng += lng - o_lng
+        while recent[0][0] < t - SMOOTH_S:
+            _, dlat, dlng = recent.popleft()
+            self.sum_lat -= dlat
+            self.sum_lng -= dlng
+        plat = o_lat + self.sum_lat / len(recent)
+        plng = o_lng + self.sum_lng / len(recent)
+
+        history = self.history
+        history.append((t, plat, plng))
+        while len(history) > 1 and history[1][0] <= t - SPEED_WINDOW_S:
+            history.popleft()
+        t0, lat0, lng0 = history[0]
+        span = t - t0
+        if span < SPEED_WINDOW_S or span > MAX_SEGMENT_GAP_S:
+            self.speed = None
+        else:
+            d = haversine_m_scalar(lat0, lng0, plat, plng)
+            self.speed = 0.0 if d < JITTER_M else d / span * 3.6
+        return self.speed
+
+
+class SpeedTracker:
+    """
+    Speed per device from consecutive GPS fixes, in O(1) per sample.
+    Out-of-order fixes and implausible jumps are rejected (and carry the last
+    speed). Positions are averaged over SMOOTH_S, and speed is the smoothed
+    position's displacement over SPEED_WINDOW_S, so GPS noise neither makes
+    spikes nor moves a parked helmet. derive_speeds() applies the same rules
+    to stored tracks.
+    """
+
+    def __init__(self):
+        self.states: Dict[str, _SpeedState] = {}
+        self.rejected = 0
+
+    def observe(self, device_id: str, obj: TelemetryIn) -> Optional[float]:
+        """km/h at this sample, or None (no fix, not enough history, after a gap)."""
+        gps = obj.gps
+        if not (gps.ok and gps.lock) or (gps.lat == 0 and gps.lng == 0):
+            return None
+        t = to_epoch(obj.ts)
+        st = self.states.get(device_id)
+        if st is None:
+            self.states[device_id] = _SpeedState(gps.lat, gps.lng, t)
+            return None
+        dt = t - st.t
+        if dt > 0:
+            d = haversine_m_scalar(st.lat, st.lng, gps.lat, gps.lng)
+            if d / dt * 3.6 <= MAX_PLAUSIBLE_KMH:
+                return st.accept(gps.lat, gps.lng, t)
+            self.rejected += 1
+            st.rejects += 1
+            if st.rejects >= MAX_REJECTS:
+                self.states[device_id] = _SpeedState(gps.lat, gps.lng, t)
+                return None
+        return st.speed
+
+    def forget(self, device_id: str) -> None:
+        self.states.pop(device_id, None)
+
+    def stats(self) -> dict:
+        return {"devices": len(self.states), "rejected_fixes": self.rejected}
+
+
+class TripAnalytics:
+    """
+    trip_id -> TripAccumulator for every trip being recorded. Fed by the
+    persist worker; close_trip() writes summary() in its single UPDATE, so a
+    trip summary costs nothing at close instead of a scan of trip_data.
+    """
+
+    def __init__(self):
+        self.trips: Dict[str, TripAccumulator] = {}
+        self.evicted = 0
+
+    def begin(self, trip_id: str) -> None:
+        self.trips[trip_id] = TripAccumulator(complete=True)
+
+    def update(self, trip_id: str, obj: TelemetryIn, speed_kmh: Optional[float] = None) -> None:
+        acc = self.trips.get(trip_id)
+        if acc is None:
+            acc = self.trips[trip_id] = TripAccumulator(complete=False)
+        acc.add(obj, speed_kmh)
+
+    def finalize(self, trip_id: str) -> Optional[dict]:
+        """Pop the trip; its summary, or None if the accumulator is partial/missing."""
+        acc = self.trips.pop(trip_id, None)
+        if acc is None or not acc.complete:
+            return None
+        return acc.summary()
+
+    def peek(self, trip_id: str) -> Optional[dict]:
+        """Live summary of a trip still recording (partial totals included)."""
+        acc = self.trips.get(trip_id)
+        return acc.summary() if acc else None
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop accumulators idle for IDLE_EVICT_SECONDS; closing them falls back to a recompute."""
+        cutoff = (time.monotonic() if now is None else now) - IDLE_EVICT_SECONDS
+        idle = [trip_id for trip_id, acc in self.trips.items() if acc.last_seen < cutoff]
+        for trip_id in idle:
+            del self.trips[trip_id]
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(EVICT_SWEEP_SECONDS)
+            self.evict_idle()
+
+    def stats(self) -> dict:
+        return {
+            "active_trips": len(self.trips),
+            "partial_trips": sum(1 for a in self.trips.values() if not a.complete),
+            "evicted": self.evicted,
+        }
+
+
+trip_analytics = TripAnalytics()
+speed_tracker = SpeedTracker()
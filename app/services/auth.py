@@ -3,7 +3,8 @@ from __future__ import annotations
 
 import os
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+import hmac
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import firebase_admin
 from firebase_admin import auth, credentials
@@ -75,3 +76,21 @@ async def get_current_user_uid(token: str = Depends(get_current_user_token)) ->
     """
     decoded = await verify_firebase_token(token)
     return decoded.get("uid")
+
+# Shared secret for operational endpoints (model reload etc.). Unset = disabled.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """
+    Dependency for admin endpoints: X-Admin-Token must match ADMIN_TOKEN.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin endpoints disabled (ADMIN_TOKEN not set)",
+        )
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin token",
+        )
@@ -0,0 +1,264 @@
+# app/services/broadcaster.py
+from __future__ import annotations
+
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.models.schemas import TelemetryIn
+from app.services.geo import haversine_m_scalar
+
+# Last N telemetry frames kept per device (60 s at 5 Hz by default)
+BUFFER_FRAMES = int(os.getenv("STREAM_BUFFER_FRAMES", "300"))
+# Frames older than this are never replayed, even if still in the ring
+BUFFER_SECONDS = float(os.getenv("STREAM_BUFFER_SECONDS", "60"))
+# Devices silent for this long have their ring freed
+IDLE_EVICT_SECONDS = 600.0
+
+# Column layout of one buffered frame. Every telemetry field is numeric,
+# so a frame fits in one float64 row and can be rebuilt exactly.
+_BLOCKS = {
+    "heart_rate": (("ok", bool), ("ir", int), ("red", int), ("finger", bool), ("hr", int), ("spo2", int)),
+    "imu": (("ok", bool), ("sleep", bool), ("ax", float), ("ay", float), ("az", float),
+            ("gx", float), ("gy", float), ("gz", float)),
+    "gps": (("ok", bool), ("lat", float), ("lng", float), ("alt", float), ("sats", int), ("lock", bool)),
+}
+_TOP = (("helmet_on", bool), ("crash_flag", bool))
+N_COLS = sum(len(v) for v in _BLOCKS.values()) + len(_TOP)
+
+
+def _col(block: Optional[str], name: str) -> int:
+    i = 0
+    for b, cols in _BLOCKS.items():
+        for n, _ in cols:
+            if b == block and n == name:
+                return i
+            i += 1
+    return i + [n for n, _ in _TOP].index(name)
+
+
+COL_LAT = _col("gps", "lat")
+COL_LNG = _col("gps", "lng")
+COL_GPS_OK = _col("gps", "ok")
+COL_HR = _col("heart_rate", "hr")
+COL_CRASH = _col(None, "crash_flag")
+COL_HELMET_ON = _col(None, "helmet_on")
+
+# Device considered offline after this much silence (fleet status)
+STALE_SECONDS = 10.0
+
+
+def to_epoch(ts: datetime) -> float:
+    # Naive datetimes are UTC everywhere in this app
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class FrameRing:
+    """
+    Fixed-size ring of telemetry frames for one device.
+    Storage is preallocated once: no per-frame allocation on append.
+    """
+    __slots__ = ("seq", "ts", "values", "trip_ids", "head", "size", "last_append")
+
+    def __init__(self, capacity: int):
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, N_COLS), dtype=np.float64)
+        self.trip_ids: List[Optional[str]] = [None] * capacity
+        self.head = 0   # next slot to write
+        self.size = 0
+        self.last_append = 0.0
+
+    def append(self, seq: int, ts: float, row: list, trip_id: Optional[str]) -> None:
+        i = self.head
+        self.seq[i] = seq
+        self.ts[i] = ts
+        self.values[i] = row
+        self.trip_ids[i] = trip_id
+        capacity = len(self.seq)
+        self.head = (i + 1) % capacity
+        self.size = min(self.size + 1, capacity)
+        self.last_append = time.monotonic()
+
+    def _ordered_slots(self) -> np.ndarray:
+        capacity = len(self.seq)
+        start = (self.head - self.size) % capacity
+        return (start + np.arange(self.size)) % capacity
+
+    def select(self, since_seq: Optional[int] = None, since_ts: Optional[float] = None) -> np.ndarray:
+        """Return slot indices (oldest first) newer than the given seq and/or ts."""
+        slots = self._ordered_slots()
+        mask = np.ones(len(slots), dtype=bool)
+        if since_seq is not None:
+            mask &= self.seq[slots] > since_seq
+        if since_ts is not None:
+            mask &= self.ts[slots] > since_ts
+        return slots[mask]
+
+
+    def latest(self, now: float) -> list:
+        """
+        Compact fleet row from the newest frame:
+        [lat, lng, speed_kmh, hr, status, age_s]
+        Speed comes from the two newest frames that carry a GPS fix.
+        """
+        capacity = len(self.seq)
+        i = (self.head - 1) % capacity
+        row = self.values[i]
+        speed = None
+        if self.size > 1 and row[COL_GPS_OK]:
+            j = (self.head - 2) % capacity
+            prev = self.values[j]
+            dt = self.ts[i] - self.ts[j]
+            if prev[COL_GPS_OK] and dt > 0:
+                d = haversine_m_scalar(prev[COL_LAT], prev[COL_LNG], row[COL_LAT], row[COL_LNG])
+                speed = round(d / dt * 3.6, 1)
+
+        age = now - self.last_append
+        if row[COL_CRASH]:
+            status = "crash"
+        elif age > STALE_SECONDS:
+            status = "offline"
+        elif not row[COL_HELMET_ON]:
+            status = "idle"
+        else:
+            status = "riding"
+        return [
+            round(float(row[COL_LAT]), 6),
+            round(float(row[COL_LNG]), 6),
+            speed,
+            int(row[COL_HR]),
+            status,
+            round(age, 1),
+        ]
+
+
+def _flatten(obj: TelemetryIn) -> list:
+    row = []
+    for block, cols in _BLOCKS.items():
+        sub = getattr(obj, block)
+        row.extend(float(getattr(sub, name)) for name, _ in cols)
+    row.extend(float(getattr(obj, name)) for name, _ in _TOP)
+    return row
+
+
+def _rebuild(device_id: str, ring: FrameRing, slot: int) -> dict:
+    row = ring.values[slot].tolist()
+    frame = {
+        "type": "telemetry",
+        "device_id": device_id,
+        "ts": datetime.fromtimestamp(float(ring.ts[slot]), tz=timezone.utc).isoformat(),
+        "seq": int(ring.seq[slot]),
+        "trip_id": ring.trip_ids[slot],
+    }
+    i = 0
+    for block, cols in _BLOCKS.items():
+        frame[block] = {name: kind(row[i + j]) for j, (name, kind) in enumerate(cols)}
+        i += len(cols)
+    for j, (name, kind) in enumerate(_TOP):
+        frame[name] = kind(row[i + j])
+    return frame
+
+
+class StreamBuffer:
+    """
+    Recent telemetry per active device, for backfilling reconnecting dashboards
+    without touching the DB. Sequence numbers are global, so one `since_seq`
+    works across all of a user's devices.
+    """
+
+    def __init__(self, capacity: int = BUFFER_FRAMES, window_s: float = BUFFER_SECONDS):
+        self.capacity = capacity
+        self.window_s = window_s
+        self.rings: Dict[str, FrameRing] = {}
+        self.last_seq = 0
+        # Sequence numbers restart with the process; clients tell boots apart by this
+        self.boot_id = uuid.uuid4().hex[:12]
+        self._last_prune = time.monotonic()
+
+    def append(self, obj: TelemetryIn) -> int:
+        """Buffer one validated telemetry sample; returns its sequence number."""
+        ring = self.rings.get(obj.device_id)
+        if ring is None:
+            ring = self.rings[obj.device_id] = FrameRing(self.capacity)
+        self.last_seq += 1
+        ring.append(self.last_seq, to_epoch(obj.ts), _flatten(obj), obj.trip_id)
+
+        if ring.last_append - self._last_prune > IDLE_EVICT_SECONDS:
+            self.prune(ring.last_append)
+        return self.last_seq
+
+    def prune(self, now: float) -> None:
+        """Drop rings of devices that stopped sending."""
+        self._last_prune = now
+        for device_id in [d for d, r in self.rings.items() if now - r.last_append > IDLE_EVICT_SECONDS]:
+            del self.rings[device_id]
+
+    def frames_since(
+        self,
+        device_ids,
+        since_seq: Optional[int] = None,
+        since_ts: Optional[float] = None,
+    ) -> List[dict]:
+        """
+        Buffered frames for the given devices, newer than since_seq/since_ts,
+        merged in sequence order. Never older than the buffer window.
+        """
+        picked = []
+        for device_id in device_ids:
+            ring = self.rings.get(device_id)
+            if ring is None or ring.size == 0:
+                continue
+            # Window is measured against the device's own clock, not ours
+            floor = ring.ts[(ring.head - 1) % len(ring.ts)] - self.window_s
+            lower = floor if since_ts is None else max(since_ts, floor)
+            for slot in ring.select(since_seq, lower):
+                picked.append((int(ring.seq[slot]), device_id, ring, int(slot)))
+        picked.sort(key=lambda p: p[0])
+        return [_rebuild(device_id, ring, slot) for _, device_id, ring, slot in picked]
+
+
+    def fleet_rows(self) -> Dict[str, list]:
+        """Latest compact state of every buffered device: O(devices)."""
+        now = time.monotonic()
+        return {device_id: ring.latest(now) for device_id, ring in self.rings.items() if ring.size}
+
+
+def _parse_ts(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return to_epoch(datetime.fromisoformat(value))
+
+
+def parse_since(value: Optional[str], last_seq: int) -> tuple[Optional[int], Optional[float]]:
+    """
+    `since` query value -> (since_seq, since_ts).
+    "s:<seq>" is a sequence number and "t:<ISO time | epoch seconds>" a
+    timestamp. Without a prefix an integer no greater than last_seq is a
+    sequence number, a larger one is epoch seconds (no seq can be ahead of
+    the buffer), and anything else is a timestamp.
+    """
+    if value is None or value == "":
+        return None, None
+    if value.startswith("s:"):
+        return int(value[2:]), None
+    if value.startswith("t:"):
+        return None, _parse_ts(value[2:])
+    try:
+        seq = int(value)
+    except ValueError:
+        return None, _parse_ts(value)
+    if seq <= last_seq:
+        return seq, None
+    return None, float(seq)
+
+
+# Global instance
+stream_buffer = StreamBuffer()
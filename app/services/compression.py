@@ -0,0 +1,292 @@
+# app/services/compression.py
+from __future__ import annotations
+
+import math
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.services.broadcaster import to_epoch
+from app.services.geo import EARTH_RADIUS_M
+
+# Off by default: every sample is stored at full rate
+COMPRESSION_ENABLED = os.getenv("TELEMETRY_COMPRESSION", "0") == "1"
+# Error bounds of the reconstruction (see resample())
+GPS_TOLERANCE_M = float(os.getenv("COMPRESS_GPS_M", "5.0"))           # per axis, linear
+HR_DEADBAND = float(os.getenv("COMPRESS_HR_BPM", "2"))                 # held
+ACC_DEADBAND = float(os.getenv("COMPRESS_ACC_DEADBAND", "0.8"))        # m/s^2 per axis, held
+GYRO_DEADBAND = float(os.getenv("COMPRESS_GYRO_DEADBAND", "8"))        # deg/s per axis, held
+# Short-term acc variance (sum over axes, (m/s^2)^2) above which IMU goes to full rate
+IMU_VAR_GATE = float(os.getenv("COMPRESS_IMU_VAR_GATE", "1.0"))
+# Full rate this long either side of a crash-flagged sample
+CRASH_KEEP_S = float(os.getenv("COMPRESS_CRASH_KEEP_S", "10"))
+# A row at least this often, whatever the signals do
+MAX_GAP_S = float(os.getenv("COMPRESS_MAX_GAP_S", "10"))
+
+IMU_SPAN = 5   # samples (~1 s at 5 Hz) in the acc variance EWMA
+MAX_RESAMPLE_POINTS = 200_000
+
+ACC_COLS = ("acc_x", "acc_y", "acc_z")
+GYRO_COLS = ("gyro_x", "gyro_y", "gyro_z")
+# Column order of the rows resample() takes
+RESAMPLE_COLUMNS = (
+    "timestamp", "lat", "lng", "speed", "heart_rate",
+    *ACC_COLS, *GYRO_COLS, "crash_flag",
+)
+
+_ALPHA = 2.0 / (IMU_SPAN + 1)
+_M_PER_DEG = math.pi * EARTH_RADIUS_M / 180.0
+_INF = float("inf")
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+class _DeviceState:
+    """Last stored row (the archive) and what has been skipped since."""
+    __slots__ = (
+        "trip_id", "row", "t", "fix", "lat", "lng", "m_per_deg_lng",
+        "lo_x", "up_x", "lo_y", "up_y", "last", "skipped",
+        "crash_until", "acc_mean", "acc_var",
+    )
+
+    def __init__(self, trip_id: Optional[str]):
+        self.trip_id = trip_id
+        self.last = None                 # (t, row, fix): newest skipped sample
+        self.skipped = deque()           # (t, row) skipped in the last CRASH_KEEP_S
+        self.crash_until = -_INF           # full rate up to here (epoch s)
+        self.acc_mean = None             # EWMA per acc axis
+        self.acc_var = [0.0, 0.0, 0.0]
+
+    def archive(self, t: float, row: dict, fix: bool) -> None:
+        self.row, self.t, self.fix = row, t, fix
+        self.lat, self.lng = row["lat"], row["lng"]
+        self.m_per_deg_lng = _M_PER_DEG * math.cos(math.radians(self.lat or 0.0))
+        # Slopes (m/s) a line from here may take and stay within tolerance
+        # of every fix skipped since
+        self.lo_x = self.lo_y = -_INF
+        self.up_x = self.up_y = _INF
+        self.last = None
+
+    def corridor(self, t: float, row: dict) -> bool:
+        """
+        Swinging door, exact form: can a line from the archive to this fix
+        stand in for all skipped fixes? If so, narrow the doors by this fix.
+        """
+        dt = t - self.t
+        x = (row["lng"] - self.lng) * self.m_per_deg_lng
+        y = (row["lat"] - self.lat) * _M_PER_DEG
+        sx, sy = x / dt, y / dt
+        if not (self.lo_x <= sx <= self.up_x and self.lo_y <= sy <= self.up_y):
+            return False
+        e = GPS_TOLERANCE_M
+        self.lo_x = max(self.lo_x, (x - e) / dt)
+        self.up_x = min(self.up_x, (x + e) / dt)
+        self.lo_y = max(self.lo_y, (y - e) / dt)
+        self.up_y = min(self.up_y, (y + e) / dt)
+        return True
+
+
+def _has_fix(row: dict) -> bool:
+    lat, lng = row["lat"], row["lng"]
+    return lat is not None and lng is not None and not (lat == 0 and lng == 0)
+
+
+class TelemetryCompressor:
+    """
+    Decides per device which telemetry rows to store. A row is skipped when
+    every channel can be rebuilt from the stored rows around it within the
+    configured bounds:
+      GPS  swinging door: linear interpolation stays within GPS_TOLERANCE_M
+      HR   dead-band: holding the last stored value stays within HR_DEADBAND
+      IMU  variance gate + dead-band: full rate while acc is rough,
+           otherwise the held value stays within ACC/GYRO_DEADBAND
+    Crash-flagged samples open a full-rate window of CRASH_KEEP_S either
+    side; skipped samples are kept in memory that long so the window can
+    reach back. Rows are stored whole, so a row kept for one channel
+    refreshes the others.
+    """
+
+    def __init__(self):
+        self.states: Dict[str, _DeviceState] = {}
+        self.samples = 0
+        self.stored = 0
+        self.reasons: Dict[str, int] = {}
+
+    def _keep(self, reason: str, n: int = 1) -> None:
+        self.reasons[reason] = self.reasons.get(reason, 0) + n
+        self.stored += n
+
+    def push(self, row: dict) -> List[dict]:
+        """
+        One sample (TripData column dict, in order per device) in; the rows
+        to insert now out, often none.
+        """
+        self.samples += 1
+        device_id = row["device_id"]
+        t = to_epoch(row["timestamp"])
+        fix = _has_fix(row)
+        st = self.states.get(device_id)
+        out: List[dict] = []
+
+        if st is None or st.trip_id != row["trip_id"]:
+            if st is not None and st.last is not None:
+                out.append(st.last[1])
+                self._keep("end")
+            st = self.states[device_id] = _DeviceState(row["trip_id"])
+            st.archive(t, row, fix)
+            if row["crash_flag"]:
+                st.crash_until = t + CRASH_KEEP_S
+            self._keep("first")
+            out.append(row)
+            return out
+
+        # Short-term acc variance, over every sample (stored or not)
+        acc = [row[c] or 0.0 for c in ACC_COLS]
+        if st.acc_mean is None:
+            st.acc_mean = acc
+        else:
+            for i, a in enumerate(acc):
+                diff = a - st.acc_mean[i]
+                incr = _ALPHA * diff
+                st.acc_mean[i] += incr
+                st.acc_var[i] = (1.0 - _ALPHA) * (st.acc_var[i] + diff * incr)
+
+        if t <= (st.last[0] if st.last is not None else st.t):
+            # Device clock repeated or went back: no slope to test, store as is
+            self._keep("clock")
+            return [row]
+
+        if row["crash_flag"]:
+            # Full rate CRASH_KEEP_S either side: skipped samples still held
+            # from the window before are stored now. They are the tail of
+            # `skipped`, ending at st.last if a GPS segment is open, so that
+            # segment ends there
+            st.crash_until = t + CRASH_KEEP_S
+            held = [r for ts, r in st.skipped if ts >= t - CRASH_KEEP_S]
+            if held:
+                st.skipped = deque(x for x in st.skipped if x[0] < t - CRASH_KEEP_S)
+                out.extend(held)
+                self._keep("crash_window", len(held))
+                if st.last is not None:
+                    st.archive(*st.last)
+
+        # GPS: close the segment at the previous fix when this one can't extend it
+        if st.last is not None and (
+            fix != st.fix or (fix and st.fix and not st.corridor(t, row))
+        ):
+            lt, lrow, lfix = st.last
+            st.skipped.pop()
+            out.append(lrow)
+            self._keep("gps")
+            st.archive(lt, lrow, lfix)
+
+        reason = None
+        if row["crash_flag"]:
+            reason = "crash"
+        elif t <= st.crash_until:
+            reason = "crash_window"
+        elif t - st.t >= MAX_GAP_S:
+            reason = "gap"
+        elif fix != st.fix:
+            reason = "fix"
+        elif not _within(row["heart_rate"], st.row["heart_rate"], HR_DEADBAND):
+            reason = "hr"
+        elif sum(st.acc_var) > IMU_VAR_GATE:
+            reason = "imu_gate"
+        elif not (
+            all(_within(row[c], st.row[c], ACC_DEADBAND) for c in ACC_COLS)
+            and all(_within(row[c], st.row[c], GYRO_DEADBAND) for c in GYRO_COLS)
+        ):
+            reason = "imu"
+
+        if reason:
+            st.archive(t, row, fix)
+            self._keep(reason)
+            out.append(row)
+            return out
+
+        if fix and st.last is None:
+            st.corridor(t, row)   # first fix after the archive: opens the doors
+        st.last = (t, row, fix)
+        st.skipped.append((t, row))
+        while st.skipped and st.skipped[0][0] < t - CRASH_KEEP_S:
+            st.skipped.popleft()
+        return out
+
+    def finish(self, device_id: str) -> List[dict]:
+        """Trip over: the newest skipped sample, so the track ends exactly."""
+        st = self.states.pop(device_id, None)
+        if st is None or st.last is None:
+            return []
+        self._keep("end")
+        return [st.last[1]]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": COMPRESSION_ENABLED,
+            "samples": self.samples,
+            "stored": self.stored,
+            "ratio": round(self.samples / self.stored, 2) if self.stored else None,
+            "reasons": dict(self.reasons),
+        }
+
+
+def _within(v, ref, band: float) -> bool:
+    if v is None or ref is None:
+        return v is ref
+    return abs(v - ref) <= band
+
+
+# -----------------------
+# Reads
+# -----------------------
+
+def _json_list(values: np.ndarray, ndigits: int) -> List[Optional[float]]:
+    return [None if v != v else round(v, ndigits) for v in values.tolist()]
+
+
+def resample(rows: Sequence[tuple], hz: float) -> dict:
+    """
+    Stored rows (RESAMPLE_COLUMNS order, time-ordered) -> columns on a
+    uniform grid of `hz` from the first to the last row. Rebuilds what
+    compression skipped with the same rules it was skipped under: position
+    and speed interpolated linearly between stored fixes, heart rate and IMU
+    held from the previous stored row. crash_flag marks the grid slot
+    nearest each flagged row. Uncompressed trips just get resampled.
+    """
+    if not rows:
+        return {"hz": hz, "start_ms": None, "points": 0, "t": []}
+    cols = list(zip(*rows))
+    t = np.fromiter(((x - _EPOCH) / _SECOND for x in cols[0]), dtype=np.float64, count=len(rows))
+    data = {name: np.array(col, dtype=np.float64) for name, col in zip(RESAMPLE_COLUMNS[1:-1], cols[1:-1])}
+    crash = np.array(cols[-1], dtype=bool)
+
+    n = int(math.floor((t[-1] - t[0]) * hz + 1e-6)) + 1
+    if n > MAX_RESAMPLE_POINTS:
+        raise ValueError(f"{n} points at {hz} Hz; lower hz (max {MAX_RESAMPLE_POINTS} points)")
+    grid = t[0] + np.arange(n) / hz
+    prev = np.searchsorted(t, grid, side="right") - 1
+
+    lat, lng = data["lat"], data["lng"]
+    fix = np.isfinite(lat) & np.isfinite(lng) & ~((lat == 0) & (lng == 0))
+    out = {"hz": hz, "start_ms": int(round(t[0] * 1000.0)), "points": n,
+           "t": np.round(grid - t[0], 3).tolist()}
+    held_fix = fix[prev]
+    for name, ndigits in (("lat", 6), ("lng", 6), ("speed", 1)):
+        values = data[name]
+        ok = fix & np.isfinite(values)
+        col = np.interp(grid, t[ok], values[ok]) if ok.any() else np.full(n, np.nan)
+        col[~held_fix] = np.nan
+        out[name] = _json_list(col, ndigits)
+    for name in ("heart_rate", *ACC_COLS, *GYRO_COLS):
+        out[name] = _json_list(data[name][prev], 3)
+    flags = np.zeros(n, dtype=bool)
+    flags[np.clip(np.round((t[crash] - t[0]) * hz).astype(np.int64), 0, n - 1)] = True
+    out["crash_flag"] = flags.tolist()
+    return out
+
+
+compressor = TelemetryCompressor()
@@ -1,28 +1,170 @@
+import asyncio
+import json
+import os
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional
 from fastapi import WebSocket
 
+from app.models.schemas import StreamControlIn, StreamField
+
+# Payload keys carried by each field group
+FIELD_GROUP_KEYS = {
+    StreamField.gps: ("gps",),
+    StreamField.imu: ("imu",),
+    StreamField.hr: ("heart_rate",),
+    StreamField.alerts: ("crash_flag",),
+}
+
+# Keys every projected frame keeps so the client can route it
+ENVELOPE_KEYS = ("type", "device_id", "ts", "trip_id", "helmet_on")
+
+ALL_FIELDS = frozenset(StreamField)
+
+# Field groups that carry routine telemetry (alerts only covers crash_flag)
+SAMPLE_FIELDS = ALL_FIELDS - {StreamField.alerts}
+
+
+class Subscription:
+    """
+    One client subscription: which devices, which field groups, how often.
+    Rate limiting is tracked per device so 1 Hz for two helmets means 1 Hz each.
+    """
+    __slots__ = ("sub_id", "device_ids", "fields", "interval", "last_sent")
+
+    def __init__(
+        self,
+        sub_id: str,
+        device_ids: Optional[set],
+        fields: frozenset,
+        interval: float,
+    ):
+        self.sub_id = sub_id
+        self.device_ids = device_ids
+        self.fields = fields
+        self.interval = interval
+        # Map device_id -> timestamp of last frame sent for this subscription
+        self.last_sent: Dict[str, float] = {}
+
+    def wants(self, device_id: Optional[str], msg_type: Optional[str], crash_flag: bool = False) -> bool:
+        if self.device_ids is not None and device_id not in self.device_ids:
+            return False
+        if msg_type == "alert":
+            return StreamField.alerts in self.fields
+        if msg_type == "telemetry" and not self.fields & SAMPLE_FIELDS:
+            # Alerts only: a routine sample would project to a bare envelope
+            return crash_flag
+        return True
+
+    def due(self, device_id: Optional[str], now: float) -> bool:
+        if now - self.last_sent.get(device_id, 0) < self.interval:
+            return False
+        self.last_sent[device_id] = now
+        return True
+
+
+def is_priority(data: dict) -> bool:
+    """Alerts and crash-flagged samples skip every throttle."""
+    return data.get("type") == "alert" or bool(data.get("crash_flag"))
+
+
+def project_fields(data: dict, fields: frozenset) -> dict:
+    """
+    Keep only the envelope plus the keys of the requested field groups.
+    Non-telemetry messages (trip_start/trip_end/alert) are passed through whole.
+    """
+    if fields == ALL_FIELDS or data.get("type") != "telemetry":
+        return data
+    out = {k: data[k] for k in ENVELOPE_KEYS if k in data}
+    for field in fields:
+        for key in FIELD_GROUP_KEYS[field]:
+            if key in data:
+                out[key] = data[key]
+    return out
+
+
 class ConnectionManager:
     """
     Manages active WebSocket connections for real-time streaming.
-    Includes throttling to prevent client flooding.
+    Includes throttling to prevent client flooding, heartbeats, and
+    eviction of dead sockets so broadcast cost tracks live viewers.
+    Each socket has its own outbox and writer task, so a slow viewer never
+    holds up the broadcaster (or the ingest socket that triggered it).
     """
     THROTTLE_INTERVAL = 0.1  # 100ms between messages per user (max 10 msg/sec)
+    MAX_SUBSCRIPTIONS_PER_SOCKET = 16
+
+    # Heartbeat: server pings every interval; a socket silent for the timeout is reaped
+    PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+    PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "60"))
+    # A socket that can't take a frame this fast is treated as dead
+    SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "2"))
+    # Frames waiting per socket; a socket that falls this far behind is evicted
+    SEND_QUEUE_FRAMES = int(os.getenv("WS_SEND_QUEUE_FRAMES", "256"))
+
+    MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "2000"))
+    MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "8"))
 
     def __init__(self):
         # Map user_id -> list of sockets
         self.user_connections: Dict[str, List[WebSocket]] = {}
-        
+
         # Map user_id -> timestamp of last sent message
         self.user_last_sent: Dict[str, float] = {}
 
+        # Map socket -> {subscription id -> Subscription}
+        # Sockets without an entry get every message (legacy behaviour); an
+        # empty dict (all unsubscribed) gets nothing.
+        self.subscriptions: Dict[WebSocket, Dict[str, Subscription]] = {}
+
+        # Map socket -> owning user_id / last time it was known alive
+        self.socket_users: Dict[WebSocket, str] = {}
+        self.last_seen: Dict[WebSocket, float] = {}
+
+        # Map socket -> pending encoded frames / the task sending them
+        self.outboxes: Dict[WebSocket, asyncio.Queue] = {}
+        self.writers: Dict[WebSocket, asyncio.Task] = {}
+        self._closing: set = set()
+
+        # Gauges / counters
+        self.reaped: Dict[str, int] = {}
+        self.rejected = 0
+        self.priority_sent = 0
+
+    async def admit(self, websocket: WebSocket, user_id: str) -> bool:
+        """
+        Enforce connection limits before accepting.
+        Over the global cap the new socket is refused; over the per-user cap
+        the user's oldest socket makes room (typical of a dashboard reload).
+        """
+        if len(self.socket_users) >= self.MAX_CONNECTIONS:
+            self.rejected += 1
+            await websocket.close(code=1013, reason="Server busy")
+            return False
+        existing = self.user_connections.get(user_id, [])
+        while len(existing) >= self.MAX_CONNECTIONS_PER_USER:
+            await self._reap(existing[0], "superseded", code=1008)
+        return True
+
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
+        self.attach(websocket, user_id)
+
+    def attach(self, websocket: WebSocket, user_id: str):
+        """Start delivering broadcasts to an already-accepted socket."""
         if user_id not in self.user_connections:
             self.user_connections[user_id] = []
         self.user_connections[user_id].append(websocket)
+        self.socket_users[websocket] = user_id
+        self.last_seen[websocket] = time.monotonic()
 
     def disconnect(self, websocket: WebSocket, user_id: str):
+        self.subscriptions.pop(websocket, None)
+        self.socket_users.pop(websocket, None)
+        self.last_seen.pop(websocket, None)
+        self.outboxes.pop(websocket, None)
+        writer = self.writers.pop(websocket, None)
+        if writer is not None:
+            writer.cancel()
         if user_id in self.user_connections:
             if websocket in self.user_connections[user_id]:
                 self.user_connections[user_id].remove(websocket)
@@ -31,33 +173,206 @@ class ConnectionManager:
                 # Clean up throttle state
                 self.user_last_sent.pop(user_id, None)
 
-    async def broadcast_to_user(self, user_id: str, data: dict):
+    def _drop(self, websocket: WebSocket, reason: str) -> bool:
+        """Remove a socket from every table; False if it was already gone."""
+        user_id = self.socket_users.get(websocket)
+        if user_id is None:
+            return False
+        self.disconnect(websocket, user_id)
+        self.reaped[reason] = self.reaped.get(reason, 0) + 1
+        return True
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), timeout=self.SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _reap(self, websocket: WebSocket, reason: str, code: int = 1001):
+        """Drop a socket from every table first, then try to close it."""
+        if self._drop(websocket, reason):
+            await self._close(websocket, code)
+
+    def _evict(self, websocket: WebSocket, reason: str, code: int = 1001):
+        """_reap() for callers that can't wait: the close runs in the background."""
+        if self._drop(websocket, reason):
+            task = asyncio.create_task(self._close(websocket, code))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def send(self, websocket: WebSocket, text: str) -> None:
+        """
+        Queue one encoded frame for an attached socket, never waiting on it.
+        A socket whose outbox is full is evicted rather than buffered without
+        bound.
+        """
+        if websocket not in self.socket_users:
+            return
+        outbox = self.outboxes.get(websocket)
+        if outbox is None:
+            outbox = self.outboxes[websocket] = asyncio.Queue(maxsize=self.SEND_QUEUE_FRAMES)
+            self.writers[websocket] = asyncio.create_task(self._writer(websocket, outbox))
+        try:
+            outbox.put_nowait(text)
+        except asyncio.QueueFull:
+            self._evict(websocket, "slow", code=1008)
+
+    def send_json(self, websocket: WebSocket, data: dict) -> None:
+        self.send(websocket, json.dumps(data, default=str))
+
+    async def _writer(self, websocket: WebSocket, outbox: asyncio.Queue):
+        """One per socket: deliver its frames in order. A delivered frame counts as alive."""
+        try:
+            while True:
+                text = await outbox.get()
+                await asyncio.wait_for(websocket.send_text(text), timeout=self.SEND_TIMEOUT)
+                outbox.task_done()
+                self.touch(websocket)
+        except Exception:
+            # Dead or stuck socket: evict now so later broadcasts skip it
+            self.writers.pop(websocket, None)
+            await self._reap(websocket, "send_failed")
+
+    def touch(self, websocket: WebSocket):
+        if websocket in self.last_seen:
+            self.last_seen[websocket] = time.monotonic()
+
+    def handle_client_message(self, websocket: WebSocket, text: str) -> Optional[dict]:
+        """
+        Any inbound frame proves the socket is alive, so answering pings is
+        optional. Pongs need no reply; everything else is a subscription
+        control message.
+        """
+        self.touch(websocket)
+        msg = json.loads(text)
+        if isinstance(msg, dict) and msg.get("type") == "pong":
+            return None
+        return self.handle_control(websocket, msg)
+
+    async def run_heartbeat(self):
+        """
+        Run forever: ping live sockets, reap the silent ones.
+        A socket is silent when nothing has come from it and nothing queued
+        for it has been delivered for PING_TIMEOUT, so clients that never
+        answer pings stay connected as long as they keep taking frames.
+        One task for all sockets; cost is O(connections) per interval.
+        """
+        while True:
+            await asyncio.sleep(self.PING_INTERVAL)
+            self.heartbeat(time.monotonic())
+
+    def heartbeat(self, now: float) -> None:
+        ping = json.dumps({"type": "ping", "ts": time.time()})
+        for websocket, seen in list(self.last_seen.items()):
+            if now - seen > self.PING_TIMEOUT:
+                self._evict(websocket, "timeout")
+                continue
+            self.send(websocket, ping)
+
+    def stats(self) -> dict:
+        return {
+            "active_connections": len(self.socket_users),
+            "active_users": len(self.user_connections),
+            "subscribed_sockets": len(self.subscriptions),
+            "reaped": dict(self.reaped),
+            "reaped_total": sum(self.reaped.values()),
+            "queued_frames": sum(q.qsize() for q in self.outboxes.values()),
+            "rejected": self.rejected,
+            "priority_sent": self.priority_sent,
+        }
+
+    def handle_control(self, websocket: WebSocket, msg: dict) -> dict:
+        """
+        Apply a subscribe/unsubscribe/reset control message sent by the
+        client. Returns the acknowledgement to send back.
+        """
+        ctrl = StreamControlIn(**msg)
+        if ctrl.action == "reset":
+            # Back to the legacy "everything" stream
+            self.subscriptions.pop(websocket, None)
+            return {"type": "reset"}
+
+        subs = self.subscriptions.setdefault(websocket, {})
+        if ctrl.action == "unsubscribe":
+            # The last one going leaves an empty dict: the socket gets nothing
+            subs.pop(ctrl.id, None)
+            return {"type": "unsubscribed", "id": ctrl.id}
+
+        if ctrl.id not in subs and len(subs) >= self.MAX_SUBSCRIPTIONS_PER_SOCKET:
+            raise ValueError("too many subscriptions on this socket")
+
+        # Never faster than the server-wide cap
+        interval = self.THROTTLE_INTERVAL
+        if ctrl.max_rate is not None:
+            interval = max(interval, 1.0 / ctrl.max_rate)
+
+        subs[ctrl.id] = Subscription(
+            sub_id=ctrl.id,
+            device_ids=set(ctrl.device_ids) if ctrl.device_ids is not None else None,
+            fields=frozenset(ctrl.fields) if ctrl.fields else ALL_FIELDS,
+            interval=interval,
+        )
+        return {
+            "type": "subscribed",
+            "id": ctrl.id,
+            "device_ids": ctrl.device_ids,
+            "fields": sorted(f.value for f in subs[ctrl.id].fields),
+            "max_rate": round(1.0 / interval, 3),
+        }
+
+    async def broadcast_to_user(self, user_id: str, data: dict, priority: Optional[bool] = None):
         """
         Send JSON data to a specific user's connections.
-        Throttled to prevent flooding.
+        Throttled to prevent flooding, except priority messages (alerts and
+        crash-flagged samples by default), which are always sent and don't
+        count against the rate of the routine frames that follow.
         """
         if user_id not in self.user_connections:
             return
 
         now = time.time()
-        last_sent = self.user_last_sent.get(user_id, 0)
+        device_id = data.get("device_id")
+        msg_type = data.get("type")
+        crash_flag = bool(data.get("crash_flag"))
+        if priority is None:
+            priority = is_priority(data)
+        if priority:
+            self.priority_sent += 1
 
-        # Simple throttling: drop message if too soon
-        # Note: For critical alerts, we might want to bypass this or have a separate queue.
-        # But for high-freq telemetry, dropping frames is acceptable.
-        if now - last_sent < self.THROTTLE_INTERVAL:
-            return
+        # Encode each distinct projection once, however many sockets share it
+        encoded: Dict[frozenset, str] = {}
+
+        # Legacy sockets share the per-user throttle
+        legacy_due = now - self.user_last_sent.get(user_id, 0) >= self.THROTTLE_INTERVAL
+        legacy_sent = False
 
-        self.user_last_sent[user_id] = now
-        
-        # Send to all user's sockets
         # Copy list to avoid modification issues during iteration
         for connection in list(self.user_connections[user_id]):
-            try:
-                await connection.send_json(data)
-            except Exception:
-                # If send fails, assume disconnect and cleanup later
-                pass
+            subs = self.subscriptions.get(connection)
+            if subs is not None:
+                fields = frozenset()
+                for sub in subs.values():
+                    if sub.wants(device_id, msg_type, crash_flag) and (priority or sub.due(device_id, now)):
+                        fields |= sub.fields
+                if not fields:
+                    continue
+            else:
+                # Simple throttling: drop message if too soon
+                # For high-freq telemetry, dropping frames is acceptable.
+                if not priority:
+                    if not legacy_due:
+                        continue
+                    legacy_sent = True
+                fields = ALL_FIELDS
+
+            text = encoded.get(fields)
+            if text is None:
+                text = json.dumps(project_fields(data, fields), default=str)
+                encoded[fields] = text
+            self.send(connection, text)
+
+        if legacy_sent:
+            self.user_last_sent[user_id] = now
 
 # Global instance
 manager = ConnectionManager()
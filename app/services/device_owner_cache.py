@@ -0,0 +1,131 @@
+# app/services/device_owner_cache.py
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# Bounded so a flood of unknown device_ids can't grow memory
+MAX_ENTRIES = int(os.getenv("OWNER_CACHE_MAX_ENTRIES", "10000"))
+# How long a resolved owner list is trusted (explicit invalidation covers changes made here)
+TTL_SECONDS = float(os.getenv("OWNER_CACHE_TTL", "300"))
+# "No owner" is cached briefly, so an unclaimed helmet doesn't cost a DB hit per packet
+NEGATIVE_TTL_SECONDS = float(os.getenv("OWNER_CACHE_NEGATIVE_TTL", "10"))
+
+
+class DeviceOwnerCache:
+    """
+    device_id -> tuple of user_ids that may watch the device (owner + viewers).
+    LRU + TTL eviction, negative caching, explicit invalidation from devices_repo.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MAX_ENTRIES,
+        ttl: float = TTL_SECONDS,
+        negative_ttl: float = NEGATIVE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Map device_id -> (expires_at, user_ids); order = recency
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[str, ...]]]" = OrderedDict()
+        # One DB lookup per device at a time; concurrent misses share it
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Bumped on invalidation so an in-flight lookup can't store stale owners
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, device_id: str) -> Optional[Tuple[str, ...]]:
+        """Cached watchers for a device, or None on miss/expiry."""
+        entry = self._entries.get(device_id)
+        if entry is None:
+            return None
+        expires_at, user_ids = entry
+        if expires_at < time.monotonic():
+            del self._entries[device_id]
+            return None
+        self._entries.move_to_end(device_id)
+        return user_ids
+
+    def put(self, device_id: str, user_ids: Tuple[str, ...]) -> None:
+        ttl = self.ttl if user_ids else self.negative_ttl
+        self._entries[device_id] = (time.monotonic() + ttl, user_ids)
+        self._entries.move_to_end(device_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, device_id: Optional[str] = None) -> None:
+        """Forget one device (or everything) after an ownership change."""
+        self._generation += 1
+        if device_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(device_id, None)
+
+    async def resolve(self, device_id: str) -> Tuple[str, ...]:
+        """
+        Return every user linked to the device, hitting the DB only on a miss.
+        """
+        user_ids = self.get(device_id)
+        if user_ids is not None:
+            self.hits += 1
+            return user_ids
+        self.misses += 1
+
+        pending = self._inflight.get(device_id)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The caller doing the lookup was cancelled, not us: retry
+                return await self.resolve(device_id)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[device_id] = fut
+        generation = self._generation
+        try:
+            user_ids = await self._load(device_id)
+        except asyncio.CancelledError:
+            # Never leave waiters on a future nobody will finish
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # Nobody else may be awaiting it; mark retrieved to avoid warnings
+            fut.exception()
+            raise
+        finally:
+            self._inflight.pop(device_id, None)
+        if generation == self._generation:
+            self.put(device_id, user_ids)
+        fut.set_result(user_ids)
+        return user_ids
+
+    async def _load(self, device_id: str) -> Tuple[str, ...]:
+        from app.database.connection import get_db_context
+        from app.repositories.devices_repo import list_device_user_ids
+
+        async with get_db_context() as db:
+            return tuple(await list_device_user_ids(db, device_id))
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Global instance
+owner_cache = DeviceOwnerCache()
@@ -0,0 +1,94 @@
+# app/services/fleet.py
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Dict, FrozenSet, Tuple
+
+from app.services.broadcaster import stream_buffer
+from app.services.connection_manager import ConnectionManager
+
+# One snapshot per tick, whatever the ingest rate
+TICK_SECONDS = float(os.getenv("FLEET_TICK_SECONDS", "1.0"))
+# How often a viewer's visible-device list is re-read from the DB
+VISIBILITY_TTL = 30.0
+
+FLEET_FIELDS = ["device_id", "lat", "lng", "speed_kmh", "hr", "status", "age_s"]
+
+
+class FleetBroadcaster:
+    """
+    Sends each fleet viewer one aggregated snapshot per tick, built from the
+    in-memory stream buffer. Cost is O(devices) to build plus O(visible) per
+    viewer, instead of O(frames x viewers).
+    """
+
+    def __init__(self, tick: float = TICK_SECONDS):
+        self.tick = tick
+        # Fleet sockets get their own manager: same limits/heartbeat/reaping,
+        # but never receive per-frame broadcasts.
+        self.manager = ConnectionManager()
+        # Map user_id -> (expires_at, device_ids the user may see)
+        self._visible: Dict[str, Tuple[float, FrozenSet[str]]] = {}
+        self.ticks = 0
+        self.last_build_ms = 0.0
+
+    async def _visible_devices(self, user_id: str) -> FrozenSet[str]:
+        cached = self._visible.get(user_id)
+        now = time.monotonic()
+        if cached and cached[0] > now:
+            return cached[1]
+
+        from app.database.connection import get_db_context
+        from app.repositories.devices_repo import list_user_devices
+
+        async with get_db_context() as db:
+            devices = frozenset(d.device_id for d in await list_user_devices(db, user_id))
+        self._visible[user_id] = (now + VISIBILITY_TTL, devices)
+        return devices
+
+    async def run(self) -> None:
+        """Run forever: build one snapshot per tick and fan it out."""
+        while True:
+            await asyncio.sleep(self.tick)
+            if not self.manager.user_connections:
+                continue
+            try:
+                await self._tick()
+            except Exception as e:
+                print(f"[fleet] tick error: {e}")
+
+    async def _tick(self) -> None:
+        started = time.perf_counter()
+        rows = stream_buffer.fleet_rows()
+        self.last_build_ms = (time.perf_counter() - started) * 1000.0
+        self.ticks += 1
+        ts = time.time()
+
+        # Forget visibility of users who left
+        for user_id in list(self._visible):
+            if user_id not in self.manager.user_connections:
+                del self._visible[user_id]
+
+        for user_id in list(self.manager.user_connections):
+            visible = await self._visible_devices(user_id)
+            snapshot = {
+                "type": "fleet",
+                "ts": ts,
+                "fields": FLEET_FIELDS,
+                "rows": [[d] + rows[d] for d in visible if d in rows],
+            }
+            await self.manager.broadcast_to_user(user_id, snapshot)
+
+    def stats(self) -> dict:
+        return {
+            "ticks": self.ticks,
+            "devices_buffered": len(stream_buffer.rings),
+            "last_build_ms": round(self.last_build_ms, 3),
+            **self.manager.stats(),
+        }
+
+
+# Global instance
+fleet = FleetBroadcaster()
@@ -0,0 +1,31 @@
+# app/services/geo.py
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6_371_000.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance in meters.
+    Works on floats or NumPy arrays (broadcasting), so the same code serves
+    per-sample updates and whole-trip vectorized passes.
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def haversine_m_scalar(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Pure-Python haversine for the per-sample hot path (no array overhead)."""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dlat = p2 - p1
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2.0) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlng / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
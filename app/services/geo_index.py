@@ -0,0 +1,215 @@
+# app/services/geo_index.py
+from __future__ import annotations
+
+import math
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from app.services.geo import EARTH_RADIUS_M, haversine_m
+
+# Grid resolutions, coarse to fine: ~11 km, ~1.1 km and ~110 m cells (north-south)
+CELL_SIZES_DEG = (0.1, 0.01, 0.001)
+# A query uses the finest level whose covering stays within this many cells
+MAX_QUERY_CELLS = 256
+# Largest box /trips/within accepts, per side (~550 km north-south)
+MAX_BBOX_SPAN_DEG = 5.0
+
+_M_PER_DEG_LAT = math.pi * EARTH_RADIUS_M / 180.0
+
+
+def cell_ids(lat, lng, level: int):
+    """
+    Grid cell id(s) of points at a level: row-major over a global lat/lng
+    grid. Floats or NumPy arrays.
+    """
+    size = CELL_SIZES_DEG[level]
+    n_cols = int(round(360.0 / size))
+    row = np.floor((np.asarray(lat) + 90.0) / size).astype(np.int64)
+    col = np.floor((np.asarray(lng) + 180.0) / size).astype(np.int64) % n_cols
+    return row * n_cols + col
+
+
+def cell_id_scalar(lat: float, lng: float, level: int) -> int:
+    """Pure-Python cell_ids() for one point (per-sample ingest path)."""
+    size = CELL_SIZES_DEG[level]
+    n_cols = int(round(360.0 / size))
+    return math.floor((lat + 90.0) / size) * n_cols + math.floor((lng + 180.0) / size) % n_cols
+
+
+def bbox_for_radius(lat: float, lng: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lng, max_lat, max_lng) enclosing a circle."""
+    dlat = radius_m / _M_PER_DEG_LAT
+    dlng = radius_m / (_M_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+
+def covering_cells(bbox: Tuple[float, float, float, float], level: int) -> np.ndarray:
+    """Every cell id at `level` intersecting a bbox."""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    size = CELL_SIZES_DEG[level]
+    n_cols = int(round(360.0 / size))
+    r0, r1 = (int(math.floor((v + 90.0) / size)) for v in (min_lat, max_lat))
+    c0, c1 = (int(math.floor((v + 180.0) / size)) for v in (min_lng, max_lng))
+    rows = np.arange(r0, r1 + 1, dtype=np.int64)
+    cols = np.arange(c0, c1 + 1, dtype=np.int64) % n_cols
+    return (rows[:, None] * n_cols + cols[None, :]).ravel()
+
+
+def query_level(bbox: Tuple[float, float, float, float], max_cells: int = MAX_QUERY_CELLS) -> Optional[int]:
+    """
+    Finest level whose covering of bbox has at most max_cells cells; None
+    when even the coarsest level needs more.
+    """
+    min_lat, min_lng, max_lat, max_lng = bbox
+    for level in range(len(CELL_SIZES_DEG) - 1, -1, -1):
+        size = CELL_SIZES_DEG[level]
+        n = (math.floor((max_lat + 90.0) / size) - math.floor((min_lat + 90.0) / size) + 1) * (
+            math.floor((max_lng + 180.0) / size) - math.floor((min_lng + 180.0) / size) + 1
+        )
+        if n <= max_cells:
+            return level
+    return None
+
+
+def trip_cell_rows(trip_id: str, lat: np.ndarray, lng: np.ndarray) -> List[dict]:
+    """trip_cells rows for a whole track at every level (vectorized; bulk backfill)."""
+    ok = np.isfinite(lat) & np.isfinite(lng) & ~((lat == 0) & (lng == 0))
+    lat, lng = lat[ok], lng[ok]
+    rows = []
+    for level in range(len(CELL_SIZES_DEG)):
+        for cell in np.unique(cell_ids(lat, lng, level)).tolist():
+            rows.append({"trip_id": trip_id, "level": level, "cell": cell})
+    return rows
+
+
+def nearest_per_trip(
+    rows: Sequence[tuple],
+    lat: float,
+    lng: float,
+    radius_m: float,
+) -> List[dict]:
+    """
+    Refine candidate points, (trip_id, timestamp, lat, lng) rows ordered by
+    trip, with one vectorized haversine pass. Returns each trip's closest
+    approach if it lies within radius_m, nearest first.
+    """
+    if not rows:
+        return []
+    trip, ts, plat, plng = zip(*rows)
+    trip = np.array(trip, dtype=object)
+    d = haversine_m(np.array(plat, dtype=np.float64), np.array(plng, dtype=np.float64), lat, lng)
+    starts = np.flatnonzero(np.concatenate(([True], trip[1:] != trip[:-1])))
+    ends = np.append(starts[1:], len(trip))
+    out = []
+    for a, b in zip(starts.tolist(), ends.tolist()):
+        i = a + int(np.argmin(d[a:b]))
+        if d[i] <= radius_m:
+            out.append({"trip_id": trip[i], "distance_m": round(float(d[i]), 1), "ts": ts[i]})
+    out.sort(key=lambda r: r["distance_m"])
+    return out
+
+
+# -----------------------
+# Queries
+# -----------------------
+
+async def _candidate_trips(db, user_id: str, bbox: Tuple[float, float, float, float]) -> Sequence[str]:
+    """
+    The user's trips indexed under the cells covering bbox. A box too large
+    for MAX_QUERY_CELLS even at the coarsest level skips the cells and is
+    answered from the fixes in the box.
+    """
+    from app.repositories.trip_cells_repo import trips_in_cells, user_trips_with_points_in_bbox
+
+    level = query_level(bbox)
+    if level is None:
+        return await user_trips_with_points_in_bbox(db, user_id, bbox)
+    return await trips_in_cells(db, user_id, level, covering_cells(bbox, level).tolist())
+
+
+async def trips_near(db, user_id: str, lat: float, lng: float, radius_m: float, limit: int = 50) -> List[dict]:
+    """
+    The user's trips that passed within radius_m of a point, with their
+    closest approach. Cells pick the candidates; only their fixes inside the
+    circle's bbox are read and checked with haversine.
+    """
+    from app.repositories.trip_cells_repo import points_in_bbox
+
+    bbox = bbox_for_radius(lat, lng, radius_m)
+    candidates = await _candidate_trips(db, user_id, bbox)
+    if not candidates:
+        return []
+    rows = await points_in_bbox(db, candidates, bbox)
+    return nearest_per_trip(rows, lat, lng, radius_m)[:limit]
+
+
+async def trips_within(
+    db,
+    user_id: str,
+    bbox: Tuple[float, float, float, float],
+    starting: bool = False,
+    limit: int = 50,
+):
+    """
+    The user's trips that passed through a bbox (or, with starting, began in
+    it), newest first.
+    """
+    from app.repositories.trip_cells_repo import (
+        trips_starting_in, trips_with_points_in_bbox, user_trips_with_points_in_bbox,
+    )
+    from app.repositories.trips_repo import TripsRepo
+
+    if starting:
+        return await trips_starting_in(db, user_id, bbox, limit)
+    if query_level(bbox) is None:
+        # Too many cells to bind: go straight to the fixes in the box
+        hits = await user_trips_with_points_in_bbox(db, user_id, bbox)
+    else:
+        candidates = await _candidate_trips(db, user_id, bbox)
+        if not candidates:
+            return ()
+        hits = await trips_with_points_in_bbox(db, candidates, bbox)
+    if not hits:
+        return ()
+    trips = sorted(await TripsRepo.get_trips(db, hits), key=lambda t: t.start_time or datetime.min, reverse=True)
+    return trips[:limit]
+
+
+class TripCellIndexer:
+    """
+    Cells each recording trip has already been stored under, so ingest only
+    writes when a trip enters a new cell (about once per 100 m at the finest
+    level). Inserts are idempotent, so losing this memory on restart just
+    re-sends a few rows.
+    """
+
+    def __init__(self):
+        self.trips: Dict[str, Set[Tuple[int, int]]] = {}
+        self.cells_written = 0
+
+    def observe(self, trip_id: str, lat: Optional[float], lng: Optional[float]) -> List[dict]:
+        """New trip_cells rows for this fix (usually none)."""
+        if lat is None or lng is None or (lat == 0 and lng == 0):
+            return []
+        seen = self.trips.get(trip_id)
+        if seen is None:
+            seen = self.trips[trip_id] = set()
+        rows = []
+        for level in range(len(CELL_SIZES_DEG)):
+            key = (level, cell_id_scalar(lat, lng, level))
+            if key not in seen:
+                seen.add(key)
+                rows.append({"trip_id": trip_id, "level": key[0], "cell": key[1]})
+        self.cells_written += len(rows)
+        return rows
+
+    def forget(self, trip_id: str) -> None:
+        self.trips.pop(trip_id, None)
+
+    def stats(self) -> dict:
+        return {"active_trips": len(self.trips), "cells_written": self.cells_written}
+
+
+trip_cells = TripCellIndexer()
@@ -0,0 +1,280 @@
+# app/services/geofence.py
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.models.schemas import AlertType, TelemetryIn
+from app.services.geo import haversine_m_scalar
+from app.services.geo_index import (
+    CELL_SIZES_DEG, bbox_for_radius, cell_id_scalar, covering_cells, query_level,
+)
+
+# A fence is indexed at the finest grid level where it covers at most this many cells
+FENCE_MAX_CELLS = int(os.getenv("GEOFENCE_MAX_CELLS", "64"))
+# Consecutive fixes on the other side before an enter/exit counts, so GPS
+# jitter along an edge doesn't flap
+CONFIRM_FIXES = int(os.getenv("GEOFENCE_CONFIRM_FIXES", "3"))
+# Fences edited through another worker process are picked up this often
+RELOAD_SECONDS = float(os.getenv("GEOFENCE_RELOAD_SECONDS", "60"))
+IDLE_EVICT_SECONDS = 3600.0
+
+_LEVELS = range(len(CELL_SIZES_DEG))
+
+
+class _Fence:
+    """A fence compiled for containment tests (bbox first, then exact shape)."""
+    __slots__ = (
+        "fence_id", "device_id", "name", "kind", "lat", "lng", "radius_m",
+        "poly", "bbox", "alert_on", "severity", "updated_at", "keys",
+    )
+
+    def __init__(self, row):
+        self.fence_id = row.fence_id
+        self.device_id = row.device_id
+        self.name = row.name
+        self.kind = row.kind
+        self.alert_on = row.alert_on or "both"
+        self.severity = row.severity or "warning"
+        self.updated_at = row.updated_at
+        self.lat = self.lng = self.radius_m = None
+        self.poly: List[Tuple[float, float]] = []
+        if self.kind == "circle":
+            self.lat, self.lng, self.radius_m = row.center_lat, row.center_lng, row.radius_m
+            self.bbox = bbox_for_radius(self.lat, self.lng, self.radius_m)
+        else:
+            self.poly = [(float(lat), float(lng)) for lat, lng in row.vertices]
+            lats = [p[0] for p in self.poly]
+            lngs = [p[1] for p in self.poly]
+            self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+        self.keys: List[tuple] = []
+
+    def contains(self, lat: float, lng: float) -> bool:
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        if self.kind == "circle":
+            return haversine_m_scalar(lat, lng, self.lat, self.lng) <= self.radius_m
+        # Ray casting on lat/lng (fences are small enough for the plane)
+        inside = False
+        poly = self.poly
+        j = len(poly) - 1
+        for i in range(len(poly)):
+            yi, xi = poly[i]
+            yj, xj = poly[j]
+            if (yi > lat) != (yj > lat) and lng < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+                inside = not inside
+            j = i
+        return inside
+
+
+class _FenceState:
+    """Per-device: fences it is inside, fences it may be crossing, last fix."""
+    __slots__ = ("inside", "pending", "lat", "lng", "last_seen")
+
+    def __init__(self, inside: Set[str], lat: float, lng: float):
+        self.inside = inside
+        self.pending: Dict[str, int] = {}   # fence_id -> fixes seen on the other side
+        self.lat = lat
+        self.lng = lng
+        self.last_seen = time.monotonic()
+
+
+class GeoFenceEngine:
+    """
+    Circle/polygon fences per device, checked on every ingested GPS fix. Each
+    fence is registered in the grid cells (services/geo_index.py) covering its
+    bbox, at the finest level where that takes at most FENCE_MAX_CELLS cells,
+    so a fix costs one dict lookup per level plus exact tests for the few
+    fences whose cells it falls in, however many fences exist. Enter/exit
+    state is kept per device and a geo_fence alert fires once per confirmed
+    transition.
+    """
+
+    def __init__(self):
+        self.fences: Dict[str, _Fence] = {}
+        # (device_id, level, cell) -> fences registered there
+        self.cells: Dict[tuple, List[_Fence]] = {}
+        self.per_device: Dict[str, int] = {}
+        self.states: Dict[str, _FenceState] = {}
+        self.signature: Optional[tuple] = None
+        self.fixes = 0
+        self.checks = 0
+        self.transitions = {"enter": 0, "exit": 0}
+        self.alerts = 0
+
+    # -----------------------
+    # Index
+    # -----------------------
+
+    def upsert(self, row) -> None:
+        """(Re)index one fence from its GeoFence row; inactive ones are removed."""
+        self.remove(row.fence_id)
+        if not row.active:
+            return
+        fence = _Fence(row)
+        level = query_level(fence.bbox, FENCE_MAX_CELLS)
+        if level is None:
+            level = 0   # large fence: coarsest grid (fence size is capped by GeoFenceIn)
+        for cell in covering_cells(fence.bbox, level).tolist():
+            key = (fence.device_id, level, cell)
+            self.cells.setdefault(key, []).append(fence)
+            fence.keys.append(key)
+        self.fences[fence.fence_id] = fence
+        self.per_device[fence.device_id] = self.per_device.get(fence.device_id, 0) + 1
+        # A fence drawn around where the device already is: inside, no alert
+        st = self.states.get(fence.device_id)
+        if st is not None and fence.contains(st.lat, st.lng):
+            st.inside.add(fence.fence_id)
+
+    def remove(self, fence_id: str) -> None:
+        fence = self.fences.pop(fence_id, None)
+        if fence is None:
+            return
+        for key in fence.keys:
+            bucket = self.cells[key]
+            bucket.remove(fence)
+            if not bucket:
+                del self.cells[key]
+        left = self.per_device[fence.device_id] - 1
+        if left:
+            self.per_device[fence.device_id] = left
+        else:
+            del self.per_device[fence.device_id]
+        st = self.states.get(fence.device_id)
+        if st is not None:
+            st.inside.discard(fence_id)
+            st.pending.pop(fence_id, None)
+
+    def inside(self, device_id: str, fence_id: str) -> Optional[bool]:
+        """Whether the device is inside an indexed fence (None: no fix yet / not indexed)."""
+        st = self.states.get(device_id)
+        if st is None or fence_id not in self.fences:
+            return None
+        return fence_id in st.inside
+
+    # -----------------------
+    # Evaluation
+    # -----------------------
+
+    def observe(self, obj: TelemetryIn) -> List[dict]:
+        """
+        Check one telemetry sample. Returns alert messages (ws "alert" shape)
+        for transitions confirmed by this fix, usually none.
+        """
+        device_id = obj.device_id
+        if device_id not in self.per_device:
+            return []
+        gps = obj.gps
+        if not (gps.ok and gps.lock) or (gps.lat == 0 and gps.lng == 0):
+            return []
+        lat, lng = gps.lat, gps.lng
+        self.fixes += 1
+
+        hits = set()
+        for level in _LEVELS:
+            for fence in self.cells.get((device_id, level, cell_id_scalar(lat, lng, level)), ()):
+                self.checks += 1
+                if fence.contains(lat, lng):
+                    hits.add(fence.fence_id)
+
+        st = self.states.get(device_id)
+        if st is None:
+            # First fix seeds the state: already being inside isn't an "enter"
+            self.states[device_id] = _FenceState(hits, lat, lng)
+            return []
+        st.lat, st.lng = lat, lng
+        st.last_seen = time.monotonic()
+
+        changed = hits.symmetric_difference(st.inside)
+        for fence_id in [f for f in st.pending if f not in changed]:
+            del st.pending[fence_id]
+        out = []
+        for fence_id in changed:
+            seen = st.pending.get(fence_id, 0) + 1
+            if seen < CONFIRM_FIXES:
+                st.pending[fence_id] = seen
+                continue
+            st.pending.pop(fence_id, None)
+            entered = fence_id in hits
+            if entered:
+                st.inside.add(fence_id)
+            else:
+                st.inside.discard(fence_id)
+            event = "enter" if entered else "exit"
+            self.transitions[event] += 1
+            fence = self.fences[fence_id]
+            if fence.alert_on in (event, "both"):
+                self.alerts += 1
+                out.append(self._alert(obj, fence, event))
+        return out
+
+    def _alert(self, obj: TelemetryIn, fence: _Fence, event: str) -> dict:
+        return {
+            "type": "alert",
+            "device_id": obj.device_id,
+            "ts": obj.ts,
+            "trip_id": obj.trip_id,
+            "alert_type": AlertType.geo_fence.value,
+            "severity": fence.severity,
+            "message": f"{'Entered' if event == 'enter' else 'Left'} geo-fence '{fence.name}'",
+            "payload": {
+                "fence_id": fence.fence_id,
+                "name": fence.name,
+                "event": event,
+                "lat": obj.gps.lat,
+                "lng": obj.gps.lng,
+            },
+        }
+
+    # -----------------------
+    # Persistence
+    # -----------------------
+
+    async def load(self) -> None:
+        """Rebuild the index from the active fences in the DB (device states are kept)."""
+        from app.database.connection import get_db_context
+        from app.repositories.geofences_repo import fences_signature, list_active_fences
+
+        async with get_db_context() as db:
+            signature = await fences_signature(db)
+            if signature == self.signature:
+                return
+            rows = await list_active_fences(db)
+        current = {r.fence_id for r in rows}
+        for fence_id in [f for f in self.fences if f not in current]:
+            self.remove(fence_id)
+        for row in rows:
+            fence = self.fences.get(row.fence_id)
+            if fence is None or fence.updated_at != row.updated_at:
+                self.upsert(row)
+        self.signature = signature
+
+    async def run(self) -> None:
+        """Load fences, then pick up external edits every RELOAD_SECONDS."""
+        while True:
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"[geofence] could not load fences: {e}")
+            await asyncio.sleep(RELOAD_SECONDS)
+            cutoff = time.monotonic() - IDLE_EVICT_SECONDS
+            for device_id in [d for d, st in self.states.items() if st.last_seen < cutoff]:
+                del self.states[device_id]
+
+    def stats(self) -> dict:
+        return {
+            "fences": len(self.fences),
+            "devices": len(self.per_device),
+            "index_cells": len(self.cells),
+            "tracked_devices": len(self.states),
+            "fixes": self.fixes,
+            "checks_per_fix": round(self.checks / self.fixes, 2) if self.fixes else 0.0,
+            "transitions": dict(self.transitions),
+            "alerts": self.alerts,
+        }
+
+
+geofences = GeoFenceEngine()
@@ -0,0 +1,224 @@
+# app/services/hr_monitor.py
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from app.models.schemas import AlertType, Severity, TelemetryIn
+from app.services.broadcaster import to_epoch
+
+# EWMA span in clean samples (~2 min at 5 Hz); alpha = 2 / (span + 1)
+BASELINE_SPAN = int(os.getenv("HR_BASELINE_SPAN", "600"))
+# Personal band = mean ± K·std, with std floored so calm riders aren't paged at +4 bpm
+BAND_K = float(os.getenv("HR_BAND_K", "3.0"))
+MIN_STD = float(os.getenv("HR_MIN_STD", "6.0"))
+# Out of band this long (sample time) before alerting
+SUSTAIN_SECONDS = float(os.getenv("HR_SUSTAIN_SECONDS", "20"))
+# Same alert type for the same device at most once per cooldown
+ALERT_COOLDOWN_SECONDS = float(os.getenv("HR_ALERT_COOLDOWN_SECONDS", "300"))
+# Clean samples before the personal band is trusted; until then only the
+# absolute limits below apply
+WARMUP_SAMPLES = int(os.getenv("HR_WARMUP_SAMPLES", "150"))
+# Absolute limits: always out of band, and alerts beyond them are critical
+ABS_HIGH = float(os.getenv("HR_ABS_HIGH", "190"))
+ABS_LOW = float(os.getenv("HR_ABS_LOW", "40"))
+# Readings outside this range are sensor garbage, not physiology
+VALID_MIN, VALID_MAX = 25.0, 240.0
+# Baselines are written to the DB this often (only devices that changed)
+PERSIST_SECONDS = float(os.getenv("HR_BASELINE_PERSIST_SECONDS", "60"))
+IDLE_EVICT_SECONDS = 3600.0
+
+_ALPHA = 2.0 / (BASELINE_SPAN + 1)
+
+
+class _HRState:
+    """Per-device state: a handful of floats, updated in O(1) per sample."""
+    __slots__ = (
+        "mean", "var", "samples",
+        "run_dir", "run_start", "alerted",
+        "last_high", "last_low", "last_seen", "dirty",
+    )
+
+    def __init__(self, mean: float = 0.0, var: float = 0.0, samples: int = 0):
+        self.mean = mean
+        self.var = var
+        self.samples = samples
+        self.run_dir = 0            # +1 above band, -1 below, 0 inside
+        self.run_start = 0.0        # sample time the current excursion began
+        self.alerted = False        # current excursion already reported
+        self.last_high = -1e18
+        self.last_low = -1e18
+        self.last_seen = time.monotonic()
+        self.dirty = False
+
+
+class HeartRateMonitor:
+    """
+    Streaming HR anomaly detection with a personal baseline per helmet (one
+    helmet = one rider). Each clean sample updates an EWMA mean/variance, and
+    is checked against mean ± K·std. A high_hr / low_hr alert fires once the
+    reading has stayed outside the band for SUSTAIN_SECONDS, once per
+    excursion and per cooldown. Samples with ok/finger false are ignored.
+    """
+
+    def __init__(self):
+        self.states: Dict[str, _HRState] = {}
+        self.samples = 0
+        self.suppressed = 0
+        self.alerts = {AlertType.high_hr.value: 0, AlertType.low_hr.value: 0}
+        self.persisted = 0
+
+    def band(self, st: _HRState) -> tuple:
+        if st.samples < WARMUP_SAMPLES:
+            return ABS_LOW, ABS_HIGH
+        std = max(st.var ** 0.5, MIN_STD)
+        return (
+            max(st.mean - BAND_K * std, ABS_LOW),
+            min(st.mean + BAND_K * std, ABS_HIGH),
+        )
+
+    def observe(self, obj: TelemetryIn) -> Optional[dict]:
+        """
+        Fold one telemetry sample in. Returns an alert message (ws "alert"
+        shape) when an excursion becomes sustained, else None.
+        """
+        hrd = obj.heart_rate
+        self.samples += 1
+        st = self.states.get(obj.device_id)
+        if st is None:
+            st = self.states[obj.device_id] = _HRState()
+        st.last_seen = time.monotonic()
+
+        hr = float(hrd.hr)
+        if not (hrd.ok and hrd.finger) or not (VALID_MIN <= hr <= VALID_MAX):
+            # Sensor off-skin or glitching: no baseline update, and a gap
+            # breaks "sustained" so noise can't stitch an excursion together
+            self.suppressed += 1
+            st.run_dir = 0
+            return None
+
+        ts = to_epoch(obj.ts)
+        lo, hi = self.band(st)
+        direction = 1 if hr > hi else -1 if hr < lo else 0
+
+        if direction == 0:
+            # Only in-band samples move the baseline, so a long excursion
+            # can't drag the band along with it
+            if st.samples == 0:
+                st.mean = hr
+            else:
+                diff = hr - st.mean
+                incr = _ALPHA * diff
+                st.mean += incr
+                st.var = (1.0 - _ALPHA) * (st.var + diff * incr)
+            st.samples += 1
+            st.dirty = True
+            st.run_dir = 0
+            return None
+
+        if direction != st.run_dir:
+            st.run_dir = direction
+            st.run_start = ts
+            st.alerted = False
+            return None
+        if st.alerted or ts - st.run_start < SUSTAIN_SECONDS:
+            return None
+
+        high = direction > 0
+        last = st.last_high if high else st.last_low
+        st.alerted = True
+        if ts - last < ALERT_COOLDOWN_SECONDS:
+            return None
+        if high:
+            st.last_high = ts
+        else:
+            st.last_low = ts
+
+        alert_type = AlertType.high_hr if high else AlertType.low_hr
+        self.alerts[alert_type.value] += 1
+        critical = hr >= ABS_HIGH or hr <= ABS_LOW
+        return {
+            "type": "alert",
+            "device_id": obj.device_id,
+            "ts": obj.ts,
+            "trip_id": obj.trip_id,
+            "alert_type": alert_type.value,
+            "severity": (Severity.critical if critical else Severity.warning).value,
+            "message": (
+                f"Heart rate {int(hr)} bpm {'above' if high else 'below'} personal range "
+                f"{lo:.0f}-{hi:.0f} for {ts - st.run_start:.0f}s"
+            ),
+            "payload": {
+                "hr": int(hr),
+                "baseline": round(st.mean, 1),
+                "std": round(st.var ** 0.5, 1),
+                "band": [round(lo, 1), round(hi, 1)],
+                "duration_s": round(ts - st.run_start, 1),
+                "warming_up": st.samples < WARMUP_SAMPLES,
+            },
+        }
+
+    # -----------------------
+    # Persistence
+    # -----------------------
+
+    async def load(self) -> None:
+        """Restore stored baselines (devices already seen keep their live state)."""
+        from app.database.connection import get_db_context
+        from app.repositories.hr_baselines_repo import load_baselines
+
+        async with get_db_context() as db:
+            rows = await load_baselines(db)
+        for device_id, mean, var, samples in rows:
+            if device_id not in self.states and mean is not None:
+                self.states[device_id] = _HRState(mean, var or 0.0, samples or 0)
+
+    async def persist(self) -> int:
+        from app.database.connection import get_db_context
+        from app.repositories.hr_baselines_repo import upsert_baselines
+
+        dirty = [(d, st) for d, st in self.states.items() if st.dirty]
+        if not dirty:
+            return 0
+        rows = [
+            {"device_id": d, "mean": st.mean, "var": st.var, "samples": st.samples}
+            for d, st in dirty
+        ]
+        async with get_db_context() as db:
+            await upsert_baselines(db, rows)
+            await db.commit()
+        for _, st in dirty:
+            st.dirty = False
+        self.persisted += len(rows)
+        return len(rows)
+
+    async def run(self) -> None:
+        """Load baselines, then persist changed ones every PERSIST_SECONDS."""
+        try:
+            await self.load()
+        except Exception as e:
+            print(f"[hr] could not load baselines: {e}")
+        while True:
+            await asyncio.sleep(PERSIST_SECONDS)
+            try:
+                await self.persist()
+            except Exception as e:
+                print(f"[hr] persist error: {e}")
+                continue
+            cutoff = time.monotonic() - IDLE_EVICT_SECONDS
+            for device_id in [d for d, st in self.states.items() if st.last_seen < cutoff and not st.dirty]:
+                del self.states[device_id]
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self.states),
+            "samples": self.samples,
+            "suppressed": self.suppressed,
+            "alerts": dict(self.alerts),
+            "baselines_persisted": self.persisted,
+        }
+
+
+hr_monitor = HeartRateMonitor()
@@ -0,0 +1,51 @@
+# app/services/latency.py
+from __future__ import annotations
+
+import numpy as np
+
+
+class LatencyTracker:
+    """
+    Rolling latency sample (last N observations, milliseconds) with cheap
+    record() and percentiles computed only when stats() is read.
+    """
+    __slots__ = ("samples", "head", "count", "max_ms")
+
+    def __init__(self, size: int = 1024):
+        self.samples = np.zeros(size, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+        self.max_ms = 0.0
+
+    def record(self, seconds: float) -> None:
+        ms = seconds * 1000.0
+        self.samples[self.head] = ms
+        self.head = (self.head + 1) % len(self.samples)
+        self.count += 1
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def stats(self) -> dict:
+        n = min(self.count, len(self.samples))
+        if n == 0:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(self.samples[:n], [50, 95, 99])
+        return {
+            "count": self.count,
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(self.max_ms, 2),
+        }
+
+
+# Per-lane end-to-end latencies, measured from receipt on /ws/ingest
+lane_latency = {
+    "priority_notify": LatencyTracker(),   # -> pushed to every owner's stream
+    "priority_persist": LatencyTracker(),  # -> committed by the priority lane
+    "bulk_persist": LatencyTracker(),      # -> committed by the bulk lane
+}
+
+
+def latency_stats() -> dict:
+    return {name: tracker.stats() for name, tracker in lane_latency.items()}
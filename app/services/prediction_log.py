@@ -0,0 +1,138 @@
+# app/services/prediction_log.py
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from app.ml.features import FEATURE_NAMES
+
+# Negatives are logged 1-in-N (positives always); 0 disables prediction logging
+NEGATIVE_SAMPLE_EVERY = int(os.getenv("PREDICTION_LOG_NEGATIVE_EVERY", "100"))
+# Buffered rows are written in one INSERT when this many are pending...
+FLUSH_ROWS = int(os.getenv("PREDICTION_LOG_FLUSH_ROWS", "500"))
+# ...or at least this often
+FLUSH_SECONDS = float(os.getenv("PREDICTION_LOG_FLUSH_SECONDS", "5"))
+# If the DB falls behind, the oldest pending rows are dropped beyond this
+MAX_PENDING = 50_000
+
+
+class PredictionLog:
+    """
+    Sampled, buffered logging of model outputs to the predictions table.
+    The inference cycle only appends dicts to a list; a background task turns
+    them into one bulk INSERT per flush, so logging adds a handful of writes
+    per minute instead of one per scored window.
+    """
+
+    def __init__(
+        self,
+        negative_every: int = NEGATIVE_SAMPLE_EVERY,
+        flush_rows: int = FLUSH_ROWS,
+        flush_seconds: float = FLUSH_SECONDS,
+    ):
+        self.negative_every = negative_every
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._pending: List[dict] = []
+        self._wake: Optional[asyncio.Event] = None
+
+        self.logged = 0
+        self.written = 0
+        self.dropped = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.negative_every > 0
+
+    def select(self, positive: np.ndarray) -> np.ndarray:
+        """Indices to log: every positive plus a random 1-in-N of negatives."""
+        if not self.enabled:
+            return np.zeros(0, dtype=np.int64)
+        if self.negative_every == 1:
+            return np.arange(len(positive))
+        sampled = np.random.random(len(positive)) < 1.0 / self.negative_every
+        return np.flatnonzero(positive | sampled)
+
+    def add(
+        self,
+        device_ids: Sequence[str],
+        trip_ids: Sequence[Optional[str]],
+        window_end: Sequence,
+        probs: np.ndarray,
+        positive: np.ndarray,
+        features: np.ndarray,
+        model_version: str,
+    ) -> None:
+        """Queue already-selected rows (all sequences aligned)."""
+        feats = np.round(features, 4).tolist()
+        for i in range(len(device_ids)):
+            self._pending.append({
+                "device_id": device_ids[i],
+                "trip_id": trip_ids[i],
+                "window_end": window_end[i],
+                "model_version": model_version,
+                "probability": float(probs[i]),
+                "positive": bool(positive[i]),
+                "sample_weight": 1 if positive[i] else self.negative_every,
+                "features": dict(zip(FEATURE_NAMES, feats[i])),
+            })
+        self.logged += len(device_ids)
+        if len(self._pending) > MAX_PENDING:
+            overflow = len(self._pending) - MAX_PENDING
+            del self._pending[:overflow]
+            self.dropped += overflow
+        if len(self._pending) >= self.flush_rows and self._wake is not None:
+            self._wake.set()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        from app.database.connection import get_db_context
+        from app.repositories.predictions_repo import bulk_insert_predictions
+
+        batch, self._pending = self._pending, []
+        started = time.perf_counter()
+        try:
+            async with get_db_context() as db:
+                await bulk_insert_predictions(db, batch)
+                await db.commit()
+        except Exception as e:
+            self.flush_errors += 1
+            self.dropped += len(batch)
+            print(f"[predictions] flush failed, dropped {len(batch)} rows: {e}")
+            return 0
+        self.last_flush_ms = (time.perf_counter() - started) * 1000.0
+        self.written += len(batch)
+        return len(batch)
+
+    async def run(self) -> None:
+        """Flush every FLUSH_SECONDS, or sooner once FLUSH_ROWS are pending."""
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "negative_every": self.negative_every,
+            "logged": self.logged,
+            "written": self.written,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "flush_errors": self.flush_errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+
+prediction_log = PredictionLog()
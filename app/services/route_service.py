@@ -0,0 +1,296 @@
+# app/services/route_service.py
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.analytics_service import derive_speeds
+from app.services.geo import EARTH_RADIUS_M
+
+# Allowed deviation of the simplified line, in screen pixels at the requested zoom
+PIXEL_TOLERANCE = float(os.getenv("ROUTE_PIXEL_TOLERANCE", "1.0"))
+# Simplified routes kept in memory, one entry per (trip, level of detail)
+CACHE_ENTRIES = int(os.getenv("ROUTE_CACHE_ENTRIES", "256"))
+
+# Web-mercator ground resolution at zoom 0 on the equator (m/px, 256 px tiles)
+_M_PER_PX_Z0 = 2 * math.pi * EARTH_RADIUS_M / 256
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+# Route representations (GET .../route?format= or Accept)
+POLYLINE_MEDIA_TYPE = "application/vnd.polyline+json"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+BINARY_FIELDS = "lat,lng,t,speed"
+
+
+class Route:
+    """
+    A trip's route as column arrays (time-ordered, valid fixes only).
+    ts: naive UTC datetimes (JSON responses); t: the same as epoch seconds;
+    speed: km/h, NaN where unknown.
+    """
+    __slots__ = ("ts", "t", "lat", "lng", "speed")
+
+    def __init__(
+        self,
+        ts: Sequence[datetime],
+        t: np.ndarray,
+        lat: np.ndarray,
+        lng: np.ndarray,
+        speed: np.ndarray,
+    ):
+        self.ts = ts
+        self.t = t
+        self.lat = lat
+        self.lng = lng
+        self.speed = speed
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def take(self, idx: np.ndarray) -> "Route":
+        return Route(
+            [self.ts[i] for i in idx], self.t[idx], self.lat[idx], self.lng[idx], self.speed[idx]
+        )
+
+    def speed_list(self, ndigits: int = 1) -> List[Optional[float]]:
+        """Speeds for JSON: rounded, None where unknown."""
+        return [None if v != v else round(v, ndigits) for v in self.speed.tolist()]
+
+
+def route_from_rows(rows: Sequence[tuple]) -> Route:
+    """
+    (timestamp, lat, lng, speed) rows -> Route, dropping (0, 0) no-fix
+    samples. Trips stored before speeds existed (column all NULL) get them
+    derived here, with the same rules as ingest.
+    """
+    if not rows:
+        return Route([], np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0))
+    ts, lat, lng, speed = zip(*rows)
+    t = np.fromiter(((x - _EPOCH) / _SECOND for x in ts), dtype=np.float64, count=len(ts))
+    lat = np.array(lat, dtype=np.float64)
+    lng = np.array(lng, dtype=np.float64)
+    speed = np.array(speed, dtype=np.float64)
+    if np.isnan(speed).all():
+        speed = derive_speeds(t, lat, lng)
+    keep = np.flatnonzero(~((lat == 0) & (lng == 0)))
+    if len(keep) == len(lat):
+        return Route(list(ts), t, lat, lng, speed)
+    return Route([ts[i] for i in keep], t[keep], lat[keep], lng[keep], speed[keep])
+
+
+def tolerance_for_zoom(zoom: int, lat: float) -> float:
+    """Metres covered by PIXEL_TOLERANCE pixels at a web-map zoom level and latitude."""
+    return PIXEL_TOLERANCE * _M_PER_PX_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def lod_tolerance(tolerance_m: float) -> float:
+    """Snap a tolerance to the power-of-two ladder (one cache entry per step)."""
+    return 2.0 ** round(math.log2(tolerance_m))
+
+
+def simplify(lat: np.ndarray, lng: np.ndarray, tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker: indices of the points to keep so that no dropped point
+    lies further than tolerance_m from the simplified line. Points are
+    projected to local metres (equirectangular; exact enough at trip scale);
+    the distance to each candidate chord is computed in one NumPy pass, so
+    the Python loop runs once per kept point, not per sample.
+    """
+    n = len(lat)
+    if n <= 2 or tolerance_m <= 0:
+        return np.arange(n)
+    lat0 = math.radians(float(lat.mean()))
+    x = np.radians(lng) * (EARTH_RADIUS_M * math.cos(lat0))
+    y = np.radians(lat) * EARTH_RADIUS_M
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack: List[Tuple[int, int]] = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        px = x[a + 1:b] - x[a]
+        py = y[a + 1:b] - y[a]
+        dx = x[b] - x[a]
+        dy = y[b] - y[a]
+        seg2 = dx * dx + dy * dy
+        if seg2 > 0:
+            # Distance to the segment (not the infinite line), so a route that
+            # doubles back on itself keeps its turning point
+            u = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+            d2 = (px - u * dx) ** 2 + (py - u * dy) ** 2
+        else:
+            d2 = px * px + py * py
+        i = int(np.argmax(d2))
+        if d2[i] > tolerance_m * tolerance_m:
+            m = a + 1 + i
+            keep[m] = True
+            stack.append((a, m))
+            stack.append((m, b))
+    return np.flatnonzero(keep)
+
+
+# -----------------------
+# Compact representations
+# -----------------------
+
+def encode_polyline(lat: np.ndarray, lng: np.ndarray, precision: int = 5) -> str:
+    """
+    Google encoded polyline, vectorized: every coordinate delta is zigzagged
+    and split into 5-bit chunks in array form; no per-point Python.
+    """
+    if not len(lat):
+        return ""
+    pts = np.round(np.column_stack((lat, lng)) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(pts, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    v = deltas << 1
+    v = np.where(deltas < 0, ~v, v)
+    # int64 deltas need at most 13 chunks; real coordinates use up to 7
+    shifts = np.arange(0, 65, 5, dtype=np.int64)
+    chunks = (v[:, None] >> shifts) & 0x1F
+    n_chunks = 1 + ((v[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    col = np.arange(len(shifts))
+    chunks |= np.where(col < (n_chunks - 1)[:, None], 0x20, 0)
+    out = (chunks + 63)[col < n_chunks[:, None]]
+    return out.astype(np.uint8).tobytes().decode("ascii")
+
+
+def polyline_payload(trip_id: str, route: Route, precision: int = 5) -> dict:
+    """
+    {"polyline": ..., "ts": [...]} where ts is delta-encoded epoch
+    milliseconds: ts[0] is absolute, the rest are gaps, so a cumulative sum
+    restores every timestamp (UTC).
+    """
+    ms = np.round(route.t * 1000.0).astype(np.int64)
+    return {
+        "trip_id": trip_id,
+        "points": len(route),
+        "precision": precision,
+        "polyline": encode_polyline(route.lat, route.lng, precision),
+        "ts": np.diff(ms, prepend=np.int64(0)).tolist(),
+        "speed": route.speed_list(),
+    }
+
+
+def binary_payload(route: Route) -> Tuple[bytes, dict]:
+    """
+    Packed little-endian float32 records (lat, lng, t, speed) per point, t
+    in seconds since the first point, speed in km/h (NaN = unknown), plus the
+    headers needed to read it. float32 keeps coordinates to ~0.5 m and t to
+    ~1 ms for rides under ~4 h.
+    """
+    start = float(route.t[0]) if len(route) else 0.0
+    buf = np.empty((len(route), 4), dtype="<f4")
+    buf[:, 0] = route.lat
+    buf[:, 1] = route.lng
+    buf[:, 2] = route.t - start
+    buf[:, 3] = route.speed
+    headers = {
+        "X-Route-Points": str(len(route)),
+        "X-Route-Fields": BINARY_FIELDS,
+        "X-Route-Start-Ms": str(int(round(start * 1000.0))),
+    }
+    return buf.tobytes(), headers
+
+
+def negotiate_format(fmt: Optional[str], accept: Optional[str]) -> str:
+    """?format= wins; otherwise the Accept header; JSON points by default."""
+    if fmt:
+        return fmt
+    accept = accept or ""
+    if POLYLINE_MEDIA_TYPE in accept:
+        return "polyline"
+    if BINARY_MEDIA_TYPE in accept:
+        return "binary"
+    return "json"
+
+
+class RouteCache:
+    """
+    LRU of simplified routes for closed trips, keyed (trip_id, tolerance).
+    A recording trip still grows, so it is never cached; whatever rewrites a
+    closed trip's trip_data calls invalidate() after committing.
+    """
+
+    def __init__(self, max_entries: int = CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Route]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, trip_id: str, tolerance_m: float) -> Optional[Route]:
+        key = (trip_id, tolerance_m)
+        route = self._entries.get(key)
+        if route is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return route
+
+    def put(self, trip_id: str, tolerance_m: float, route: Route) -> None:
+        self._entries[(trip_id, tolerance_m)] = route
+        self._entries.move_to_end((trip_id, tolerance_m))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, trip_id: str) -> None:
+        """Drop every level of detail cached for a trip whose points changed."""
+        for key in [k for k in self._entries if k[0] == trip_id]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+route_cache = RouteCache()
+
+
+def _simplified_route(rows: Sequence[tuple], tolerance_m: float) -> Route:
+    full = route_from_rows(rows)
+    return full.take(simplify(full.lat, full.lng, tolerance_m))
+
+
+async def load_route(
+    db,
+    trip_id: str,
+    cacheable: bool,
+    zoom: Optional[int] = None,
+    tolerance_m: Optional[float] = None,
+    ref_lat: Optional[float] = None,
+) -> Route:
+    """
+    A trip's route at the requested level of detail (zoom wins over
+    tolerance_m; neither = every point). ref_lat (e.g. the trip's start_lat)
+    turns zoom into metres; without it the equator is assumed, which is at
+    most one ladder step coarser at riding latitudes. cacheable: the trip is
+    closed, so the simplified result can be reused. Building the route
+    (speed derivation for older trips) and simplifying it run in a thread.
+    """
+    from app.repositories.trips_repo import TripsRepo
+
+    if zoom is not None:
+        tolerance_m = tolerance_for_zoom(zoom, ref_lat or 0.0)
+    if tolerance_m is None:
+        rows = await TripsRepo.get_trip_route_rows(db, trip_id)
+        return await asyncio.to_thread(route_from_rows, rows)
+
+    tolerance_m = lod_tolerance(tolerance_m)
+    if cacheable:
+        hit = route_cache.get(trip_id, tolerance_m)
+        if hit is not None:
+            return hit
+    rows = await TripsRepo.get_trip_route_rows(db, trip_id)
+    route = await asyncio.to_thread(_simplified_route, rows, tolerance_m)
+    if cacheable:
+        route_cache.put(trip_id, tolerance_m, route)
+    return route
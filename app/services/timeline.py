@@ -0,0 +1,95 @@
+# app/services/timeline.py
+from __future__ import annotations
+
+import heapq
+import json
+from typing import AsyncIterator, Optional
+from zoneinfo import ZoneInfo
+
+from app.services.broadcaster import to_epoch
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+TIMELINE_COLUMNS = (
+    "timestamp", "lat", "lng", "speed", "heart_rate",
+    "acc_x", "acc_y", "acc_z", "gyro_x", "gyro_y", "gyro_z", "crash_flag",
+)
+CHUNK_ROWS = 5_000      # telemetry rows per cursor fetch
+LINES_PER_WRITE = 500   # NDJSON lines per chunk sent
+
+_UTC = ZoneInfo("UTC")
+_BEIRUT = ZoneInfo("Asia/Beirut")
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+async def _telemetry(db, trip_id: str, hz: Optional[float]) -> AsyncIterator[tuple]:
+    """(epoch, 0, item) per sample; with hz, the first sample of each 1/hz slot (crashes always)."""
+    from app.repositories.telemetry_repo import stream_trip_columns
+
+    names = TIMELINE_COLUMNS[1:]
+    slot = None
+    async for rows in stream_trip_columns(db, trip_id, TIMELINE_COLUMNS, CHUNK_ROWS):
+        for row in rows:
+            ts = row[0]
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=_UTC)   # naive = UTC
+            t = ts.timestamp()
+            if hz is not None:
+                s = int(t * hz)
+                if s == slot and not row[-1]:
+                    continue
+                slot = s
+            item = {"type": "telemetry", "ts": ts.astimezone(_BEIRUT).isoformat()}
+            item.update(zip(names, row[1:]))
+            yield t, 0, item
+
+
+async def _alerts(db, trip_id: str) -> AsyncIterator[tuple]:
+    """(epoch, 1, item) per alert: after the sample with the same timestamp."""
+    from app.models.schemas import AlertOut
+    from app.repositories.alerts_repo import stream_for_trip
+
+    async for alert in stream_for_trip(db, trip_id):
+        item = {"type": "alert", **AlertOut.model_validate(alert).model_dump(mode="json")}
+        yield to_epoch(alert.ts), 1, item
+
+
+async def _merge(*streams: AsyncIterator[tuple]) -> AsyncIterator[dict]:
+    """Heap merge of time-ordered (epoch, rank, item) streams, one head per stream in memory."""
+    heap = []
+    for i, stream in enumerate(streams):
+        head = await anext(stream, None)
+        if head is not None:
+            heap.append((head[0], head[1], i, head[2]))
+    heapq.heapify(heap)
+    while heap:
+        t, rank, i, item = heap[0]
+        yield item
+        head = await anext(streams[i], None)
+        if head is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (head[0], head[1], i, head[2]))
+
+
+async def timeline_ndjson(trip_id: str, hz: Optional[float] = None) -> AsyncIterator[bytes]:
+    """
+    A trip's telemetry (optionally downsampled to `hz`) and alerts merged in
+    time order, as NDJSON, ending with a {"type": "end"} line carrying the
+    counts. Each source reads through its own connection and server-side
+    cursor (MySQL can't interleave two streaming results on one), so server
+    memory is one fetch chunk plus one pending write whatever the trip length.
+    """
+    from app.database.connection import AsyncSessionLocal
+
+    counts = {"telemetry": 0, "alert": 0}
+    async with AsyncSessionLocal() as tel_db, AsyncSessionLocal() as alert_db:
+        lines = []
+        async for item in _merge(_telemetry(tel_db, trip_id, hz), _alerts(alert_db, trip_id)):
+            counts[item["type"]] += 1
+            lines.append(_encode(item))
+            if len(lines) >= LINES_PER_WRITE:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+        lines.append(_encode({"type": "end", "trip_id": trip_id, **counts}))
+        yield ("\n".join(lines) + "\n").encode()
@@ -0,0 +1,180 @@
+# app/services/user_stats.py
+from __future__ import annotations
+
+import os
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+# Days (and so weeks/months) are cut in the riders' local time
+STATS_TZ = ZoneInfo(os.getenv("USER_STATS_TIMEZONE", "Asia/Beirut"))
+# Cached answers are dropped on trip close (this process) and after this long
+# (closes handled by other worker processes)
+CACHE_SECONDS = float(os.getenv("USER_STATS_CACHE_SECONDS", "60"))
+CACHE_USERS = 10_000
+
+PERIODS = ("day", "week", "month", "year", "all")
+
+_UTC = ZoneInfo("UTC")
+
+
+def local_day(ts: datetime) -> date:
+    """Local calendar day of a naive-UTC timestamp."""
+    return ts.replace(tzinfo=_UTC).astimezone(STATS_TZ).date()
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    """[start, end) of a local day, as naive UTC (the DB's convention)."""
+    start = datetime.combine(day, datetime.min.time(), STATS_TZ)
+    end = datetime.combine(day + timedelta(days=1), datetime.min.time(), STATS_TZ)
+    return (
+        start.astimezone(_UTC).replace(tzinfo=None),
+        end.astimezone(_UTC).replace(tzinfo=None),
+    )
+
+
+def period_start(period: str, today: date) -> Optional[date]:
+    """First local day of the current period (weeks start on Monday)."""
+    if period == "day":
+        return today
+    if period == "week":
+        return today - timedelta(days=today.weekday())
+    if period == "month":
+        return today.replace(day=1)
+    if period == "year":
+        return today.replace(month=1, day=1)
+    return None
+
+
+def _bucket(user_id: str, day: date, trips: Sequence[tuple]) -> dict:
+    """UserDailyStats row from (start, end, distance, crash_count, max_speed) tuples."""
+    ride_seconds = sum(
+        max((end - start).total_seconds(), 0.0)
+        for start, end, *_ in trips if start is not None and end is not None
+    )
+    speeds = [t[4] for t in trips if t[4] is not None]
+    return {
+        "user_id": user_id,
+        "day": day,
+        "trips": len(trips),
+        "distance_km": round(sum(t[2] or 0.0 for t in trips), 3),
+        "ride_seconds": ride_seconds,
+        "crashes": sum(t[3] or 0 for t in trips),
+        "max_speed": max(speeds) if speeds else None,
+        "updated_at": datetime.utcnow(),
+    }
+
+
+class UserStats:
+    """
+    Per-user totals ("distance this week") read from user_daily_stats, one
+    row per user and local day. A row is rebuilt from that day's trips
+    whenever one of them closes or gets its stats recomputed, so it is always
+    exact and re-running is harmless. A day/week/month/year read sums at
+    most 366 rows; "all" sums one row per day ridden (not per trip or
+    sample). Reads are cached per (user, period).
+    """
+
+    def __init__(self):
+        # user_id -> {period: (local day, monotonic time, result)}, LRU by user
+        self._cache: "OrderedDict[str, dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.buckets_refreshed = 0
+
+    # -----------------------
+    # Writes
+    # -----------------------
+
+    async def refresh_buckets(self, db, buckets: Iterable[Tuple[str, date]]) -> int:
+        """Rebuild the given (user_id, day) rows. Caller commits."""
+        from app.repositories.user_stats_repo import closed_trips_between, upsert_daily_stats
+
+        rows = []
+        for user_id, day in set(buckets):
+            start, end = day_bounds(day)
+            rows.append(_bucket(user_id, day, await closed_trips_between(db, user_id, start, end)))
+        await upsert_daily_stats(db, rows)
+        self.buckets_refreshed += len(rows)
+        for user_id in {r["user_id"] for r in rows}:
+            self.invalidate(user_id)
+        return len(rows)
+
+    async def on_trips_closed(self, trip_ids: Sequence[str]) -> None:
+        """Refresh the buckets of trips that just closed or got new stats."""
+        from app.database.connection import get_db_context
+        from app.repositories.user_stats_repo import trip_starts
+
+        async with get_db_context() as db:
+            starts = await trip_starts(db, trip_ids)
+            buckets = {(user_id, local_day(ts)) for user_id, ts in starts if ts is not None}
+            if buckets:
+                await self.refresh_buckets(db, buckets)
+                await db.commit()
+
+    async def backfill(self) -> int:
+        """Build every bucket when the table is still empty (first start on old data)."""
+        from app.database.connection import get_db_context
+        from app.repositories.user_stats_repo import count_daily_rows, list_trip_owner_starts
+
+        async with get_db_context() as db:
+            if await count_daily_rows(db):
+                return 0
+            buckets = {(user_id, local_day(ts)) for user_id, ts in await list_trip_owner_starts(db)}
+            if not buckets:
+                return 0
+            count = await self.refresh_buckets(db, buckets)
+            await db.commit()
+        print(f"[user-stats] built {count} daily bucket(s)")
+        return count
+
+    # -----------------------
+    # Reads
+    # -----------------------
+
+    def invalidate(self, user_id: str) -> None:
+        self._cache.pop(user_id, None)
+
+    async def get(self, db, user_id: str, period: str) -> dict:
+        from app.repositories.user_stats_repo import sum_daily_stats
+
+        today = datetime.now(STATS_TZ).date()
+        entry = self._cache.get(user_id)
+        hit = entry.get(period) if entry else None
+        if hit is not None and hit[0] == today and time.monotonic() - hit[1] < CACHE_SECONDS:
+            self._cache.move_to_end(user_id)
+            self.hits += 1
+            return hit[2]
+        self.misses += 1
+
+        since = period_start(period, today)
+        days, trips, distance_km, ride_seconds, crashes, max_speed = await sum_daily_stats(db, user_id, since)
+        result = {
+            "period": period,
+            "since": since,
+            "trips": int(trips),
+            "ride_days": int(days),
+            "distance_km": round(float(distance_km), 3),
+            "ride_seconds": round(float(ride_seconds), 1),
+            "average_speed": round(float(distance_km) / ride_seconds * 3600.0, 2) if ride_seconds else 0.0,
+            "max_speed": max_speed,
+            "crashes": int(crashes),
+        }
+        self._cache.setdefault(user_id, {})[period] = (today, time.monotonic(), result)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > CACHE_USERS:
+            self._cache.popitem(last=False)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "cached_users": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "buckets_refreshed": self.buckets_refreshed,
+        }
+
+
+user_stats = UserStats()
@@ -0,0 +1,296 @@
+from __future__ import annotations
+import asyncio
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.database.connection import get_db_context
+from app.models.schemas import TelemetryIn, AlertType, Severity
+from app.ml.features import extract_features
+from app.ml.gate import StreamingGate
+from app.ml.inference_pool import create_scorer
+from app.ml.predictor import MODEL_PATH
+from app.ml.windows import DeviceWindows, sample_row, CH
+from app.repositories.alerts_repo import insert_alert
+from app.services.broadcaster import to_epoch
+from app.services.prediction_log import prediction_log
+
+
+# How often all dirty windows are scored together
+CADENCE_SECONDS = float(os.getenv("ML_CADENCE_SECONDS", "1.0"))
+# Probability at or above which a crash_server alert is raised
+CRASH_THRESHOLD = float(os.getenv("ML_CRASH_THRESHOLD", "0.8"))
+# One server alert per device per cooldown, however many windows score high
+ALERT_COOLDOWN_SECONDS = 30.0
+# Poll interval for model file changes (0 disables; reload is then admin-only)
+MODEL_WATCH_SECONDS = float(os.getenv("ML_MODEL_WATCH_SECONDS", "5"))
+
+# Sliding windows for every active device (filled from /ws/ingest)
+_WINDOWS = DeviceWindows()
+
+# Stage 1 of the cascade: only windows around triggering samples reach the model
+_GATE = StreamingGate()
+
+# Map device_id -> last trip_id seen on ingest / monotonic time of last alert
+_LAST_TRIP: Dict[str, Optional[str]] = {}
+_LAST_ALERT: Dict[str, float] = {}
+
+# ThreadScorer or ProcessScorer (ML_EXECUTION_MODE)
+_scorer = None
+# One reload at a time (watcher and admin endpoint can race)
+_RELOAD_LOCK = asyncio.Lock()
+
+_STATS = {
+    "cycles": 0,
+    "skipped_cycles": 0,
+    "model_calls": 0,
+    "windows_scored": 0,
+    "alerts": 0,
+    "last_batch": 0,
+    "last_infer_ms": 0.0,
+    "model_reloads": 0,
+    "model_reload_error": None,
+}
+
+
+def feed_inference(obj: TelemetryIn) -> None:
+    """
+    Append one validated sample to the device's window.
+    Synchronous and O(channels): safe to call inline from /ws/ingest.
+    Without a valid fix the position is NaN, which the features skip.
+    """
+    gps = obj.gps
+    if not (gps.ok and gps.lock) or (gps.lat == 0 and gps.lng == 0):
+        lat = lng = math.nan
+    else:
+        lat, lng = gps.lat, gps.lng
+    _WINDOWS.push(
+        obj.device_id,
+        sample_row(
+            to_epoch(obj.ts),
+            obj.imu.ax, obj.imu.ay, obj.imu.az,
+            obj.imu.gx, obj.imu.gy, obj.imu.gz,
+            obj.heart_rate.hr,
+            lat, lng,
+        ),
+    )
+    _GATE.check(
+        obj.device_id,
+        obj.imu.ax, obj.imu.ay, obj.imu.az,
+        obj.imu.gx, obj.imu.gy, obj.imu.gz,
+        obj.crash_flag,
+        imu_valid=obj.imu.ok and not obj.imu.sleep,
+    )
+    if obj.trip_id:
+        _LAST_TRIP[obj.device_id] = obj.trip_id
+
+
+async def start_inference_worker() -> None:
+    """
+    Run forever on a fixed cadence: score every device that received new data
+    in one batch. If a cycle overruns (or the event loop is lagging), the next
+    due cycles are skipped rather than queued, so inference load can never
+    build up behind ingest.
+    """
+    global _scorer
+    _scorer = await create_scorer()
+
+    next_tick = time.monotonic() + CADENCE_SECONDS
+    while True:
+        await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+        now = time.monotonic()
+        if now - next_tick > CADENCE_SECONDS:
+            # Fell behind by a whole cycle or more: drop the missed ones
+            missed = int((now - next_tick) // CADENCE_SECONDS)
+            _STATS["skipped_cycles"] += missed
+            next_tick += missed * CADENCE_SECONDS
+        next_tick += CADENCE_SECONDS
+
+        try:
+            await _run_cycle()
+        except Exception as e:
+            print(f"[inference] error: {e}")
+
+
+async def _run_cycle() -> None:
+    slots = _WINDOWS.take_dirty()
+    _STATS["cycles"] += 1
+    if len(slots):
+        slots = slots[_GATE.select(_WINDOWS.device_of(slots))]
+    _STATS["last_batch"] = len(slots)
+    if len(slots) == 0:
+        return
+    _STATS["model_calls"] += 1
+
+    batch = _WINDOWS.gather(slots)
+    started = time.perf_counter()
+    # Scoring happens off the event loop (thread or worker process)
+    probs, version = await _scorer.score(batch)
+    _STATS["last_infer_ms"] = (time.perf_counter() - started) * 1000.0
+    _STATS["windows_scored"] += len(slots)
+
+    positive = probs >= CRASH_THRESHOLD
+    _log_predictions(slots, batch, probs, positive, version)
+
+    hits = np.flatnonzero(positive)
+    for i in hits:
+        await _raise_crash_alert(int(slots[i]), float(probs[i]), version)
+
+
+def _log_predictions(slots: np.ndarray, batch: np.ndarray, probs: np.ndarray,
+                     positive: np.ndarray, version: str) -> None:
+    """Hand the sampled subset of this cycle's outputs to the prediction log."""
+    from app.workers.persist_worker import _ACTIVE_TRIP
+
+    keep = prediction_log.select(positive)
+    if len(keep) == 0:
+        return
+    kept = slots[keep]
+    device_ids = _WINDOWS.device_of(kept)
+    window_end = [
+        datetime.fromtimestamp(t, tz=timezone.utc).replace(tzinfo=None)
+        for t in _WINDOWS.newest_ts(kept).tolist()
+    ]
+    prediction_log.add(
+        device_ids,
+        [_LAST_TRIP.get(d) or _ACTIVE_TRIP.get(d) for d in device_ids],
+        window_end,
+        probs[keep],
+        positive[keep],
+        # Recomputed on the sampled rows only; cheap next to the model
+        extract_features(batch[keep]),
+        version,
+    )
+
+
+def _finite_or_none(v) -> Optional[float]:
+    v = float(v)
+    return v if math.isfinite(v) else None
+
+
+async def _raise_crash_alert(slot: int, prob: float, model_version: str) -> None:
+    device_id = _WINDOWS.devices[slot]
+    now = time.monotonic()
+    if now - _LAST_ALERT.get(device_id, 0.0) < ALERT_COOLDOWN_SECONDS:
+        return
+    _LAST_ALERT[device_id] = now
+
+    from app.repositories.devices_repo import get_device
+    from app.workers.persist_worker import _resolve_active_trip_id
+    from app.services.device_owner_cache import owner_cache
+    from app.services.connection_manager import manager
+
+    sample = _WINDOWS.newest(slot)
+    ts = datetime.fromtimestamp(float(sample[CH["t"]]), tz=timezone.utc).replace(tzinfo=None)
+    trip_id = _LAST_TRIP.get(device_id) or await _resolve_active_trip_id(device_id)
+    snapshot = {
+        "probability": round(prob, 4),
+        "model_version": model_version,
+        "lat": _finite_or_none(sample[CH["lat"]]),
+        "lng": _finite_or_none(sample[CH["lng"]]),
+        "hr": float(sample[CH["hr"]]),
+    }
+
+    async with get_db_context() as db:
+        device = await get_device(db, device_id)
+        alert = await insert_alert(
+            db,
+            device_id=device_id,
+            ts=ts,
+            alert_type=AlertType.crash_server.value,
+            severity=Severity.critical.value,
+            message=f"Server model crash probability {prob:.2f}",
+            user_id=device.user_id if device else None,
+            trip_id=trip_id,
+            payload_json=snapshot,
+        )
+        await db.commit()
+        alert_id = alert.alert_id
+    _STATS["alerts"] += 1
+
+    message = {
+        "type": "alert",
+        "alert_id": alert_id,
+        "device_id": device_id,
+        "trip_id": trip_id,
+        "ts": ts.isoformat(),
+        "alert_type": AlertType.crash_server.value,
+        "severity": Severity.critical.value,
+        "payload": snapshot,
+    }
+    for user_id in await owner_cache.resolve(device_id):
+        await manager.broadcast_to_user(user_id, message)
+
+
+async def reload_model(path: Optional[str] = None) -> str:
+    """
+    Load and warm up a new model in the background, then switch to it between
+    batches. On failure the current model stays live and the error is raised.
+    """
+    if _scorer is None:
+        raise RuntimeError("inference worker not started")
+    async with _RELOAD_LOCK:
+        previous = _scorer.version
+        try:
+            version = await _scorer.reload(path)
+        except Exception as e:
+            _STATS["model_reload_error"] = repr(e)
+            print(f"[inference] model reload failed, keeping {previous}: {e}")
+            raise
+        _STATS["model_reloads"] += 1
+        _STATS["model_reload_error"] = None
+        print(f"[inference] model {previous} -> {version}")
+        return version
+
+
+def _model_stat(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+async def run_model_watcher(path: str = MODEL_PATH) -> None:
+    """
+    Reload when the model file changes. A change must be seen unchanged on two
+    consecutive polls first, so a file still being copied is never loaded.
+    """
+    if MODEL_WATCH_SECONDS <= 0:
+        return
+    loaded = _model_stat(path)
+    pending = None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_SECONDS)
+        current = _model_stat(path)
+        if current is None or current == loaded or _scorer is None:
+            pending = None
+            continue
+        if current != pending:
+            pending = current
+            continue
+        try:
+            await reload_model(path)
+        except Exception:
+            pass
+        # Don't retry a bad file until it changes again
+        loaded, pending = current, None
+
+
+async def stop_inference_worker() -> None:
+    """Release worker processes / shared memory (process mode)."""
+    if _scorer is not None:
+        await _scorer.close()
+
+
+def inference_stats() -> dict:
+    return {
+        **_STATS,
+        "active_devices": len(_WINDOWS.slots),
+        "gate": _GATE.stats(),
+        "model_version": _scorer.version if _scorer else None,
+    }
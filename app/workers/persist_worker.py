@@ -1,48 +1,91 @@
 from __future__ import annotations
 import json
 import asyncio
+import time
 from typing import Any, Dict, Optional
 
 from app.database.connection import get_db_context
 from app.models.schemas import (
     TripStartIn, TripEndIn, TelemetryIn, AlertIn
 )
-from app.repositories.devices_repo import upsert_device, update_last_seen
+from app.repositories.devices_repo import upsert_device, update_last_seen, get_device
 from app.repositories.trips_repo import create_trip, close_trip, get_active_trip_for_device
-from app.repositories.telemetry_repo import insert_trip_data
+from app.repositories.telemetry_repo import bulk_insert_trip_data, insert_trip_data
 from app.repositories.alerts_repo import insert_alert
+from app.repositories.trip_cells_repo import insert_trip_cells
+from app.services.latency import lane_latency
+from app.services.analytics_service import speed_tracker, trip_analytics
+from app.services.compression import COMPRESSION_ENABLED, compressor
+from app.services.geo_index import trip_cells
+from app.services.route_service import route_cache
+from app.services.user_stats import user_stats
 
 
-# Single in-process queue for persistence work
-_QUEUE: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=10_000)
+# Bulk in-process queue for persistence work: (received_at, msg)
+_QUEUE: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=10_000)
+
+# Priority lane: alert rows only. Own queue and own consumer, so they never
+# wait behind routine telemetry (or a full bulk queue). Telemetry, trip_start
+# and trip_end all use the bulk lane, so each device's messages are handled
+# in arrival order.
+_PRIORITY_QUEUE: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=1_000)
 
 # Active trip map (device_id -> trip_id). In-memory; persist later if needed.
 _ACTIVE_TRIP: dict[str, str] = {}
 
 
-async def enqueue_persist(msg: Dict[str, Any]) -> None:
+async def enqueue_persist(
+    msg: Dict[str, Any],
+    priority: bool = False,
+    received_at: Optional[float] = None,
+) -> None:
     """
     Put a validated message onto the persistence queue.
     Call this from your /ws/ingest handler after schema validation.
+    priority=True routes it through the high-priority lane (alerts only:
+    telemetry must stay ordered with its device's trip_start/trip_end).
+    received_at (time.monotonic() at ingest) feeds the per-lane latency stats.
     """
-    await _QUEUE.put(msg)
+    item = (received_at or time.monotonic(), msg)
+    if priority:
+        await _PRIORITY_QUEUE.put(item)
+    else:
+        await _QUEUE.put(item)
 
 
 async def start_persist_worker() -> None:
     """
     Run forever, consuming messages and writing them to the DB.
     Call this once at app startup (create a background task).
+    The priority lane runs as its own task alongside the bulk one.
     """
+    asyncio.create_task(_consume(_PRIORITY_QUEUE, lane_latency["priority_persist"]))
+    await _consume(_QUEUE, lane_latency["bulk_persist"])
+
+
+async def _consume(queue: asyncio.Queue, latency) -> None:
     while True:
-        msg = await _QUEUE.get()
+        received_at, msg = await queue.get()
         try:
             await _handle_message(msg)
+            latency.record(time.monotonic() - received_at)
         except Exception as e:
             # In production, log this with structured logs
             # so a bad message doesn't crash the loop.
             print(f"[persist] error: {e}")
         finally:
-            _QUEUE.task_done()
+            queue.task_done()
+
+
+def persist_stats() -> dict:
+    return {
+        "bulk_queue": _QUEUE.qsize(),
+        "priority_queue": _PRIORITY_QUEUE.qsize(),
+        "trip_summaries": trip_analytics.stats(),
+        "speed": speed_tracker.stats(),
+        "compression": compressor.stats(),
+        "trip_cells": trip_cells.stats(),
+    }
 
 
 # -----------------------
@@ -57,6 +100,8 @@ async def _handle_message(msg: dict) -> None:
         await _handle_telemetry(TelemetryIn(**msg))
     elif mtype == "trip_end":
         await _handle_trip_end(TripEndIn(**msg))
+    elif mtype == "alert":
+        await _handle_alert(AlertIn(**msg))
     else:
         # Unknown message type; ignore or log
         pass
@@ -87,13 +132,16 @@ async def _handle_trip_start(payload: TripStartIn) -> None:
             end_lat = last_loc.lat if last_loc else None
             end_lng = last_loc.lng if last_loc else None
 
+            dangling_summary = trip_analytics.finalize(existing_trip.trip_id)
+            await bulk_insert_trip_data(db, compressor.finish(payload.device_id))
             await close_trip(
                 db=db,
                 trip_id=existing_trip.trip_id,
                 end_time=payload.ts, # Use new trip start time as end time
                 end_lat=end_lat,
                 end_lng=end_lng,
-                crash_detected=None
+                crash_detected=None,
+                summary=dangling_summary,
             )
 
         # Create trip (linked to device owner)
@@ -107,6 +155,15 @@ async def _handle_trip_start(payload: TripStartIn) -> None:
         # Map device -> active trip
         _ACTIVE_TRIP[payload.device_id] = trip.trip_id
         await db.commit()
+    # Running summary from the first sample on
+    trip_analytics.begin(trip.trip_id)
+    speed_tracker.forget(payload.device_id)
+    if existing_trip:
+        trip_cells.forget(existing_trip.trip_id)
+        route_cache.invalidate(existing_trip.trip_id)
+        await _refresh_user_stats(existing_trip.trip_id)
+        if dangling_summary is None:
+            _schedule_recompute(existing_trip.trip_id)
 
 
 async def _resolve_active_trip_id(device_id: str) -> Optional[str]:
@@ -139,20 +196,34 @@ async def _handle_telemetry(payload: TelemetryIn) -> None:
         
         # safe_raw_payload = json.loads(json.dumps(payload.model_dump(), default=str))
 
-        await insert_trip_data(
-            db,
+        # Speed from this device's previous fixes (km/h, None without a fix)
+        speed = speed_tracker.observe(payload.device_id, payload)
+
+        row = dict(
             device_id=payload.device_id,
             timestamp=payload.ts,
             trip_id=trip_id,
             lat=payload.gps.lat,
             lng=payload.gps.lng,
+            speed=round(speed, 2) if speed is not None else None,
             acc_x=payload.imu.ax, acc_y=payload.imu.ay, acc_z=payload.imu.az,
             gyro_x=payload.imu.gx, gyro_y=payload.imu.gy, gyro_z=payload.imu.gz,
             heart_rate=payload.heart_rate.hr,
             crash_flag=payload.crash_flag,
         )
+        if COMPRESSION_ENABLED:
+            # Only the rows needed to rebuild the signals within bounds (often none)
+            await bulk_insert_trip_data(db, compressor.push(row))
+        else:
+            await insert_trip_data(db, **row)
+        # Spatial index: a row only when the trip enters a new grid cell
+        if trip_id and payload.gps.ok and payload.gps.lock:
+            await insert_trip_cells(db, trip_cells.observe(trip_id, payload.gps.lat, payload.gps.lng))
         await db.commit()
 
+    if trip_id:
+        trip_analytics.update(trip_id, payload, speed)
+
 
 async def _handle_trip_end(payload: TripEndIn) -> None:
     """
@@ -165,17 +236,44 @@ async def _handle_trip_end(payload: TripEndIn) -> None:
     if not trip_id:
         return  # Nothing to close
 
+    summary = trip_analytics.finalize(trip_id)
     async with get_db_context() as db:
+        # Last skipped sample, so the stored track ends where the trip did
+        await bulk_insert_trip_data(db, compressor.finish(payload.device_id))
         await close_trip(
             db=db,
             trip_id=trip_id,
             end_time=payload.ts,
             crash_detected=None,
+            summary=summary,
         )
         await db.commit()
 
     # Remove from active map
     _ACTIVE_TRIP.pop(payload.device_id, None)
+    trip_cells.forget(trip_id)
+    route_cache.invalidate(trip_id)
+    speed_tracker.forget(payload.device_id)
+    await _refresh_user_stats(trip_id)
+    if summary is None:
+        _schedule_recompute(trip_id)
+
+
+async def _refresh_user_stats(trip_id: str) -> None:
+    """Rebuild the owner's daily stats bucket for a trip that just closed."""
+    try:
+        await user_stats.on_trips_closed([trip_id])
+    except Exception as e:
+        print(f"[persist] user stats refresh failed for {trip_id}: {e}")
+
+
+def _schedule_recompute(trip_id: str) -> None:
+    """
+    The running summary was partial or missing (the trip spanned a restart):
+    rebuild the trip's stats from stored telemetry in the background.
+    """
+    from app.workers.trip_stats_job import recompute_trip_stats
+    asyncio.create_task(recompute_trip_stats(trip_ids=[trip_id]))
 
 
 async def _handle_alert(payload: AlertIn) -> None:
@@ -185,6 +283,7 @@ async def _handle_alert(payload: AlertIn) -> None:
     async with get_db_context() as db:
         # Attach trip if missing
         trip_id = payload.trip_id or await _resolve_active_trip_id(payload.device_id)
+        device = await get_device(db, payload.device_id)
 
         await insert_alert(
             db,
@@ -193,7 +292,7 @@ async def _handle_alert(payload: AlertIn) -> None:
             alert_type=payload.alert_type.value,
             severity=payload.severity.value,
             message=payload.message,
-            user_id=None,          # fill from auth later
+            user_id=device.user_id if device else None,
             trip_id=trip_id,
             payload_json=payload.payload,
         )
@@ -203,12 +302,12 @@ async def _handle_alert(payload: AlertIn) -> None:
 
 # | Method                               | What it does                                                          | Why we need it                                                                             |
 # | ------------------------------------ | --------------------------------------------------------------------- | ------------------------------------------------------------------------------------------ |
-# | `enqueue_persist(msg)`               | Puts a validated message onto the queue.                              | Decouples WebSocket ingest from DB work; keeps ingest fast and safe.                       |
+# | `enqueue_persist(msg, priority)`     | Puts a validated message onto the bulk or priority queue.             | Decouples WebSocket ingest from DB work; alert writes never wait behind telemetry.         |
 # | `start_persist_worker()`             | Infinite loop that consumes messages from the queue and writes to DB. | Centralized, reliable persistence; isolates failures to one message, not the whole server. |
 # | `_handle_message(msg)`               | Dispatches by `type` to the correct handler.                          | Clean separation of behaviors: start/end trip vs telemetry vs alert.                       |
 # | `_handle_trip_start(payload)`        | Creates a `Trip` row and updates the active trip map.                 | Starts session context; later used to attach telemetry to the right trip.                  |
 # | `_resolve_active_trip_id(device_id)` | Returns current trip ID (from memory, else DB).                       | Ensures telemetry attaches even if `trip_id` isn’t sent every message.                     |
-# | `_handle_telemetry(payload)`         | Upserts device, updates `last_seen_at`, inserts one `TripData` row.   | The core storage path for your time-series data.                                           |
+# | `_handle_telemetry(payload)`         | Upserts device, updates `last_seen_at`, inserts one `TripData` row.   | The core storage path for your time-series data; also feeds the trip's running summary.   |
 # | `_handle_trip_end(payload)`          | Closes the active trip and removes it from the active map.            | Marks the ride as finished; keeps active map consistent.                                   |
 # | `_handle_alert(payload)`             | Inserts an `Alert` row (edge or server ML), attaching trip if known.  | Persists risk/crash events for dashboards and history.                                     |
 
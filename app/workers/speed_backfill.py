@@ -0,0 +1,189 @@
+# app/workers/speed_backfill.py
+"""
+Backfill trip_data.speed for telemetry stored before speeds were derived
+on ingest.
+
+    python -m app.workers.speed_backfill                       # trips with no speeds yet
+    python -m app.workers.speed_backfill --all                 # re-derive every closed trip
+    python -m app.workers.speed_backfill --all --after <id>    # resume a rebuild
+    python -m app.workers.speed_backfill --trip <id> --trip <id>
+
+Each trip's fixes are read once, speeds come from
+analytics_service.derive_speeds (same rules and results as ingest, in a
+thread) and are
+written back in one bulk UPDATE by primary key. One commit per trip keeps
+write locks short while the app is running. Routes of trips not done yet
+derive their speeds when requested, so nothing waits on this.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app.services.analytics_service import derive_speeds
+
+BATCH_TRIPS = 100
+STAGES = ("fetch", "compute", "write")
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def speed_updates(rows: Sequence[tuple]) -> List[dict]:
+    """
+    {"data_id", "speed"} updates for (data_id, device_id, timestamp, lat,
+    lng) rows ordered by device then time; each device's track on its own.
+    """
+    if not rows:
+        return []
+    data_id, device, ts, lat, lng = zip(*rows)
+    device = np.array(device, dtype=object)
+    t = np.fromiter(((x - _EPOCH) / _SECOND for x in ts), dtype=np.float64, count=len(ts))
+    lat = np.array(lat, dtype=np.float64)
+    lng = np.array(lng, dtype=np.float64)
+
+    speed = np.empty(len(t))
+    bounds = [0, *(np.flatnonzero(device[1:] != device[:-1]) + 1).tolist(), len(t)]
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        speed[a:b] = derive_speeds(t[a:b], lat[a:b], lng[a:b])
+    speed = np.round(speed, 2)
+    return [
+        {"data_id": i, "speed": None if v != v else v}
+        for i, v in zip(data_id, speed.tolist())
+    ]
+
+
+class SpeedBackfill:
+    def __init__(self, engine: AsyncEngine, batch_size: int = BATCH_TRIPS):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.timings: Dict[str, float] = {s: 0.0 for s in STAGES}
+        self.trips = 0
+        self.rows = 0
+        self.errors = 0
+        self.wall_s = 0.0
+        self.resume_after: Optional[str] = None
+
+    async def _process(self, trip_id: str) -> None:
+        from app.repositories.telemetry_repo import bulk_update_speeds, get_trip_fix_rows
+        from app.services.route_service import route_cache
+
+        async with AsyncSession(self.engine) as db:
+            started = time.perf_counter()
+            rows = await get_trip_fix_rows(db, trip_id)
+            self.timings["fetch"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            updates = await asyncio.to_thread(speed_updates, rows)
+            self.timings["compute"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            await bulk_update_speeds(db, updates)
+            await db.commit()
+            self.timings["write"] += time.perf_counter() - started
+        route_cache.invalidate(trip_id)
+        self.trips += 1
+        self.rows += len(updates)
+
+    async def run(
+        self,
+        trip_ids: Optional[Sequence[str]] = None,
+        missing_only: bool = True,
+        after: Optional[str] = None,
+    ) -> "SpeedBackfill":
+        from app.repositories.trips_repo import list_trips_missing_speed
+
+        started = time.perf_counter()
+        explicit = list(trip_ids or ())
+        while True:
+            if trip_ids:
+                page, explicit = explicit[:self.batch_size], explicit[self.batch_size:]
+            else:
+                async with AsyncSession(self.engine) as db:
+                    page = await list_trips_missing_speed(db, after, self.batch_size, missing_only)
+            if not page:
+                break
+            after = page[-1]
+            for trip_id in page:
+                try:
+                    await self._process(trip_id)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[speed] trip {trip_id} failed: {e}")
+                    continue
+                self.resume_after = trip_id
+        self.wall_s = time.perf_counter() - started
+        return self
+
+    def report(self) -> dict:
+        wall_s = self.wall_s
+        return {
+            "trips": self.trips,
+            "rows": self.rows,
+            "errors": self.errors,
+            "wall_s": round(wall_s, 3),
+            "rows_per_s": round(self.rows / wall_s) if wall_s else 0,
+            "stages_ms": {s: round(v * 1000.0, 1) for s, v in self.timings.items()},
+            "resume_after": self.resume_after,
+        }
+
+
+async def backfill_speeds(
+    url: Optional[str] = None,
+    trip_ids: Optional[Sequence[str]] = None,
+    missing_only: bool = True,
+    after: Optional[str] = None,
+    batch_size: int = BATCH_TRIPS,
+) -> SpeedBackfill:
+    """Run the backfill against `url` (default: the app engine), migrating the schema first."""
+    from app.database.connection import _create_engine, engine as app_engine
+    from app.database.migrations import run_migrations
+    from app.models.db_models import Base
+
+    engine = _create_engine(url) if url else app_engine
+    job = SpeedBackfill(engine, batch_size=batch_size)
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(run_migrations)
+        await job.run(trip_ids=trip_ids, missing_only=missing_only, after=after)
+    finally:
+        if url:
+            await engine.dispose()
+    return job
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive trip_data.speed for stored telemetry")
+    parser.add_argument("--db", help="SQLAlchemy async URL (default: DATABASE_URL or helmet.db)")
+    parser.add_argument("--trip", action="append", dest="trips", help="Trip id (repeatable)")
+    parser.add_argument("--all", action="store_true", help="Re-derive every closed trip, not only missing ones")
+    parser.add_argument("--after", help="Resume: only trips with a greater trip_id")
+    parser.add_argument("--batch", type=int, default=BATCH_TRIPS, help="Trip ids per listing page")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    job = asyncio.run(backfill_speeds(
+        url=args.db,
+        trip_ids=args.trips,
+        missing_only=not args.all,
+        after=args.after,
+        batch_size=args.batch,
+    ))
+    report = job.report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"trips      {report['trips']:,} ({report['rows']:,} rows, {report['errors']} failed)")
+        print(f"throughput {report['rows_per_s']:,} rows/s ({report['wall_s']:.2f} s wall)")
+        for stage, ms in report["stages_ms"].items():
+            print(f"  {stage:<8}{ms:>10.1f} ms")
+        if report["resume_after"] and args.all:
+            print(f"resume with --after {report['resume_after']}")
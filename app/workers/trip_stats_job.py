@@ -0,0 +1,288 @@
+# app/workers/trip_stats_job.py
+"""
+Bulk recompute of trip summary columns from stored telemetry.
+
+    python -m app.workers.trip_stats_job                       # closed trips with no stats
+    python -m app.workers.trip_stats_job --all                 # rebuild every closed trip
+    python -m app.workers.trip_stats_job --all --after <id>    # resume a rebuild
+    python -m app.workers.trip_stats_job --trip <id> --trip <id>
+
+Trips are taken in pages of --batch, up to --concurrency pages in flight.
+Each page streams its telemetry as NumPy columns, is summarized with
+analytics_service.summarize_samples (in a thread, so the next fetch
+overlaps it) and written back in one bulk UPDATE, together with the trips'
+spatial index cells and their owners' daily stats buckets, in one commit.
+
+Progress lives in the DB: a default run only selects trips still missing
+stats, so rerunning after an interruption carries on where it stopped. An
+--all rebuild prints the trip id to pass to --after.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app.services.analytics_service import summarize_samples
+from app.services.geo_index import trip_cell_rows
+from app.services.user_stats import local_day, user_stats
+
+# Trips per page (one telemetry fetch + one UPDATE each)
+BATCH_TRIPS = int(os.getenv("TRIP_STATS_BATCH", "100"))
+# Pages in flight at once
+CONCURRENCY = int(os.getenv("TRIP_STATS_CONCURRENCY", "4"))
+# Fill missing trip stats once in the background when the app starts
+RECOMPUTE_ON_STARTUP = os.getenv("TRIP_STATS_RECOMPUTE_ON_STARTUP", "1") == "1"
+
+STATS_COLUMNS = ("trip_id", "timestamp", "lat", "lng", "heart_rate", "crash_flag")
+STAGES = ("fetch", "compute", "write")
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def _to_arrays(rows: Sequence[tuple]):
+    """DB tuples (STATS_COLUMNS order) -> trip ids + float columns (NULL -> NaN)."""
+    cols = list(zip(*rows))
+    trip = np.array(cols[0], dtype=object)
+    t = np.fromiter(((ts - _EPOCH) / _SECOND for ts in cols[1]), dtype=np.float64, count=len(rows))
+    lat = np.array(cols[2], dtype=np.float64)
+    lng = np.array(cols[3], dtype=np.float64)
+    hr = np.array(cols[4], dtype=np.float64)
+    crash = np.array(cols[5], dtype=bool)
+    return trip, t, lat, lng, hr, crash
+
+
+def _summarize_page(trip_ids: Sequence[str], parts: List[tuple]) -> Tuple[List[dict], List[dict]]:
+    """
+    One UPDATE row per trip of the page (trips without telemetry get zeros),
+    plus the trips' spatial index (trip_cells) rows.
+    """
+    found: Dict[str, dict] = {}
+    cells: List[dict] = []
+    if parts:
+        trip, t, lat, lng, hr, crash = (np.concatenate(c) for c in zip(*parts))
+        change = np.flatnonzero(trip[1:] != trip[:-1]) + 1
+        bounds = [0, *change.tolist(), len(trip)]
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            found[trip[a]] = summarize_samples(t[a:b], lat[a:b], lng[a:b], hr[a:b], crash[a:b])
+            cells.extend(trip_cell_rows(trip[a], lat[a:b], lng[a:b]))
+
+    empty = np.zeros(0)
+    now = datetime.utcnow()
+    rows = []
+    for trip_id in trip_ids:
+        summary = found.get(trip_id)
+        if summary is None:
+            summary = summarize_samples(empty, empty, empty, empty, np.zeros(0, dtype=bool))
+        rows.append({
+            "trip_id": trip_id,
+            **summary,
+            "crash_detected": summary["crash_count"] > 0,
+            "updated_at": now,
+        })
+    return rows, cells
+
+
+class TripStatsJob:
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        batch_size: int = BATCH_TRIPS,
+        concurrency: int = CONCURRENCY,
+        chunk_size: int = 20_000,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        # SQLite can't commit while another connection is mid-read, and its
+        # reads don't run in parallel anyway: one page at a time there
+        self.concurrency = 1 if engine.dialect.name == "sqlite" else max(1, concurrency)
+        self.chunk_size = chunk_size
+
+        self.timings: Dict[str, float] = {s: 0.0 for s in STAGES}
+        self.trips = 0
+        self.rows = 0
+        self.pages = 0
+        self.errors = 0
+        self.wall_s = 0.0
+        # Last trip id of the longest run of finished pages (for --after)
+        self.resume_after: Optional[str] = None
+        self._order: List[list] = []   # [last_trip_id, done] per page, in page order
+
+    async def _process(self, trip_ids: Sequence[str]) -> None:
+        from app.repositories.telemetry_repo import stream_trip_samples
+        from app.repositories.trips_repo import bulk_update_trip_stats
+        from app.repositories.trip_cells_repo import insert_trip_cells
+        from app.repositories.user_stats_repo import trip_starts
+
+        started = time.perf_counter()
+        parts = []
+        async with AsyncSession(self.engine) as db:
+            async for rows in stream_trip_samples(db, trip_ids, self.chunk_size, STATS_COLUMNS):
+                parts.append(_to_arrays(rows))
+                self.rows += len(rows)
+        self.timings["fetch"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        updates, cells = await asyncio.to_thread(_summarize_page, trip_ids, parts)
+        self.timings["compute"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        async with AsyncSession(self.engine) as db:
+            await bulk_update_trip_stats(db, updates)
+            await insert_trip_cells(db, cells)
+            # Owners' daily buckets follow the new trip stats, same transaction
+            starts = await trip_starts(db, trip_ids)
+            buckets = {(user_id, local_day(ts)) for user_id, ts in starts if ts is not None}
+            if buckets:
+                await user_stats.refresh_buckets(db, buckets)
+            await db.commit()
+        self.timings["write"] += time.perf_counter() - started
+        self.trips += len(updates)
+
+    async def _page(self, trip_ids: Sequence[str], slot: list, sem: asyncio.Semaphore) -> None:
+        try:
+            await self._process(trip_ids)
+            slot[1] = True
+        except Exception as e:
+            # Its trips keep null stats, so the next default run retries them
+            self.errors += 1
+            print(f"[trip-stats] page after {trip_ids[0]} failed: {e}")
+        finally:
+            sem.release()
+        while self._order and self._order[0][1]:
+            self.resume_after = self._order.pop(0)[0]
+
+    async def run(
+        self,
+        trip_ids: Optional[Sequence[str]] = None,
+        missing_only: bool = True,
+        after: Optional[str] = None,
+    ) -> "TripStatsJob":
+        from app.repositories.trips_repo import list_trips_for_recompute
+
+        sem = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        explicit = list(trip_ids or ())
+        started = time.perf_counter()
+        while True:
+            if trip_ids:
+                page, explicit = explicit[:self.batch_size], explicit[self.batch_size:]
+            else:
+                async with AsyncSession(self.engine) as db:
+                    page = await list_trips_for_recompute(db, after, self.batch_size, missing_only)
+            if not page:
+                break
+            after = page[-1]
+            await sem.acquire()
+            slot = [page[-1], False]
+            self._order.append(slot)
+            self.pages += 1
+            tasks.append(asyncio.create_task(self._page(page, slot, sem)))
+        await asyncio.gather(*tasks)
+        self.wall_s = time.perf_counter() - started
+        return self
+
+    def report(self) -> dict:
+        wall_s = self.wall_s
+        return {
+            "trips": self.trips,
+            "rows": self.rows,
+            "pages": self.pages,
+            "errors": self.errors,
+            "wall_s": round(wall_s, 3),
+            "trips_per_s": round(self.trips / wall_s, 1) if wall_s else 0,
+            "rows_per_s": round(self.rows / wall_s) if wall_s else 0,
+            "stages_ms": {s: round(v * 1000.0, 1) for s, v in self.timings.items()},
+            "resume_after": self.resume_after,
+        }
+
+
+async def recompute_trip_stats(
+    url: Optional[str] = None,
+    trip_ids: Optional[Sequence[str]] = None,
+    missing_only: bool = True,
+    after: Optional[str] = None,
+    batch_size: int = BATCH_TRIPS,
+    concurrency: int = CONCURRENCY,
+    chunk_size: int = 20_000,
+    prepare_schema: bool = False,
+) -> TripStatsJob:
+    """
+    Run the job against `url` (default: the app engine); returns it for
+    report(). prepare_schema: create/migrate tables first, as app startup
+    does (the CLI may run against a database the app hasn't opened yet).
+    """
+    from app.database.connection import _create_engine, engine as app_engine
+
+    engine = _create_engine(url) if url else app_engine
+    job = TripStatsJob(engine, batch_size=batch_size, concurrency=concurrency, chunk_size=chunk_size)
+    try:
+        if prepare_schema:
+            from app.database.migrations import run_migrations
+            from app.models.db_models import Base
+
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(run_migrations)
+        await job.run(trip_ids=trip_ids, missing_only=missing_only, after=after)
+    finally:
+        if url:
+            await engine.dispose()
+    return job
+
+
+async def run_startup_recompute() -> None:
+    """Background pass at startup: trips left without stats (legacy, restarts)."""
+    if not RECOMPUTE_ON_STARTUP:
+        return
+    try:
+        job = await recompute_trip_stats()
+    except Exception as e:
+        print(f"[trip-stats] startup recompute failed: {e}")
+        return
+    if job.trips:
+        print(f"[trip-stats] filled stats for {job.trips} trip(s) in {job.wall_s:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute trip summary statistics from telemetry")
+    parser.add_argument("--db", help="SQLAlchemy async URL (default: DATABASE_URL or helmet.db)")
+    parser.add_argument("--trip", action="append", dest="trips", help="Trip id (repeatable)")
+    parser.add_argument("--all", action="store_true", help="Recompute every closed trip, not only missing ones")
+    parser.add_argument("--after", help="Resume: only trips with a greater trip_id")
+    parser.add_argument("--batch", type=int, default=BATCH_TRIPS, help="Trips per page")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Pages in flight")
+    parser.add_argument("--chunk", type=int, default=20_000, help="Telemetry rows per fetch")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    job = asyncio.run(recompute_trip_stats(
+        url=args.db,
+        trip_ids=args.trips,
+        missing_only=not args.all,
+        after=args.after,
+        batch_size=args.batch,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk,
+        prepare_schema=True,
+    ))
+    report = job.report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"trips      {report['trips']:,} ({report['rows']:,} rows, {report['pages']} page(s), "
+              f"{report['errors']} failed)")
+        print(f"throughput {report['trips_per_s']:,} trips/s, {report['rows_per_s']:,} rows/s "
+              f"({report['wall_s']:.2f} s wall)")
+        for stage, ms in report["stages_ms"].items():
+            print(f"  {stage:<8}{ms:>10.1f} ms")
+        if report["resume_after"] and args.all:
+            print(f"resume with --after {report['resume_after']}")
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.models.schemas import TelemetryIn
+from app.services import analytics_service
+from app.services.analytics_service import (
+    SpeedTracker,
+    TripAccumulator,
+    TripAnalytics,
+    derive_speeds,
+    summarize_samples,
+)
+from app.services.broadcaster import to_epoch
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def _telemetry(ts, lat, lng, gps_ok=True, hr=80, crash_flag=False):
+    return TelemetryIn.model_validate({
+        "ts": ts,
+        "type": "telemetry",
+        "device_id": "analytics-test",
+        "trip_id": "T",
+        "helmet_on": True,
+        "heart_rate": {"ok": True, "ir": 1, "red": 1, "finger": True, "hr": hr, "spo2": 97},
+        "imu": {"ok": True, "sleep": False, "ax": 0, "ay": 0, "az": 9.8, "gx": 0, "gy": 0, "gz": 0},
+        "gps": {"ok": gps_ok, "lat": lat, "lng": lng, "alt": 0, "sats": 8, "lock": gps_ok},
+        "crash_flag": crash_flag,
+    })
+
+
+def _track(n=3000, seed=7, noise=1e-5, glitches=20, relocate=True):
+    """5 Hz ride with parked stretches, lost fixes, bad jumps and clock repeats."""
+    rng = np.random.default_rng(seed)
+    ts = [START + timedelta(seconds=0.2 * i) for i in range(n)]
+    for i in rng.choice(np.arange(1, n), 40, replace=False):
+        ts[i] = ts[i - 1]
+    moving = (np.arange(n) // 400) % 3 != 2            # every third stretch parked
+    step = np.where(moving, 4e-5, 0.0)
+    lat = 33.85 + np.cumsum(step) + rng.normal(0, noise, n)
+    lng = 35.86 + np.cumsum(step * 0.5) + rng.normal(0, noise, n)
+    hr = rng.integers(70, 110, n).astype(float)
+    hr[rng.random(n) < 0.05] = 0
+    lost = rng.random(n) < 0.03
+    lat[lost] = lng[lost] = 0.0
+    for i in rng.choice(n, glitches, replace=False):
+        lat[i] += 0.05
+    if relocate:
+        # More implausible fixes in a row than MAX_REJECTS: GPS reacquired elsewhere
+        lat[2000:] += 0.2
+    crash = np.zeros(n, dtype=bool)
+    crash[[500, 501, 503, 1500]] = True
+    return ts, lat, lng, hr, crash
+
+
+def _live(ts, lat, lng, hr, crash):
+    acc = TripAccumulator(complete=True)
+    tracker = SpeedTracker()
+    speeds = []
+    for i, stamp in enumerate(ts):
+        no_fix = lat[i] == 0 and lng[i] == 0
+        obj = _telemetry(stamp, lat[i], lng[i], gps_ok=not no_fix, hr=int(hr[i]), crash_flag=bool(crash[i]))
+        speed = tracker.observe(obj.device_id, obj)
+        speeds.append(np.nan if speed is None else speed)
+        acc.add(obj, speed)
+    return acc.summary(), np.array(speeds)
+
+
+TRACKS = [
+    dict(noise=0.0, glitches=0, relocate=False),
+    dict(),
+    dict(seed=3, noise=3e-5, glitches=60),
+]
+
+
+@pytest.mark.parametrize("track", TRACKS)
+def test_summarize_samples_matches_live_accumulator(track):
+    ts, lat, lng, hr, crash = _track(**track)
+    live, _ = _live(ts, lat, lng, hr, crash)
+    t = np.array([to_epoch(x) for x in ts])
+    offline = summarize_samples(t, lat, lng, hr, crash)
+    assert offline == live
+    assert live["crash_count"] == 2
+    assert live["total_distance"] > 0 and live["max_speed"] > 0
+
+
+@pytest.mark.parametrize("track", TRACKS)
+def test_derive_speeds_matches_speed_tracker(track):
+    ts, lat, lng, hr, crash = _track(**track)
+    _, live = _live(ts, lat, lng, hr, crash)
+    t = np.array([to_epoch(x) for x in ts])
+    offline = derive_speeds(t, lat, lng)
+    np.testing.assert_array_equal(np.isnan(offline), np.isnan(live))
+    np.testing.assert_allclose(offline, live, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_idle_trips_are_evicted():
+    trips = TripAnalytics()
+    trips.begin("old")
+    trips.begin("new")
+    trips.update("new", _telemetry(START, 33.85, 35.86))
+    trips.trips["old"].last_seen -= analytics_service.IDLE_EVICT_SECONDS + 1
+    assert trips.evict_idle() == 1
+    assert list(trips.trips) == ["new"]
+    # Telemetry after eviction gets a partial accumulator; closing then recomputes
+    trips.update("old", _telemetry(START, 33.85, 35.86))
+    assert trips.finalize("old") is None
+    assert trips.stats()["evicted"] == 1
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.schemas import TelemetryIn
+from app.services.broadcaster import StreamBuffer, parse_since, to_epoch
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def telemetry(t=0.0, device_id="helmet-1", lat=33.85, lng=35.86, hr=80, crash_flag=False, trip_id=None):
+    """A valid telemetry sample `t` seconds after START."""
+    return TelemetryIn.model_validate({
+        "ts": START + timedelta(seconds=t),
+        "type": "telemetry",
+        "device_id": device_id,
+        "helmet_on": True,
+        "heart_rate": {"ok": True, "ir": 1, "red": 1, "finger": True, "hr": hr, "spo2": 97},
+        "imu": {"ok": True, "sleep": False, "ax": 0.1, "ay": 0.1, "az": 9.8, "gx": 1, "gy": 1, "gz": 1},
+        "gps": {"ok": True, "lat": lat, "lng": lng, "alt": 0, "sats": 8, "lock": True},
+        "crash_flag": crash_flag,
+        "trip_id": trip_id,
+    })
+
+
+def _buffer(capacity=10, window_s=60.0):
+    buf = StreamBuffer(capacity=capacity, window_s=window_s)
+    for i in range(6):
+        buf.append(telemetry(t=i, device_id="a" if i % 2 == 0 else "b", trip_id="T"))
+    return buf
+
+
+def test_frames_since_seq_merges_devices_in_order():
+    buf = _buffer()
+    frames = buf.frames_since(["a", "b"], since_seq=2)
+    assert [f["seq"] for f in frames] == [3, 4, 5, 6]
+    assert [f["device_id"] for f in frames] == ["a", "b", "a", "b"]
+
+
+def test_frames_since_only_requested_devices():
+    buf = _buffer()
+    assert [f["seq"] for f in buf.frames_since(["b"])] == [2, 4, 6]
+    assert buf.frames_since(["unknown"]) == []
+
+
+def test_frames_since_ts():
+    buf = _buffer()
+    since = to_epoch(START + timedelta(seconds=3))
+    assert [f["seq"] for f in buf.frames_since(["a", "b"], since_ts=since)] == [5, 6]
+
+
+def test_frame_rebuilt_exactly():
+    buf = StreamBuffer()
+    obj = telemetry(t=1.5, lat=33.123456, lng=35.654321, hr=91, crash_flag=True, trip_id="T")
+    buf.append(obj)
+    frame = buf.frames_since([obj.device_id])[0]
+    assert frame["gps"] == obj.gps.model_dump()
+    assert frame["heart_rate"] == obj.heart_rate.model_dump()
+    assert frame["imu"] == obj.imu.model_dump()
+    assert frame["crash_flag"] is True and frame["trip_id"] == "T"
+
+
+def test_ring_and_window_bound_the_replay():
+    buf = StreamBuffer(capacity=3, window_s=60.0)
+    for i in range(5):
+        buf.append(telemetry(t=i))
+    assert [f["seq"] for f in buf.frames_since(["helmet-1"])] == [3, 4, 5]
+
+    buf = StreamBuffer(capacity=10, window_s=2.0)
+    for i in range(5):
+        buf.append(telemetry(t=i))
+    # Window measured on the device clock: newest ts 4 s, floor 2 s (exclusive)
+    assert [f["seq"] for f in buf.frames_since(["helmet-1"])] == [4, 5]
+
+
+@pytest.mark.parametrize("value,expected", [
+    (None, (None, None)),
+    ("", (None, None)),
+    ("42", (42, None)),
+    ("s:42", (42, None)),
+    ("t:42", (None, 42.0)),
+    ("1735732800", (None, 1735732800.0)),
+    ("s:1735732800", (1735732800, None)),
+    ("1735732800.5", (None, 1735732800.5)),
+    ("2025-01-01T12:00:00+00:00", (None, 1735732800.0)),
+    ("t:2025-01-01T12:00:00", (None, 1735732800.0)),
+])
+def test_parse_since(value, expected):
+    assert parse_since(value, last_seq=100) == expected
+
+
+def test_parse_since_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_since("yesterday", last_seq=100)
+    with pytest.raises(ValueError):
+        parse_since("s:12.5", last_seq=100)
+
+
+def test_boot_ids_differ_between_buffers():
+    assert StreamBuffer().boot_id != StreamBuffer().boot_id
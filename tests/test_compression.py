@@ -0,0 +1,158 @@
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.services import compression as C
+
+T0 = datetime(2026, 5, 1)
+M_PER_DEG = 111_194.9
+
+
+def _ride(n: int = 3000, seed: int = 1):
+    """5 Hz ride: GPS noise, a stop, a rough patch, a no-fix stretch and one crash."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) * 0.2
+    speed = np.clip(10 + 6 * np.sin(t / 60), 0, 25)
+    speed[1500:1700] = 0
+    head = np.cumsum(rng.normal(0, 0.02, n))
+    x = np.cumsum(speed * np.cos(head) * 0.2)
+    y = np.cumsum(speed * np.sin(head) * 0.2)
+    m_lng = M_PER_DEG * math.cos(math.radians(33.85))
+    lat = 33.85 + (y + rng.normal(0, 1.5, n)) / M_PER_DEG
+    lng = 35.5 + (x + rng.normal(0, 1.5, n)) / m_lng
+    hr = np.round(90 + 15 * np.sin(t / 300) + rng.normal(0, 0.7, n))
+    acc = rng.normal(0, 0.25, (3, n))
+    acc[2] += 9.8
+    rough = (t > 200) & (t < 230)
+    acc[0, rough] += rng.normal(0, 3, rough.sum())
+    gyro = rng.normal(0, 2, (3, n))
+    crash = np.zeros(n, dtype=bool)
+    crash[2500] = True
+    acc[0, 2495:2505] += 40
+    no_fix = (t > 100) & (t < 110)
+    rows = []
+    for i in range(n):
+        la, ln = (0.0, 0.0) if no_fix[i] else (float(lat[i]), float(lng[i]))
+        rows.append({
+            "device_id": "d", "trip_id": "T", "timestamp": T0 + timedelta(seconds=float(t[i])),
+            "lat": la, "lng": ln, "speed": float(speed[i] * 3.6), "heart_rate": float(hr[i]),
+            "acc_x": float(acc[0, i]), "acc_y": float(acc[1, i]), "acc_z": float(acc[2, i]),
+            "gyro_x": float(gyro[0, i]), "gyro_y": float(gyro[1, i]), "gyro_z": float(gyro[2, i]),
+            "crash_flag": bool(crash[i]),
+        })
+    return t, lat, lng, m_lng, no_fix, rows
+
+
+def _compress(rows):
+    comp = C.TelemetryCompressor()
+    stored = []
+    for row in rows:
+        stored += comp.push(row)
+    stored += comp.finish("d")
+    stored.sort(key=lambda r: r["timestamp"])
+    return comp, stored
+
+
+@pytest.fixture(scope="module")
+def ride():
+    t, lat, lng, m_lng, no_fix, rows = _ride()
+    comp, stored = _compress(rows)
+    out = C.resample([tuple(r[c] for c in C.RESAMPLE_COLUMNS) for r in stored], 5.0)
+    return t, lat, lng, m_lng, no_fix, rows, comp, stored, out
+
+
+def _col(out, name):
+    return np.array([np.nan if v is None else v for v in out[name]])
+
+
+def test_compresses(ride):
+    *_, comp, stored, out = ride
+    assert comp.stats()["ratio"] > 2
+    assert out["points"] == len(ride[0])
+
+
+def test_gps_within_tolerance(ride):
+    t, lat, lng, m_lng, no_fix, *_, out = ride
+    fix = ~no_fix
+    # resample rounds to 6 decimals (~0.1 m)
+    err_y = np.abs(_col(out, "lat") - lat)[fix] * M_PER_DEG
+    err_x = np.abs(_col(out, "lng") - lng)[fix] * m_lng
+    assert err_y.max() <= C.GPS_TOLERANCE_M + 0.2
+    assert err_x.max() <= C.GPS_TOLERANCE_M + 0.2
+    assert np.isnan(_col(out, "lat")[no_fix]).all()
+
+
+def test_held_channels_within_deadband(ride):
+    *_, rows, comp, stored, out = ride
+    for name, band in (("heart_rate", C.HR_DEADBAND), ("acc_x", C.ACC_DEADBAND),
+                       ("acc_z", C.ACC_DEADBAND), ("gyro_y", C.GYRO_DEADBAND)):
+        truth = np.array([r[name] for r in rows])
+        assert np.abs(_col(out, name) - truth).max() <= band + 1e-3, name
+
+
+def test_crash_window_stored_at_full_rate(ride):
+    t, *_, rows, comp, stored, out = ride
+    kept = {r["timestamp"] for r in stored}
+    window = [r for r, ti in zip(rows, t) if abs(ti - t[2500]) <= C.CRASH_KEEP_S]
+    assert all(r["timestamp"] in kept for r in window)
+    assert np.flatnonzero(out["crash_flag"]).tolist() == [2500]
+
+
+def test_repeated_timestamp_is_stored():
+    rows = _ride()[-1][:50]
+    rows.insert(20, dict(rows[19]))
+    comp, stored = _compress(rows)
+    assert comp.reasons.get("clock") == 1
+
+
+def test_resample_interpolates_and_holds():
+    rows = [
+        (T0, 33.0, 35.0, 10.0, 80.0, 0, 0, 9.8, 0, 0, 0, False),
+        (T0 + timedelta(seconds=1), 33.001, 35.0, 20.0, 90.0, 1, 0, 9.8, 0, 0, 0, True),
+    ]
+    out = C.resample(rows, 2.0)
+    assert out["points"] == 3
+    assert out["t"] == [0.0, 0.5, 1.0]
+    assert out["lat"] == [33.0, 33.0005, 33.001]
+    assert out["speed"] == [10.0, 15.0, 20.0]
+    assert out["heart_rate"] == [80.0, 80.0, 90.0]
+    assert out["crash_flag"] == [False, False, True]
+
+
+def test_resample_caps_points():
+    rows = [
+        (T0, 33.0, 35.0, None, 80.0, 0, 0, 9.8, 0, 0, 0, False),
+        (T0 + timedelta(days=2), 33.0, 35.0, None, 80.0, 0, 0, 9.8, 0, 0, 0, False),
+    ]
+    with pytest.raises(ValueError):
+        C.resample(rows, 5.0)
+    assert C.resample([], 5.0)["points"] == 0
+
+
+def test_each_sample_is_stored_at_most_once():
+    rows = _ride()[-1]
+    comp = C.TelemetryCompressor()
+    emitted = []
+    for row in rows:
+        out = [r["timestamp"] for r in comp.push(row)]
+        # A crash reaches back for held samples; one push still comes out in order
+        assert out == sorted(out)
+        emitted += out
+    emitted += [r["timestamp"] for r in comp.finish("d")]
+    assert len(set(emitted)) == len(emitted) == comp.stored
+    assert comp.reasons.get("crash_window", 0) > 0
+
+
+def test_new_trip_flushes_the_last_skipped_sample():
+    rows = _ride()[-1][:40]
+    comp = C.TelemetryCompressor()
+    for row in rows:
+        comp.push(row)
+    last_skipped = comp.states["d"].last
+    nxt = dict(rows[-1], trip_id="T2", timestamp=rows[-1]["timestamp"] + timedelta(seconds=1))
+    out = comp.push(nxt)
+    if last_skipped is not None:
+        assert out[0] is last_skipped[1] and comp.reasons["end"] == 1
+    assert out[-1] is nxt and comp.states["d"].trip_id == "T2"
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.services.connection_manager import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, stall: bool = False):
+        self.sent = []
+        self.closed = None
+        self.stall = stall
+
+    async def send_text(self, text: str) -> None:
+        if self.stall:
+            await asyncio.sleep(3600)
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.closed = code
+
+
+def _frame(device_id="helmet-1", **extra):
+    msg = {
+        "type": "telemetry", "device_id": device_id, "ts": "2025-01-01T12:00:00",
+        "trip_id": "T", "helmet_on": True, "crash_flag": False,
+        "gps": {"lat": 33.85}, "imu": {"ax": 0.1}, "heart_rate": {"hr": 80},
+    }
+    msg.update(extra)
+    return msg
+
+
+@pytest.fixture
+def run():
+    """Run coroutines on one loop per test, so socket writers survive between steps."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.wait(tasks))
+    loop.close()
+
+
+@pytest.fixture
+def manager():
+    m = ConnectionManager()
+    # Frames in a test are microseconds apart; only max_rate should throttle them
+    m.THROTTLE_INTERVAL = 1e-9
+    return m
+
+
+async def _flush(manager):
+    for outbox in list(manager.outboxes.values()):
+        await outbox.join()
+
+
+def _send(run, manager, data, user_id="u1"):
+    async def go():
+        await manager.broadcast_to_user(user_id, data)
+        await _flush(manager)
+    run(go())
+
+
+def _attach(manager, user_id="u1", **kw):
+    ws = FakeSocket(**kw)
+    manager.attach(ws, user_id)
+    return ws
+
+
+def test_socket_without_subscription_gets_everything(run, manager):
+    ws = _attach(manager)
+    _send(run, manager, _frame())
+    _send(run, manager, _frame(device_id="helmet-2"))
+    assert [m["device_id"] for m in ws.sent] == ["helmet-1", "helmet-2"]
+
+
+def test_subscribe_filters_devices_and_fields(run, manager):
+    ws = _attach(manager)
+    ack = manager.handle_control(ws, {"action": "subscribe", "device_ids": ["helmet-2"], "fields": ["gps"]})
+    assert ack["type"] == "subscribed" and ack["fields"] == ["gps"]
+    _send(run, manager, _frame())
+    _send(run, manager, _frame(device_id="helmet-2"))
+    assert len(ws.sent) == 1
+    assert "gps" in ws.sent[0] and "imu" not in ws.sent[0] and "heart_rate" not in ws.sent[0]
+
+
+def test_unsubscribing_the_last_id_sends_nothing(run, manager):
+    ws = _attach(manager)
+    manager.handle_control(ws, {"action": "subscribe", "id": "a"})
+    manager.handle_control(ws, {"action": "subscribe", "id": "b", "device_ids": ["helmet-2"]})
+    manager.handle_control(ws, {"action": "unsubscribe", "id": "a"})
+    _send(run, manager, _frame())
+    assert ws.sent == []
+    assert manager.handle_control(ws, {"action": "unsubscribe", "id": "b"}) == {"type": "unsubscribed", "id": "b"}
+    _send(run, manager, _frame(device_id="helmet-2"))
+    _send(run, manager, {"type": "alert", "device_id": "helmet-2"})
+    assert ws.sent == []
+
+
+def test_reset_goes_back_to_everything(run, manager):
+    ws = _attach(manager)
+    manager.handle_control(ws, {"action": "subscribe"})
+    manager.handle_control(ws, {"action": "unsubscribe"})
+    assert manager.handle_control(ws, {"action": "reset"}) == {"type": "reset"}
+    _send(run, manager, _frame())
+    assert len(ws.sent) == 1 and "imu" in ws.sent[0]
+
+
+def test_alerts_need_the_alerts_field(run, manager):
+    ws = _attach(manager)
+    manager.handle_control(ws, {"action": "subscribe", "id": "gps", "fields": ["gps"]})
+    _send(run, manager, {"type": "alert", "device_id": "helmet-1"})
+    assert ws.sent == []
+    manager.handle_control(ws, {"action": "subscribe", "id": "alerts", "fields": ["alerts"]})
+    _send(run, manager, {"type": "alert", "device_id": "helmet-1"})
+    assert [m["type"] for m in ws.sent] == ["alert"]
+
+
+def test_alerts_only_subscription_skips_routine_telemetry(run, manager):
+    ws = _attach(manager)
+    manager.handle_control(ws, {"action": "subscribe", "fields": ["alerts"]})
+    _send(run, manager, _frame())
+    assert ws.sent == []
+    _send(run, manager, _frame(crash_flag=True))
+    assert len(ws.sent) == 1 and ws.sent[0]["crash_flag"] is True
+    assert "gps" not in ws.sent[0] and "imu" not in ws.sent[0]
+
+
+def test_rate_limit_is_per_device_and_priority_bypasses_it(run, manager):
+    ws = _attach(manager)
+    manager.handle_control(ws, {"action": "subscribe", "max_rate": 0.001})
+    _send(run, manager, _frame())
+    _send(run, manager, _frame())                        # throttled
+    _send(run, manager, _frame(device_id="helmet-2"))    # own budget
+    _send(run, manager, _frame(crash_flag=True))         # priority
+    assert [(m["device_id"], m["crash_flag"]) for m in ws.sent] == [
+        ("helmet-1", False), ("helmet-2", False), ("helmet-1", True),
+    ]
+
+
+def test_subscription_cap(manager):
+    ws = _attach(manager)
+    for i in range(manager.MAX_SUBSCRIPTIONS_PER_SOCKET):
+        manager.handle_control(ws, {"action": "subscribe", "id": str(i)})
+    with pytest.raises(ValueError):
+        manager.handle_control(ws, {"action": "subscribe", "id": "one-more"})
+    # Replacing an existing id is not a new subscription
+    manager.handle_control(ws, {"action": "subscribe", "id": "0", "fields": ["hr"]})
+
+
+def test_disconnect_drops_subscriptions(manager):
+    ws = _attach(manager)
+    manager.handle_control(ws, {"action": "subscribe"})
+    manager.disconnect(ws, "u1")
+    assert manager.subscriptions == {} and manager.user_connections == {}
+
+
+def test_per_user_cap_supersedes_the_oldest_socket(run, manager):
+    manager.MAX_CONNECTIONS_PER_USER = 2
+    first, second = _attach(manager), _attach(manager)
+    third = FakeSocket()
+    assert run(manager.admit(third, "u1"))
+    manager.attach(third, "u1")
+    assert first.closed == 1008
+    assert manager.user_connections["u1"] == [second, third]
+    assert manager.reaped == {"superseded": 1}
+
+
+def test_a_stuck_socket_does_not_hold_up_the_others(run, manager):
+    manager.SEND_TIMEOUT = 0.05
+    stuck = _attach(manager, stall=True)
+    ws = _attach(manager)
+
+    async def go():
+        started = time.monotonic()
+        await manager.broadcast_to_user("u1", _frame())
+        elapsed = time.monotonic() - started
+        await manager.outboxes[ws].join()
+        await asyncio.sleep(0.2)
+        return elapsed
+
+    assert run(go()) < manager.SEND_TIMEOUT
+    assert len(ws.sent) == 1
+    assert stuck.closed == 1001 and stuck not in manager.socket_users
+    assert manager.reaped == {"send_failed": 1}
+
+
+def test_a_full_outbox_evicts_the_socket(run, manager):
+    manager.SEND_QUEUE_FRAMES = 2
+    stuck = _attach(manager, stall=True)
+
+    async def go():
+        for _ in range(4):
+            await manager.broadcast_to_user("u1", _frame(crash_flag=True))
+        await asyncio.sleep(0)
+
+    run(go())
+    assert stuck not in manager.socket_users and stuck not in manager.outboxes
+    assert stuck.closed == 1008
+    assert manager.reaped == {"slow": 1}
+
+
+def test_delivered_frames_keep_a_silent_client_alive(run, manager):
+    quiet, idle = _attach(manager), _attach(manager, user_id="u2")
+    for ws in (quiet, idle):
+        manager.last_seen[ws] -= manager.PING_TIMEOUT + 1
+
+    # A frame delivered to the client counts; it never answers pings
+    _send(run, manager, _frame())
+
+    async def beat():
+        manager.heartbeat(time.monotonic())
+        await _flush(manager)
+        await asyncio.sleep(0)
+
+    run(beat())
+    assert quiet in manager.socket_users and quiet.sent[-1]["type"] == "ping"
+    assert idle not in manager.socket_users and idle.closed == 1001
+    assert manager.reaped == {"timeout": 1}
+
+
+def test_any_inbound_frame_counts_as_alive(manager):
+    ws = _attach(manager)
+    manager.last_seen[ws] = 0.0
+    assert manager.handle_client_message(ws, '{"type": "pong"}') is None
+    assert manager.last_seen[ws] > 0.0
+    manager.last_seen[ws] = 0.0
+    manager.handle_client_message(ws, '{"action": "subscribe"}')
+    assert manager.last_seen[ws] > 0.0
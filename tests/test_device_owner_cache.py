@@ -0,0 +1,112 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.models.db_models import Base, User
+from app.repositories.devices_repo import claim_device_to_user, unclaim_device_from_user
+from app.services.device_owner_cache import DeviceOwnerCache, owner_cache
+
+
+class SlowCache(DeviceOwnerCache):
+    """Owners come from a dict, after a delay, so lookups can overlap."""
+
+    def __init__(self, owners, delay=0.01, **kw):
+        super().__init__(**kw)
+        self.owners = owners
+        self.delay = delay
+        self.loads = 0
+
+    async def _load(self, device_id):
+        self.loads += 1
+        await asyncio.sleep(self.delay)
+        return tuple(self.owners.get(device_id, ()))
+
+
+def test_concurrent_misses_share_one_lookup():
+    cache = SlowCache({"d1": ["u1"]})
+
+    async def run():
+        return await asyncio.gather(*(cache.resolve("d1") for _ in range(5)))
+
+    assert asyncio.run(run()) == [("u1",)] * 5
+    assert cache.loads == 1
+    assert cache.stats()["misses"] == 5
+
+
+def test_negative_results_are_cached_briefly():
+    cache = SlowCache({}, delay=0, negative_ttl=0.0)
+    asyncio.run(cache.resolve("d1"))
+    asyncio.run(cache.resolve("d1"))
+    assert cache.loads == 2
+
+    cache = SlowCache({}, delay=0)
+    asyncio.run(cache.resolve("d1"))
+    assert asyncio.run(cache.resolve("d1")) == ()
+    assert cache.loads == 1
+
+
+def test_lru_bound():
+    cache = SlowCache({}, delay=0, max_entries=2)
+    for device_id in ("a", "b", "c"):
+        asyncio.run(cache.resolve(device_id))
+    assert cache.get("a") is None and cache.get("c") == ()
+    assert cache.evictions == 1
+
+
+def test_invalidation_during_lookup_is_not_overwritten():
+    cache = SlowCache({"d1": ["u1"]})
+
+    async def run():
+        task = asyncio.create_task(cache.resolve("d1"))
+        await asyncio.sleep(0)
+        cache.invalidate("d1")
+        return await task
+
+    assert asyncio.run(run()) == ("u1",)
+    assert cache.get("d1") is None
+
+
+def test_cancelled_lookup_does_not_strand_waiters():
+    cache = SlowCache({"d1": ["u1"]})
+
+    async def run():
+        first = asyncio.create_task(cache.resolve("d1"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.resolve("d1"))
+        await asyncio.sleep(0)
+        first.cancel()
+        result = await asyncio.wait_for(waiter, timeout=1)
+        assert first.cancelled()
+        return result
+
+    assert asyncio.run(run()) == ("u1",)
+    assert cache._inflight == {}
+    assert cache.loads == 2
+
+
+def test_claim_invalidates_only_after_commit():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            db.add(User(user_id="u1", email="u1@example.com"))
+            await db.commit()
+
+            owner_cache.put("d1", ())
+            await claim_device_to_user(db, "u1", "d1")
+            assert owner_cache.get("d1") == ()
+            await db.commit()
+            assert owner_cache.get("d1") is None
+
+            owner_cache.put("d1", ("u1",))
+            await unclaim_device_from_user(db, "u1", "d1")
+            assert owner_cache.get("d1") == ("u1",)
+            await db.commit()
+            assert owner_cache.get("d1") is None
+        await engine.dispose()
+
+    try:
+        asyncio.run(run())
+    finally:
+        owner_cache.invalidate()
@@ -0,0 +1,44 @@
+import numpy as np
+
+from app.ml.features import (
+    FX,
+    N_FEATURES,
+    extract_features,
+    extract_features_reference,
+    synthetic_windows,
+)
+from app.ml.windows import CH
+
+
+def _reference(batch):
+    return np.stack([extract_features_reference(w) for w in batch])
+
+
+def test_batch_matches_reference():
+    batch = synthetic_windows(200, 50, seed=3)
+    out = extract_features(batch)
+    assert out.shape == (200, N_FEATURES)
+    np.testing.assert_allclose(out, _reference(batch), rtol=1e-9, atol=1e-9)
+
+
+def test_repeated_timestamps_match_reference():
+    batch = synthetic_windows(20, 10, seed=4)
+    batch[:, 5, CH["t"]] = batch[:, 4, CH["t"]]
+    np.testing.assert_allclose(extract_features(batch), _reference(batch), rtol=1e-9, atol=1e-9)
+
+
+def test_missing_fixes_are_skipped():
+    batch = synthetic_windows(3, 10, seed=5)
+    batch[:, :, CH["lat"]] = 33.85 + np.arange(10) * 1e-4
+    batch[:, :, CH["lng"]] = 35.86
+    batch[0, :, CH["lat"]] = np.nan          # no fix at all
+    batch[1, -1, CH["lng"]] = np.nan         # fix lost on the newest sample
+    batch[2, 4, CH["lat"]] = np.nan          # one gap mid-window
+    out = extract_features(batch)
+    assert np.isfinite(out).all()
+    np.testing.assert_allclose(out, _reference(batch), rtol=1e-9, atol=1e-9)
+    assert out[0, FX["speed_max_kmh"]] == 0.0
+    assert out[0, FX["speed_drop_kmh"]] == 0.0
+    # Steady speed: the newest valid segment is as fast as the fastest
+    assert out[1, FX["speed_drop_kmh"]] < 1e-6
+    assert out[1, FX["speed_max_kmh"]] > 0
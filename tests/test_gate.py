@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from app.ml.gate import GRAVITY, GYRO_MAX, StreamingGate, trigger_mask
+
+G = GRAVITY
+
+
+def _gate(**kw):
+    kw.setdefault("sample_rate", 0.0)
+    return StreamingGate(seed=0, **kw)
+
+
+@pytest.mark.parametrize("sample,expected", [
+    ((0.0, 0.0, G, 0, 0, 0), False),               # riding, ~1 g
+    ((0.0, 0.0, 3.0 * G, 0, 0, 0), True),          # impact
+    ((0.0, 0.0, 0.1 * G, 0, 0, 0), True),          # free fall
+    ((0.0, 0.0, G, 0, GYRO_MAX + 1, 0), True),     # spin
+    ((0.0, 0.0, G, 0, -GYRO_MAX - 1, 0), True),
+])
+def test_motion_triggers(sample, expected):
+    assert _gate().check("d", *sample) is expected
+
+
+def test_crash_flag_triggers_even_with_a_dead_imu():
+    gate = _gate()
+    assert gate.check("d", 0, 0, 0, 0, 0, 0, crash_flag=True, imu_valid=False)
+
+
+def test_failed_or_sleeping_imu_is_not_free_fall():
+    gate = _gate()
+    for _ in range(10):
+        assert not gate.check("d", 0, 0, 0, 0, 0, 0, imu_valid=False)
+    assert gate.stats()["imu_invalid"] == 10 and gate.triggers == 0
+
+
+def test_only_armed_devices_are_selected_until_the_arm_expires():
+    gate = _gate(arm_seconds=60.0)
+    gate.check("a", 0.0, 0.0, 3.0 * G, 0, 0, 0)
+    assert gate.select(["a", "b"]).tolist() == [True, False]
+    gate.armed_until["a"] = 0.0
+    assert gate.select(["a", "b"]).tolist() == [False, False]
+    stats = gate.stats()
+    assert stats["windows_offered"] == 4 and stats["windows_gated"] == 1
+
+
+def test_monitoring_sample_covers_unarmed_windows():
+    gate = StreamingGate(sample_rate=0.5, seed=1)
+    picked = gate.select([f"d{i}" for i in range(2000)])
+    assert 800 < picked.sum() < 1200
+    assert gate.windows_sampled == picked.sum()
+
+
+def test_trigger_mask_matches_check():
+    rng = np.random.default_rng(7)
+    acc = rng.normal(0.0, 1.5 * G, size=(500, 3))
+    gyro = rng.normal(0.0, 200.0, size=(500, 3))
+    crash = rng.random(500) < 0.02
+    valid = rng.random(500) > 0.1
+    gate = _gate()
+    expected = [
+        gate.check("d", *acc[i], *gyro[i], crash_flag=bool(crash[i]), imu_valid=bool(valid[i]))
+        for i in range(500)
+    ]
+    assert trigger_mask(acc, gyro, crash, valid).tolist() == expected
@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.schemas import TelemetryIn
+from app.services import geofence as G
+
+CENTER = (33.85, 35.86)
+INSIDE = (33.85, 35.86)
+OUTSIDE = (33.86, 35.86)   # ~1.1 km north
+
+
+def _circle(fence_id="f1", device_id="helmet-1", radius_m=200.0, alert_on="both", active=True):
+    return SimpleNamespace(
+        fence_id=fence_id, device_id=device_id, name="Home", kind="circle",
+        center_lat=CENTER[0], center_lng=CENTER[1], radius_m=radius_m, vertices=None,
+        alert_on=alert_on, severity="warning", updated_at=None, active=active,
+    )
+
+
+def telemetry(t, lat, lng, gps_ok=True, device_id="helmet-1"):
+    return TelemetryIn.model_validate({
+        "ts": datetime(2025, 1, 1, 12) + timedelta(seconds=t),
+        "type": "telemetry",
+        "device_id": device_id,
+        "trip_id": "T",
+        "helmet_on": True,
+        "heart_rate": {"ok": True, "ir": 1, "red": 1, "finger": True, "hr": 80, "spo2": 97},
+        "imu": {"ok": True, "sleep": False, "ax": 0, "ay": 0, "az": 9.8, "gx": 0, "gy": 0, "gz": 0},
+        "gps": {"ok": gps_ok, "lat": lat, "lng": lng, "alt": 0, "sats": 8, "lock": gps_ok},
+        "crash_flag": False,
+    })
+
+
+@pytest.fixture
+def engine():
+    eng = G.GeoFenceEngine()
+    eng.upsert(_circle())
+    return eng
+
+
+def _feed(engine, points, start=0):
+    alerts = []
+    for i, (lat, lng) in enumerate(points):
+        alerts += engine.observe(telemetry(t=start + i, lat=lat, lng=lng))
+    return alerts
+
+
+def test_first_fix_inside_is_not_an_enter(engine):
+    assert _feed(engine, [INSIDE]) == []
+    assert engine.inside("helmet-1", "f1") is True
+
+
+def test_exit_needs_confirm_fixes(engine):
+    _feed(engine, [INSIDE])
+    out = _feed(engine, [OUTSIDE] * (G.CONFIRM_FIXES - 1), start=1)
+    assert out == [] and engine.inside("helmet-1", "f1") is True
+    out = _feed(engine, [OUTSIDE], start=G.CONFIRM_FIXES)
+    assert [a["payload"]["event"] for a in out] == ["exit"]
+    assert engine.inside("helmet-1", "f1") is False
+
+
+def test_jitter_across_the_edge_does_not_flap(engine):
+    _feed(engine, [INSIDE])
+    flapping = [OUTSIDE, INSIDE] * 10
+    assert _feed(engine, flapping, start=1) == []
+    assert engine.transitions == {"enter": 0, "exit": 0}
+
+
+def test_enter_then_exit(engine):
+    points = [OUTSIDE] + [INSIDE] * G.CONFIRM_FIXES + [OUTSIDE] * G.CONFIRM_FIXES
+    out = _feed(engine, points)
+    assert [a["payload"]["event"] for a in out] == ["enter", "exit"]
+
+
+def test_alert_on_filters_events():
+    eng = G.GeoFenceEngine()
+    eng.upsert(_circle(alert_on="exit"))
+    points = [OUTSIDE] + [INSIDE] * G.CONFIRM_FIXES + [OUTSIDE] * G.CONFIRM_FIXES
+    out = _feed(eng, points)
+    assert [a["payload"]["event"] for a in out] == ["exit"]
+    assert eng.transitions == {"enter": 1, "exit": 1}
+
+
+def test_fixes_without_lock_are_ignored(engine):
+    _feed(engine, [INSIDE])
+    for i in range(G.CONFIRM_FIXES + 1):
+        assert engine.observe(telemetry(t=1 + i, lat=OUTSIDE[0], lng=OUTSIDE[1], gps_ok=False)) == []
+    assert engine.inside("helmet-1", "f1") is True
+
+
+def test_inactive_or_removed_fence_is_unindexed(engine):
+    engine.upsert(_circle(active=False))
+    assert engine.cells == {} and engine.per_device == {}
+    assert _feed(engine, [INSIDE, OUTSIDE]) == []
+
+
+def test_polygon_fence_and_other_devices():
+    eng = G.GeoFenceEngine()
+    square = [(33.849, 35.859), (33.849, 35.861), (33.851, 35.861), (33.851, 35.859)]
+    eng.upsert(SimpleNamespace(
+        fence_id="sq", device_id="helmet-1", name="Depot", kind="polygon",
+        center_lat=None, center_lng=None, radius_m=None, vertices=square,
+        alert_on="both", severity="critical", updated_at=None, active=True,
+    ))
+    out = _feed(eng, [OUTSIDE] + [INSIDE] * G.CONFIRM_FIXES)
+    assert [(a["payload"]["event"], a["severity"]) for a in out] == [("enter", "critical")]
+    # Fences belong to one device
+    for i in range(G.CONFIRM_FIXES + 1):
+        assert eng.observe(telemetry(t=i, lat=OUTSIDE[0], lng=OUTSIDE[1], device_id="helmet-2")) == []
+
+
+def test_fence_drawn_around_the_device_starts_inside(engine):
+    _feed(engine, [OUTSIDE])
+    fence = _circle(fence_id="f2")
+    fence.center_lat, fence.center_lng = OUTSIDE
+    engine.upsert(fence)
+    assert engine.inside("helmet-1", "f2") is True
+    assert _feed(engine, [OUTSIDE] * G.CONFIRM_FIXES, start=1) == []
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from app.models.schemas import TelemetryIn
+from app.services import hr_monitor as hm
+from app.services.hr_monitor import HeartRateMonitor
+
+T0 = datetime(2025, 1, 1, 12)
+
+
+def _telemetry(t, hr, finger=True, device_id="hr-test"):
+    return TelemetryIn.model_validate({
+        "ts": T0 + timedelta(seconds=t),
+        "type": "telemetry",
+        "device_id": device_id,
+        "trip_id": "T",
+        "helmet_on": True,
+        "heart_rate": {"ok": True, "ir": 1, "red": 1, "finger": finger, "hr": hr, "spo2": 97},
+        "imu": {"ok": True, "sleep": False, "ax": 0, "ay": 0, "az": 9.8, "gx": 0, "gy": 0, "gz": 0},
+        "gps": {"ok": True, "lat": 33.85, "lng": 35.86, "alt": 0, "sats": 8, "lock": True},
+        "crash_flag": False,
+    })
+
+
+def _feed(mon, start, seconds, hr, rate=5, **kw):
+    """Samples at `rate` Hz from `start`; returns (alerts, next start)."""
+    alerts = []
+    n = int(seconds * rate)
+    for i in range(n):
+        alert = mon.observe(_telemetry(start + i / rate, hr, **kw))
+        if alert:
+            alerts.append(alert)
+    return alerts, start + n / rate
+
+
+def _warm(mon, hr=80.0):
+    alerts, t = _feed(mon, 0, hm.WARMUP_SAMPLES / 5 + 1, hr)
+    assert alerts == []
+    return t
+
+
+def test_warmup_only_uses_the_absolute_limits():
+    mon = HeartRateMonitor()
+    alerts, _ = _feed(mon, 0, hm.SUSTAIN_SECONDS + 5, 150)
+    assert alerts == []
+    alerts, _ = _feed(mon, 100, hm.SUSTAIN_SECONDS + 5, hm.ABS_HIGH + 5)
+    assert [(a["alert_type"], a["severity"]) for a in alerts] == [("high_hr", "critical")]
+    assert alerts[0]["payload"]["warming_up"] is True
+
+
+def test_personal_band_alerts_once_per_sustained_excursion():
+    mon = HeartRateMonitor()
+    t = _warm(mon)
+    lo, hi = mon.band(mon.states["hr-test"])
+    assert lo < 80 < hi and hi - lo == 2 * hm.BAND_K * hm.MIN_STD
+
+    # Shorter than the sustain time: nothing
+    alerts, t = _feed(mon, t, hm.SUSTAIN_SECONDS - 1, hi + 10)
+    assert alerts == []
+    _, t = _feed(mon, t, 1, 80)
+
+    alerts, t = _feed(mon, t, hm.SUSTAIN_SECONDS * 3, hi + 10)
+    assert len(alerts) == 1
+    alert = alerts[0]
+    assert alert["alert_type"] == "high_hr" and alert["severity"] == "warning"
+    assert alert["payload"]["duration_s"] >= hm.SUSTAIN_SECONDS
+    # The excursion did not move the baseline
+    assert mon.band(mon.states["hr-test"]) == (lo, hi)
+
+
+def test_cooldown_and_direction():
+    mon = HeartRateMonitor()
+    t = _warm(mon)
+    lo, hi = mon.band(mon.states["hr-test"])
+    alerts, t = _feed(mon, t, hm.SUSTAIN_SECONDS + 1, hi + 10)
+    _, t = _feed(mon, t, 1, 80)
+    again, t = _feed(mon, t, hm.SUSTAIN_SECONDS + 1, hi + 10)
+    low, t = _feed(mon, t, hm.SUSTAIN_SECONDS + 1, lo - 5)
+    assert [a["alert_type"] for a in alerts + again + low] == ["high_hr", "low_hr"]
+    assert mon.stats()["alerts"] == {"high_hr": 1, "low_hr": 1}
+
+
+def test_sensor_gaps_break_an_excursion():
+    mon = HeartRateMonitor()
+    t = _warm(mon)
+    _, hi = mon.band(mon.states["hr-test"])
+    alerts = []
+    # Out of band for 3x the sustain time, but off-skin every 10 s
+    for _ in range(6):
+        got, t = _feed(mon, t, 10, hi + 10)
+        alerts += got
+        _, t = _feed(mon, t, 0.2, hi + 10, finger=False)
+    assert alerts == []
+    assert mon.suppressed == 6
+
+    # Garbage readings are ignored the same way
+    before = mon.states["hr-test"].samples
+    mon.observe(_telemetry(t, 300))
+    assert mon.states["hr-test"].samples == before and mon.suppressed == 7
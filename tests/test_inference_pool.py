@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from app.ml.features import synthetic_windows
+from app.ml.inference_pool import ProcessScorer, ThreadScorer, _Worker
+
+WINDOW = 10
+
+
+def _pool(**kw):
+    return ProcessScorer(workers=1, max_rows=8, window=WINDOW, **kw)
+
+
+def test_process_pool_matches_thread_scorer():
+    windows = synthetic_windows(20, WINDOW, seed=2)
+
+    async def run():
+        pool = _pool()
+        await pool.start()
+        try:
+            return await pool.score(windows), await ThreadScorer(window=WINDOW).score(windows)
+        finally:
+            await pool.close()
+
+    (probs, version), (expected, expected_version) = asyncio.run(run())
+    np.testing.assert_allclose(probs, expected, rtol=1e-6)
+    assert version == expected_version
+
+
+def test_a_cancelled_chunk_retires_its_worker():
+    windows = synthetic_windows(4, WINDOW, seed=3)
+    other = synthetic_windows(4, WINDOW, seed=5)
+
+    async def run():
+        pool = _pool()
+        await pool.start()
+        try:
+            first = pool._workers[0]
+            real_recv = first.recv
+
+            async def slow_recv(timeout):
+                await asyncio.sleep(10)
+                return await real_recv(timeout)
+
+            first.recv = slow_recv
+            task = asyncio.create_task(pool.score(windows))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # Its reply is still in the pipe: it must not score the next batch
+            assert first not in pool._workers
+            for _ in range(100):
+                if not pool._idle.empty():
+                    break
+                await asyncio.sleep(0.1)
+            return await pool.score(other)
+        finally:
+            await pool.close()
+
+    probs, _ = asyncio.run(run())
+    expected, _ = asyncio.run(ThreadScorer(window=WINDOW).score(other))
+    np.testing.assert_allclose(probs, expected, rtol=1e-6)
+
+
+def test_no_live_worker_fails_fast_then_respawns(monkeypatch):
+    windows = synthetic_windows(2, WINDOW, seed=4)
+    real_wait_ready = _Worker.wait_ready
+    failures = []
+
+    async def failing_once(self):
+        if not failures:
+            failures.append(self)
+            raise RuntimeError("model failed to load")
+        return await real_wait_ready(self)
+
+    async def run():
+        pool = _pool()
+        await pool.start()
+        try:
+            monkeypatch.setattr(_Worker, "wait_ready", failing_once)
+            pool._workers[0].process.kill()
+            pool._workers[0].process.join()
+            with pytest.raises((EOFError, BrokenPipeError, ConnectionResetError)):
+                await pool.score(windows)
+            # Wait for the replacement's first (failing) start
+            for _ in range(100):
+                if failures:
+                    break
+                await asyncio.sleep(0.05)
+            # No worker is up: the batch is refused, not left waiting
+            with pytest.raises(RuntimeError, match="no inference worker"):
+                await asyncio.wait_for(pool.score(windows), timeout=5)
+            # ... and the pool recovers after the backoff
+            for _ in range(100):
+                if not pool._idle.empty():
+                    break
+                await asyncio.sleep(0.1)
+            probs, _ = await pool.score(windows)
+            return probs, len(pool._workers)
+        finally:
+            await pool.close()
+
+    probs, size = asyncio.run(run())
+    assert probs.shape == (2,) and size == 1
+    assert failures
+
+
+def test_close_joins_off_the_event_loop(monkeypatch):
+    real_close = _Worker.close
+
+    def slow_close(self, kill=False):
+        time.sleep(0.2)
+        real_close(self, kill)
+
+    async def run():
+        pool = ProcessScorer(workers=2, max_rows=8, window=WINDOW)
+        await pool.start()
+        monkeypatch.setattr(_Worker, "close", slow_close)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        await pool.close()
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(run()) >= 5
@@ -0,0 +1,39 @@
+from sqlalchemy import create_engine, insert, select
+
+from app.database.migrations import run_migrations
+from app.models.db_models import Base, TripData
+
+
+def _pk_type(conn):
+    cols = conn.exec_driver_sql("PRAGMA table_info(trip_data)").fetchall()
+    return [c[2] for c in cols if c[5]][0].upper()
+
+
+def test_old_bigint_trip_data_is_rebuilt_with_its_rows():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE trip_data (data_id BIGINT NOT NULL PRIMARY KEY, "
+            "trip_id VARCHAR(36), device_id VARCHAR(64), timestamp DATETIME)"
+        )
+        conn.exec_driver_sql("INSERT INTO trip_data VALUES (7, 'T', 'd1', '2025-01-01 12:00:00')")
+        Base.metadata.create_all(conn)
+        run_migrations(conn)
+
+        assert _pk_type(conn) == "INTEGER"
+        conn.execute(insert(TripData).values(trip_id="T", device_id="d1"))
+        rows = conn.execute(select(TripData.data_id, TripData.trip_id).order_by(TripData.data_id)).all()
+        assert [tuple(r) for r in rows] == [(7, "T"), (8, "T")]
+
+        # Idempotent: a second run leaves the rebuilt table alone
+        run_migrations(conn)
+        assert conn.execute(select(TripData.data_id).order_by(TripData.data_id)).scalars().all() == [7, 8]
+
+
+def test_new_databases_need_no_rebuild(capsys):
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        run_migrations(conn)
+        assert _pk_type(conn) == "INTEGER"
+    assert "Rebuilding" not in capsys.readouterr().out
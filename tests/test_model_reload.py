@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.endpoints import admin
+from app.ml import predictor as predictor_mod
+from app.ml.inference_pool import ThreadScorer
+from app.ml.predictor import CrashPredictor, DummyModel
+
+
+class VersionedModel(DummyModel):
+    """Stand-in for an OnnxModel: versioned by file name, never touches onnxruntime."""
+
+    def __init__(self, path, intra_op_threads=1):
+        super().__init__()
+        self.version = f"{os.path.basename(path)}@test"
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(admin, "MODEL_PATH", str(tmp_path / "model.onnx"))
+    return tmp_path
+
+
+def test_model_file_stays_in_the_model_directory(model_dir):
+    assert admin._model_file(None) is None
+    assert admin._model_file("candidate.onnx") == os.path.realpath(model_dir / "candidate.onnx")
+    for name in ("../model.onnx", "/etc/passwd", "sub/../../x.onnx", "sub/model.onnx"):
+        with pytest.raises(HTTPException) as e:
+            admin._model_file(name)
+        assert e.value.status_code == 422
+
+
+def test_reload_swaps_the_model_and_keeps_it_on_failure(model_dir, monkeypatch):
+    monkeypatch.setattr(predictor_mod, "OnnxModel", VersionedModel)
+    good = model_dir / "v2.onnx"
+    good.write_bytes(b"model")
+    scorer = ThreadScorer(CrashPredictor(DummyModel()), window=10)
+
+    assert asyncio.run(scorer.reload(str(good))) == "v2.onnx@test"
+    assert scorer.version == "v2.onnx@test"
+
+    # strict: a missing file fails instead of silently loading the dummy
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(scorer.reload(str(model_dir / "missing.onnx")))
+    assert scorer.version == "v2.onnx@test"
@@ -0,0 +1,106 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.database import connection
+from app.ml.features import FEATURE_NAMES, N_FEATURES
+from app.models.db_models import Base
+from app.repositories.predictions_repo import range_for_trip, summary_for_trip
+from app.services.prediction_log import PredictionLog
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory SQLite behind get_db_context(), for the flush path."""
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    @asynccontextmanager
+    async def get_db_context():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    async def create():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create())
+    monkeypatch.setattr(connection, "get_db_context", get_db_context)
+    yield get_db_context
+    asyncio.run(engine.dispose())
+
+
+def test_select_keeps_every_positive_and_samples_negatives():
+    np.random.seed(0)
+    positive = np.zeros(10_000, dtype=bool)
+    positive[::100] = True
+    picked = PredictionLog(negative_every=10).select(positive)
+    assert positive[picked].sum() == 100
+    assert 850 < (~positive[picked]).sum() < 1130
+    assert len(PredictionLog(negative_every=0).select(positive)) == 0
+    assert len(PredictionLog(negative_every=1).select(positive)) == 10_000
+
+
+def _add(log, n, trip_id="T", positive=None, version="v1"):
+    start = datetime(2025, 1, 1, 12)
+    log.add(
+        [f"d{i}" for i in range(n)],
+        [trip_id] * n,
+        [start + timedelta(seconds=i) for i in range(n)],
+        np.linspace(0.1, 0.9, n),
+        positive if positive is not None else np.zeros(n, dtype=bool),
+        np.ones((n, N_FEATURES)),
+        version,
+    )
+
+
+def test_rows_are_buffered_then_written_in_one_flush(db):
+    log = PredictionLog(negative_every=10, flush_rows=1000)
+    _add(log, 3, positive=np.array([False, False, True]))
+    assert log.stats()["pending"] == 3 and log.written == 0
+    assert asyncio.run(log.flush()) == 3
+    assert log.stats()["pending"] == 0 and log.written == 3
+
+    async def read():
+        async with db() as session:
+            return await range_for_trip(session, "T"), await summary_for_trip(session, "T")
+
+    rows, summary = asyncio.run(read())
+    assert [r.sample_weight for r in rows] == [10, 10, 1]
+    assert set(rows[0].features) == set(FEATURE_NAMES)
+    assert summary == ({
+        "model_version": "v1", "rows": 3, "windows": 21, "positives": 1, "max_probability": 0.9,
+    },)
+
+
+def test_flush_failure_drops_the_batch(monkeypatch):
+    @asynccontextmanager
+    async def broken():
+        raise RuntimeError("db down")
+        yield
+
+    monkeypatch.setattr(connection, "get_db_context", broken)
+    log = PredictionLog()
+    _add(log, 2)
+    assert asyncio.run(log.flush()) == 0
+    assert log.flush_errors == 1 and log.dropped == 2 and log.stats()["pending"] == 0
+
+
+def test_reaching_flush_rows_wakes_the_writer(db):
+    log = PredictionLog(flush_rows=5, flush_seconds=60)
+
+    async def run():
+        task = asyncio.create_task(log.run())
+        await asyncio.sleep(0)
+        _add(log, 5)
+        for _ in range(50):
+            if log.written:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return log.written
+
+    assert asyncio.run(run()) == 5
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from app.ml import predictor as predictor_mod
+from app.ml.features import N_FEATURES
+from app.ml.inference_pool import load_warm_predictor
+from app.ml.predictor import CrashPredictor, DummyModel, load_model
+
+
+class CorruptModel:
+    """What onnxruntime does with a truncated or non-ONNX file."""
+
+    def __init__(self, path, intra_op_threads=1):
+        raise RuntimeError("[ONNXRuntimeError] : 7 : INVALID_PROTOBUF : Load model failed")
+
+
+class WrongInputModel:
+    """Loads, but expects a different input shape than our features."""
+    name = "onnx"
+    version = "wrong@0"
+
+    def __init__(self, path, intra_op_threads=1):
+        pass
+
+    def run(self, batch):
+        raise RuntimeError("[ONNXRuntimeError] : 2 : INVALID_ARGUMENT : Got invalid dimensions")
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = tmp_path / "model.onnx"
+    path.write_bytes(b"not a model")
+    return str(path)
+
+
+def test_missing_or_placeholder_model_uses_the_dummy(tmp_path):
+    empty = tmp_path / "model.onnx"
+    empty.write_bytes(b"")
+    assert isinstance(load_model(str(empty)), DummyModel)
+    assert isinstance(load_model(str(tmp_path / "absent.onnx")), DummyModel)
+    with pytest.raises(FileNotFoundError):
+        load_model(str(empty), strict=True)
+
+
+def test_corrupt_model_falls_back_unless_strict(monkeypatch, model_file, capsys):
+    monkeypatch.setattr(predictor_mod, "OnnxModel", CorruptModel)
+    assert isinstance(load_model(model_file), DummyModel)
+    assert "INVALID_PROTOBUF" in capsys.readouterr().out
+    with pytest.raises(RuntimeError):
+        load_model(model_file, strict=True)
+
+
+def test_model_that_fails_warm_up_falls_back_unless_strict(monkeypatch, model_file):
+    monkeypatch.setattr(predictor_mod, "OnnxModel", WrongInputModel)
+    predictor = load_warm_predictor(model_file, window=10)
+    assert isinstance(predictor.model, DummyModel)
+    with pytest.raises(RuntimeError):
+        load_warm_predictor(model_file, window=10, strict=True)
+
+
+def test_large_batches_are_split():
+    batch = np.random.default_rng(0).normal(size=(7, N_FEATURES))
+    whole = CrashPredictor(DummyModel()).predict(batch)
+    split = CrashPredictor(DummyModel(), max_batch_size=3).predict(batch)
+    assert split.dtype == np.float32 and split.shape == (7,)
+    np.testing.assert_array_equal(whole, split)
+    assert CrashPredictor().predict(np.zeros((0, N_FEATURES))).shape == (0,)
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.ml.gate import GRAVITY
+from app.ml.replay import Replay
+from app.ml.windows import CH, sliding_windows
+
+G = GRAVITY
+T0 = datetime(2025, 1, 1, 12, 0, 0)
+
+
+class FlatPredictor:
+    """Every window is a crash, so alerts only depend on gating and cooldown."""
+
+    version = "flat"
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, features):
+        self.calls += 1
+        return np.ones(len(features))
+
+
+def _rows(trip_id, n, crash_at=(), impact_at=(), device_id="d1", lat=33.85, lng=35.5):
+    """Rows in stream_trip_samples order: trip, device, ts, acc, gyro, hr, lat, lng, crash_flag."""
+    rows = []
+    for i in range(n):
+        az = 3.0 * G if i in impact_at else G
+        rows.append((
+            trip_id, device_id, T0 + timedelta(seconds=i * 0.2),
+            0.0, 0.0, az, 0.0, 0.0, 0.0, 80.0, lat, lng, i in crash_at,
+        ))
+    return rows
+
+
+def _run(rows, chunk, **kw):
+    kw.setdefault("window", 10)
+    kw.setdefault("stride", 5)
+    kw.setdefault("cooldown", 5.0)
+    run = Replay(FlatPredictor(), **kw)
+    for i in range(0, len(rows), chunk):
+        run.process(rows[i:i + chunk])
+    return run
+
+
+def test_no_fix_rows_become_nan():
+    run = Replay(FlatPredictor(), window=10)
+    rows = _rows("T", 2) + _rows("T", 1, lat=0.0, lng=0.0)
+    _, _, samples, _ = run._convert(rows)
+    assert not np.isnan(samples[:2, CH["lat"]]).any()
+    assert np.isnan(samples[2, [CH["lat"], CH["lng"]]]).all()
+
+
+def test_results_do_not_depend_on_the_chunk_size():
+    rows = _rows("A", 203, impact_at={40, 150}) + _rows("B", 77, crash_at={60})
+    whole = _run(rows, chunk=len(rows))
+    for chunk in (1, 7, 64):
+        split = _run(rows, chunk=chunk)
+        assert (split.windows, split.windows_scored, split.trips) == (
+            whole.windows, whole.windows_scored, whole.trips,
+        )
+        assert split.alerts == whole.alerts
+
+
+def test_gate_scores_only_windows_near_a_trigger():
+    rows = _rows("T", 200, impact_at={100})
+    gated = _run(rows, chunk=50)
+    ungated = _run(rows, chunk=50, use_gate=False)
+    assert ungated.windows_scored == ungated.windows == (200 - 10) // 5 + 1
+    assert 0 < gated.windows_scored < ungated.windows_scored
+    # Nothing before the impact is scored; the first alert is the window holding it
+    assert min(a["ts"] for a in gated.alerts) >= (rows[100][2] - datetime(1970, 1, 1)).total_seconds()
+
+
+def test_cooldown_limits_alerts_per_trip():
+    rows = _rows("T", 200)
+    run = _run(rows, chunk=200, use_gate=False, cooldown=10.0)
+    ts = [a["ts"] for a in run.alerts]
+    assert all(b - a >= 10.0 for a, b in zip(ts, ts[1:]))
+    assert len(ts) == 4    # 40 s of windows ending at 1.8 s, 11.8 s, 21.8 s, 31.8 s
+
+
+def test_sliding_windows_rebase_time_and_copy():
+    samples = np.arange(13 * len(CH), dtype=np.float64).reshape(13, len(CH))
+    for n in (10, 13):
+        batch = sliding_windows(samples[:n], 10, 3)
+        assert batch.shape == ((n - 10) // 3 + 1, 10, len(CH))
+        assert (batch[:, -1, CH["t"]] == 0).all()
+    # The input is left alone, even for a single window
+    assert (samples[:, CH["t"]] == np.arange(13) * len(CH)).all()
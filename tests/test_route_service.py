@@ -0,0 +1,135 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.repositories.trips_repo import TripsRepo
+from app.services import route_service
+from app.services.route_service import (
+    RouteCache,
+    binary_payload,
+    encode_polyline,
+    load_route,
+    lod_tolerance,
+    negotiate_format,
+    polyline_payload,
+    route_from_rows,
+    simplify,
+)
+
+T0 = datetime(2025, 1, 1, 12)
+
+
+def _rows(n=200, seed=0):
+    """(timestamp, lat, lng, speed) rows of a wiggly ride."""
+    rng = np.random.default_rng(seed)
+    lat = 33.85 + np.cumsum(rng.normal(4e-5, 2e-5, n))
+    lng = 35.86 + np.cumsum(rng.normal(2e-5, 2e-5, n))
+    return [(T0 + timedelta(seconds=i), lat[i], lng[i], 20.0) for i in range(n)]
+
+
+def test_simplify_keeps_endpoints_and_corners():
+    # An L: straight north, then straight east
+    lat = np.concatenate([np.linspace(33.85, 33.86, 50), np.full(50, 33.86)])
+    lng = np.concatenate([np.full(50, 35.86), np.linspace(35.86, 35.87, 50)])
+    assert simplify(lat, lng, 1.0).tolist() == [0, 49, 99]
+
+
+def test_simplified_route_stays_within_tolerance():
+    route = route_from_rows(_rows())
+    for tolerance_m in (1.0, 8.0, 64.0):
+        keep = simplify(route.lat, route.lng, tolerance_m)
+        assert keep[0] == 0 and keep[-1] == len(route) - 1
+        # Every dropped point is within tolerance of its chord (local metres)
+        y = np.radians(route.lat) * 6_371_000.0
+        x = np.radians(route.lng) * 6_371_000.0 * np.cos(np.radians(route.lat.mean()))
+        for a, b in zip(keep[:-1], keep[1:]):
+            px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+            dx, dy = x[b] - x[a], y[b] - y[a]
+            u = np.clip((px * dx + py * dy) / (dx * dx + dy * dy), 0, 1)
+            assert (np.hypot(px - u * dx, py - u * dy) <= tolerance_m + 1e-6).all()
+    assert len(simplify(route.lat, route.lng, 64.0)) < len(simplify(route.lat, route.lng, 1.0))
+
+
+def test_lod_tolerance_snaps_to_powers_of_two():
+    assert lod_tolerance(3.0) == 4.0
+    assert lod_tolerance(5.0) == 4.0
+    assert lod_tolerance(7.0) == 8.0
+
+
+def test_route_cache_lru_and_invalidate():
+    cache = RouteCache(max_entries=2)
+    cache.put("a", 1.0, "a1")
+    cache.put("a", 2.0, "a2")
+    assert cache.get("a", 1.0) == "a1"
+    cache.put("b", 1.0, "b1")          # evicts ("a", 2.0), least recently used
+    assert cache.get("a", 2.0) is None
+    cache.invalidate("a")
+    assert cache.get("a", 1.0) is None
+    assert cache.get("b", 1.0) == "b1"
+
+
+def test_load_route_caches_closed_trips_only(monkeypatch):
+    fetches = []
+
+    async def rows(db, trip_id):
+        fetches.append(trip_id)
+        return _rows()
+
+    monkeypatch.setattr(TripsRepo, "get_trip_route_rows", staticmethod(rows))
+    monkeypatch.setattr(route_service, "route_cache", RouteCache())
+
+    async def run():
+        full = await load_route(None, "T", cacheable=True)
+        a = await load_route(None, "T", cacheable=True, tolerance_m=5.0)
+        b = await load_route(None, "T", cacheable=True, tolerance_m=4.5)   # same ladder step
+        c = await load_route(None, "live", cacheable=False, zoom=15)
+        d = await load_route(None, "live", cacheable=False, zoom=15)
+        return full, a, b, c, d
+
+    full, a, b, c, d = asyncio.run(run())
+    assert len(full) == 200 and a is b and len(a) < len(full)
+    assert c is not d and len(c) == len(d)
+    assert fetches == ["T", "T", "live", "live"]
+
+
+def test_encode_polyline_google_vector():
+    # Example from Google's encoded polyline algorithm documentation
+    lat = np.array([38.5, 40.7, 43.252])
+    lng = np.array([-120.2, -120.95, -126.453])
+    assert encode_polyline(lat, lng) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_encode_polyline_empty_and_precision():
+    assert encode_polyline(np.zeros(0), np.zeros(0)) == ""
+    # Precision 6 scales every delta by 10; a single zero point is "??"
+    assert encode_polyline(np.zeros(1), np.zeros(1), precision=6) == "??"
+
+
+def test_polyline_timestamps_are_deltas():
+    route = route_from_rows(_rows(5))
+    payload = polyline_payload("T", route)
+    assert payload["points"] == 5
+    assert np.cumsum(payload["ts"]).tolist() == [
+        int((T0 + timedelta(seconds=i) - datetime(1970, 1, 1)).total_seconds() * 1000) for i in range(5)
+    ]
+
+
+def test_binary_payload_round_trip():
+    route = route_from_rows(_rows(5))
+    body, headers = binary_payload(route)
+    records = np.frombuffer(body, dtype="<f4").reshape(-1, 4)
+    assert headers["X-Route-Points"] == "5" and headers["X-Route-Fields"] == "lat,lng,t,speed"
+    np.testing.assert_allclose(records[:, 0], route.lat, atol=1e-5)
+    assert records[:, 2].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+@pytest.mark.parametrize("fmt,accept,expected", [
+    ("binary", "application/vnd.polyline+json", "binary"),
+    (None, "application/vnd.polyline+json", "polyline"),
+    (None, "application/octet-stream", "binary"),
+    (None, None, "json"),
+])
+def test_negotiate_format(fmt, accept, expected):
+    assert negotiate_format(fmt, accept) == expected
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.models.schemas import TelemetryIn
+from app.services.analytics_service import MAX_SEGMENT_GAP_S, SMOOTH_S, SPEED_WINDOW_S, SpeedTracker, derive_speeds
+from app.services.route_service import route_from_rows
+from app.workers.speed_backfill import speed_updates
+
+T0 = datetime(2025, 1, 1, 12)
+# Degrees of latitude per metre
+DEG_PER_M = 1.0 / 111_194.9
+
+
+def _telemetry(t, lat, lng=35.86, gps_ok=True):
+    return TelemetryIn.model_validate({
+        "ts": T0 + timedelta(seconds=t),
+        "type": "telemetry",
+        "device_id": "speed-test",
+        "trip_id": "T",
+        "helmet_on": True,
+        "heart_rate": {"ok": True, "ir": 1, "red": 1, "finger": True, "hr": 80, "spo2": 97},
+        "imu": {"ok": True, "sleep": False, "ax": 0, "ay": 0, "az": 9.8, "gx": 0, "gy": 0, "gz": 0},
+        "gps": {"ok": gps_ok, "lat": lat, "lng": lng, "alt": 0, "sats": 8, "lock": gps_ok},
+        "crash_flag": False,
+    })
+
+
+def _ride(tracker, times, lats):
+    return [tracker.observe("speed-test", _telemetry(t, lat)) for t, lat in zip(times, lats)]
+
+
+def test_steady_ride_reads_its_speed():
+    t = np.arange(0, 20, 0.2)
+    speeds = _ride(SpeedTracker(), t, 33.85 + 10.0 * t * DEG_PER_M)     # 10 m/s
+    assert all(s is None for s, ti in zip(speeds, t) if ti < SPEED_WINDOW_S - 1e-9)
+    # Smoothing lags over the first SMOOTH_S, then speed is exact
+    known = [s for s, ti in zip(speeds, t) if ti >= SPEED_WINDOW_S + SMOOTH_S]
+    assert np.allclose(known, 36.0, atol=0.1)
+
+
+def test_parked_noise_reads_zero():
+    rng = np.random.default_rng(0)
+    t = np.arange(0, 20, 0.2)
+    speeds = _ride(SpeedTracker(), t, 33.85 + rng.normal(0, 1.0, len(t)) * DEG_PER_M)
+    assert {s for s in speeds[20:]} == {0.0}
+
+
+def test_gaps_glitches_and_relocation():
+    tracker = SpeedTracker()
+    t = np.arange(0, 10, 0.2)
+    lats = 33.85 + 10.0 * t * DEG_PER_M
+    before = _ride(tracker, t, lats)[-1]
+    # A single implausible fix keeps the last speed and is not the new anchor
+    assert tracker.observe("speed-test", _telemetry(10.0, 34.0)) == before
+    assert tracker.rejected == 1
+    # Resuming after a long gap: unknown until the window refills
+    assert tracker.observe("speed-test", _telemetry(10.2 + MAX_SEGMENT_GAP_S, lats[-1])) is None
+    # Enough implausible fixes in a row restart the track where GPS now is
+    for i in range(5):
+        tracker.observe("speed-test", _telemetry(50.0 + i * 0.2, 34.5))
+    assert tracker.states["speed-test"].lat == 34.5
+    # No fix: no speed
+    assert tracker.observe("speed-test", _telemetry(60.0, 0.0, 0.0)) is None
+
+
+def test_routes_derive_missing_speeds_and_backfill_splits_devices():
+    t = np.arange(0, 10, 0.2)
+    lat = 33.85 + 10.0 * t * DEG_PER_M
+    rows = [(T0 + timedelta(seconds=float(ti)), la, 35.86, None) for ti, la in zip(t, lat)]
+    route = route_from_rows(rows)
+    expected = derive_speeds(route.t, route.lat, route.lng)
+    np.testing.assert_array_equal(route.speed, expected)
+    assert np.isclose(route.speed[-1], 36.0, atol=0.1)
+
+    # Two devices interleaved by id: each gets its own track
+    backfill = [(i, "a", ts, la, lng) for i, (ts, la, lng, _) in enumerate(rows)]
+    backfill += [(100 + i, "b", ts, 34.0, 35.0) for i, (ts, *_rest) in enumerate(rows)]
+    updates = speed_updates(backfill)
+    by_id = {u["data_id"]: u["speed"] for u in updates}
+    assert by_id[len(rows) - 1] == round(float(expected[-1]), 2)
+    assert by_id[100 + len(rows) - 1] == 0.0
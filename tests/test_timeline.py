@@ -0,0 +1,67 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.database import connection
+from app.models.db_models import Alert, Base, TripData
+from app.services import timeline
+from app.services.timeline import _merge, timeline_ndjson
+
+T0 = datetime(2025, 1, 1, 12)
+
+
+async def _stream(items):
+    for item in items:
+        yield item
+
+
+def _collect(agen):
+    async def run():
+        return [x async for x in agen]
+    return asyncio.run(run())
+
+
+def test_merge_orders_by_time_then_samples_before_alerts():
+    telemetry = _stream([(1.0, 0, "s1"), (2.0, 0, "s2"), (2.0, 0, "s2b"), (5.0, 0, "s5")])
+    alerts = _stream([(0.5, 1, "a0"), (2.0, 1, "a2"), (9.0, 1, "a9")])
+    assert _collect(_merge(telemetry, alerts)) == ["a0", "s1", "s2", "s2b", "a2", "s5", "a9"]
+    assert _collect(_merge(_stream([]), _stream([(1.0, 1, "a")]))) == ["a"]
+
+
+def test_timeline_ndjson_end_to_end(tmp_path, monkeypatch):
+    monkeypatch.setattr(timeline, "LINES_PER_WRITE", 3)
+
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'timeline.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        monkeypatch.setattr(connection, "AsyncSessionLocal", async_sessionmaker(engine, class_=AsyncSession))
+        async with AsyncSession(engine) as db:
+            for i in range(10):
+                db.add(TripData(
+                    trip_id="T", device_id="d1", timestamp=T0 + timedelta(seconds=i * 0.2),
+                    lat=33.85, lng=35.86, heart_rate=80, crash_flag=(i == 7),
+                ))
+            db.add(Alert(trip_id="T", device_id="d1", ts=T0 + timedelta(seconds=1.4), type="crash",
+                         severity="critical", message="Crash"))
+            db.add(Alert(trip_id="other", device_id="d1", ts=T0, type="crash", severity="critical"))
+            await db.commit()
+        try:
+            full = b"".join([chunk async for chunk in timeline_ndjson("T")])
+            sampled = b"".join([chunk async for chunk in timeline_ndjson("T", hz=1.0)])
+        finally:
+            await engine.dispose()
+        return full, sampled
+
+    full, sampled = asyncio.run(run())
+    lines = [json.loads(x) for x in full.decode().splitlines()]
+    assert [x["type"] for x in lines] == ["telemetry"] * 8 + ["alert"] + ["telemetry"] * 2 + ["end"]
+    assert lines[7]["crash_flag"] is True and lines[8]["alert_type"] == "crash"
+    assert lines[-1] == {"type": "end", "trip_id": "T", "telemetry": 10, "alert": 1}
+    assert lines[0]["ts"].endswith("+02:00")
+
+    # 1 Hz: one sample per second, plus the crash-flagged one
+    end = json.loads(sampled.decode().splitlines()[-1])
+    assert end["telemetry"] == 3 and end["alert"] == 1
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.models.db_models import Base, TripCell
+from app.repositories import trip_cells_repo
+from app.repositories.trip_cells_repo import insert_trip_cells
+
+
+def _cells(trip_id, *cells, level=0):
+    return [{"trip_id": trip_id, "level": level, "cell": c} for c in cells]
+
+
+@pytest.mark.parametrize("native", [True, False])
+def test_insert_trip_cells_skips_existing_rows(monkeypatch, native):
+    if not native:
+        monkeypatch.setattr(trip_cells_repo, "_insert_ignoring_duplicates", lambda dialect: None)
+
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with AsyncSession(engine) as db:
+                await insert_trip_cells(db, _cells("A", 1, 2) + _cells("A", 1, level=1))
+                await db.commit()
+                # Ingest and the backfill both send cells of the same trip
+                await insert_trip_cells(db, _cells("A", 2, 3) + _cells("B", 1))
+                await insert_trip_cells(db, _cells("A", 1, 2, 3))
+                await db.commit()
+                res = await db.execute(
+                    select(TripCell.trip_id, TripCell.level, TripCell.cell).order_by(
+                        TripCell.trip_id, TripCell.level, TripCell.cell
+                    )
+                )
+                return [tuple(r) for r in res.all()]
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(run()) == [
+        ("A", 0, 1), ("A", 0, 2), ("A", 0, 3), ("A", 1, 1), ("B", 0, 1),
+    ]
+
+
+@pytest.mark.parametrize("dialect,sql", [
+    ("sqlite", "ON CONFLICT DO NOTHING"),
+    ("postgresql", "ON CONFLICT DO NOTHING"),
+    ("mysql", "INSERT IGNORE"),
+])
+def test_each_dialect_gets_its_own_skip_clause(dialect, sql):
+    import importlib
+
+    stmt = trip_cells_repo._insert_ignoring_duplicates(dialect)
+    compiled = str(stmt.compile(dialect=importlib.import_module(f"sqlalchemy.dialects.{dialect}").dialect()))
+    assert sql in compiled
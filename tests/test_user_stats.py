@@ -0,0 +1,90 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.database import connection
+from app.models.db_models import Base, Trip, User, UserDailyStats
+from app.repositories import user_stats_repo
+from app.repositories.user_stats_repo import upsert_daily_stats
+from app.services.user_stats import UserStats, day_bounds, local_day
+
+
+def _bucket(day, trips, distance_km):
+    return {
+        "user_id": "u1", "day": day, "trips": trips, "distance_km": distance_km,
+        "ride_seconds": 600.0 * trips, "crashes": 0, "max_speed": 40.0,
+        "updated_at": datetime(2025, 1, 1),
+    }
+
+
+def _with_db(body):
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as db:
+                db.add(User(user_id="u1", email="u1@example.com"))
+                await db.commit()
+                return await body(db)
+        finally:
+            await engine.dispose()
+    return asyncio.run(run())
+
+
+async def _buckets(db):
+    res = await db.execute(select(UserDailyStats.day, UserDailyStats.trips, UserDailyStats.distance_km))
+    return sorted(tuple(r) for r in res.all())
+
+
+@pytest.mark.parametrize("native", [True, False])
+def test_upsert_overwrites_existing_buckets(monkeypatch, native):
+    if not native:
+        monkeypatch.setattr(user_stats_repo, "_upsert_statement", lambda dialect: None)
+
+    async def body(db):
+        d1, d2 = date(2025, 1, 1), date(2025, 1, 2)
+        await upsert_daily_stats(db, [_bucket(d1, 1, 5.0)])
+        await db.commit()
+        # A rebuilt d1 replaces the old row rather than adding to it
+        await upsert_daily_stats(db, [_bucket(d1, 2, 12.0), _bucket(d2, 1, 3.0)])
+        await db.commit()
+        return await _buckets(db)
+
+    assert _with_db(body) == [(date(2025, 1, 1), 2, 12.0), (date(2025, 1, 2), 1, 3.0)]
+
+
+def test_refresh_rebuilds_a_day_from_its_trips(monkeypatch):
+    day = date(2025, 3, 4)
+    start, _ = day_bounds(day)
+
+    async def body(db):
+        @asynccontextmanager
+        async def context():
+            yield db
+
+        monkeypatch.setattr(connection, "get_db_context", context)
+        for i, km in enumerate((4.0, 6.5)):
+            begin = start + timedelta(hours=1 + i)
+            db.add(Trip(
+                trip_id=f"T{i}", user_id="u1", start_time=begin, end_time=begin + timedelta(minutes=30),
+                total_distance=km, crash_count=i, max_speed=30.0 + i, status="completed",
+            ))
+        db.add(Trip(trip_id="live", user_id="u1", start_time=start + timedelta(hours=3)))
+        await db.commit()
+
+        stats = UserStats()
+        await stats.on_trips_closed(["T0", "T1"])
+        await stats.on_trips_closed(["T1"])     # re-running is harmless
+        return await _buckets(db), await stats.get(db, "u1", "all")
+
+    buckets, totals = _with_db(body)
+    assert local_day(start) == day
+    assert buckets == [(day, 2, 10.5)]
+    assert totals["trips"] == 2 and totals["ride_days"] == 1
+    assert totals["distance_km"] == 10.5 and totals["crashes"] == 1 and totals["max_speed"] == 31.0
+    assert totals["ride_seconds"] == 3600.0
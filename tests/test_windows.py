@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.ml.windows import CH, N_CHANNELS, DeviceWindows, sample_row, sliding_windows
+from app.models.schemas import TelemetryIn
+from app.workers import inference_worker
+
+
+def _rows(n, t0=1_700_000_000.0):
+    rng = np.random.default_rng(1)
+    rows = rng.normal(size=(n, N_CHANNELS))
+    rows[:, CH["t"]] = t0 + 0.2 * np.arange(n)
+    return rows
+
+
+def test_gather_matches_the_offline_windows():
+    rows = _rows(23)
+    windows = DeviceWindows(window=8, initial_slots=2)
+    for row in rows:
+        windows.push("a", row)
+    slots = windows.take_dirty()
+    live = windows.gather(slots)
+    offline = sliding_windows(rows, window=8)
+    np.testing.assert_array_equal(live[0], offline[-1])
+    assert live[0, -1, CH["t"]] == 0.0 and live[0, 0, CH["t"]] < 0.0
+
+
+def test_only_full_windows_are_dirty_and_taking_clears_them():
+    windows = DeviceWindows(window=4, initial_slots=2)
+    for row in _rows(3):
+        windows.push("a", row)
+    assert len(windows.take_dirty()) == 0
+    windows.push("a", _rows(1)[0])
+    assert windows.device_of(windows.take_dirty()) == ["a"]
+    assert len(windows.take_dirty()) == 0
+
+
+def test_slots_grow_and_are_reused_after_eviction():
+    windows = DeviceWindows(window=2, initial_slots=2)
+    for device_id in ("a", "b", "c"):
+        windows.push(device_id, _rows(1)[0])
+    assert len(windows.head) == 4 and len(windows.slots) == 3
+
+    windows.evict_idle(now=float("inf"))
+    assert windows.slots == {} and len(windows.free) == 4
+    slot = windows.push("d", _rows(1)[0])
+    assert windows.count[slot] == 1 and windows.devices[slot] == "d"
+
+
+def test_sliding_windows_stride_and_short_input():
+    rows = _rows(10)
+    assert sliding_windows(rows, window=4, stride=3).shape == (3, 4, N_CHANNELS)
+    assert sliding_windows(rows[:3], window=4).shape == (0, 4, N_CHANNELS)
+
+
+def _telemetry(t, gps_ok=True, lat=33.85, lng=35.86):
+    return TelemetryIn.model_validate({
+        "ts": datetime(2025, 1, 1, 12) + timedelta(seconds=t),
+        "type": "telemetry",
+        "device_id": "windows-test",
+        "helmet_on": True,
+        "heart_rate": {"ok": True, "ir": 1, "red": 1, "finger": True, "hr": 80, "spo2": 97},
+        "imu": {"ok": True, "sleep": False, "ax": 0.1, "ay": 0.1, "az": 9.8, "gx": 1, "gy": 1, "gz": 1},
+        "gps": {"ok": gps_ok, "lat": lat, "lng": lng, "alt": 0, "sats": 8, "lock": gps_ok},
+        "crash_flag": False,
+    })
+
+
+def test_invalid_fixes_enter_the_window_as_nan():
+    windows = inference_worker._WINDOWS
+    inference_worker.feed_inference(_telemetry(0))
+    slot = windows.slots["windows-test"]
+    assert windows.newest(slot)[CH["lat"]] == 33.85
+    inference_worker.feed_inference(_telemetry(1, gps_ok=False))
+    assert np.isnan(windows.newest(slot)[[CH["lat"], CH["lng"]]]).all()
+    inference_worker.feed_inference(_telemetry(2, lat=0.0, lng=0.0))
+    assert np.isnan(windows.newest(slot)[CH["lat"]])
+    windows.evict_idle(now=float("inf"))
+
+
+def test_sample_row_order():
+    row = sample_row(1.0, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+    assert [row[CH[c]] for c in ("t", "hr", "lat", "lng")] == [1.0, 8, 9, 10]